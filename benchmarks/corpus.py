@@ -0,0 +1,262 @@
+"""
+Deterministic synthetic PDF corpus for the benchmark suite.
+
+Documents are laid out with matplotlib: A4 pages with one or two text
+columns, paragraphs of filler words and figures (line, bar, scatter, image
+and multi-panel plots) captioned "Fig. N. ..." either below or above. The
+text is embedded as TrueType so pdftohtml can extract it, and every PDF is
+written next to a JSON file with the ground truth:
+
+    {"pages": 4, "page_size": [595.3, 841.9], "columns": 2,
+     "figures": [{"page": 1, "bbox": [x, y, w, h], "caption": "Fig. 1. ...",
+                  "caption_bbox": [x, y, w, h], "caption_position": "below"}]}
+
+Boxes are in PDF points with the origin at the top left of the page.
+The same seed always produces byte-identical files.
+
+Usage:
+    python benchmarks/corpus.py OUTPUT_DIR [--docs 6] [--seed 0]
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+import matplotlib
+
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+
+PAGE_SIZE = (595.3, 841.9)  # A4 in points
+MARGIN = 54
+COLUMN_GAP = 18
+FONT_SIZE = 9
+LINE_HEIGHT = 11
+CAPTION_GAP = 10  # points between a figure and its caption
+PAGE_COUNTS = (1, 3, 8, 12)
+
+WORDS = (
+    "the of and a to in is that for it as was with be by on not he this are or his from "
+    "at which but have an they you were their one all we can her has there been if more "
+    "when will would who so no measured results show model data sample method analysis "
+    "signal response ratio value observed increase decrease level rate cell protein "
+    "pathway energy expression function system structure effect control baseline"
+).split()
+
+
+def _words(rng, count):
+    return ' '.join(WORDS[i] for i in rng.integers(len(WORDS), size=count))
+
+
+def _draw_line(ax, rng):
+    x = np.linspace(0, 10, 100)
+    for _ in range(int(rng.integers(1, 4))):
+        ax.plot(x, np.sin(x * rng.uniform(0.5, 2)) * rng.uniform(0.5, 2) + rng.normal(0, 0.1, x.size))
+    ax.set_xlabel('time')
+
+
+def _draw_bar(ax, rng):
+    count = int(rng.integers(3, 8))
+    ax.bar(np.arange(count), rng.uniform(1, 10, count))
+    ax.set_ylabel('value')
+
+
+def _draw_scatter(ax, rng):
+    ax.scatter(rng.normal(0, 1, 80), rng.normal(0, 1, 80), s=6)
+
+
+def _draw_image(ax, rng):
+    ax.imshow(rng.random((24, 32)), cmap='viridis', aspect='auto')
+
+
+FIGURE_KINDS = (_draw_line, _draw_bar, _draw_scatter, _draw_image)
+
+
+def _box_in_points(bbox, page_height):
+    """Matplotlib display box (points, origin bottom left) to (x, y, w, h) with a top-left origin."""
+    return [round(bbox.x0, 2), round(page_height - bbox.y1, 2), round(bbox.width, 2), round(bbox.height, 2)]
+
+
+class _PageLayout:
+    """Places paragraphs and figures top to bottom, column by column."""
+
+    def __init__(self, fig, columns):
+        self.fig = fig
+        self.columns = columns
+        self.width = (PAGE_SIZE[0] - 2 * MARGIN - (columns - 1) * COLUMN_GAP) / columns
+        self.column = 0
+        self.y = MARGIN  # from the top
+
+    @property
+    def x(self):
+        return MARGIN + self.column * (self.width + COLUMN_GAP)
+
+    def fits(self, height):
+        return self.y + height <= PAGE_SIZE[1] - MARGIN
+
+    def next_column(self):
+        self.column += 1
+        self.y = MARGIN
+        return self.column < self.columns
+
+    def text(self, x, y_top, content, **kwargs):
+        return self.fig.text(x / PAGE_SIZE[0], 1 - y_top / PAGE_SIZE[1], content,
+                             fontsize=FONT_SIZE, va='top', ha='left', **kwargs)
+
+    def paragraph(self, rng, lines):
+        chars_per_line = int(self.width / (FONT_SIZE * 0.5))
+        for _ in range(lines):
+            if not self.fits(LINE_HEIGHT):
+                return
+            line = _words(rng, 30)[:chars_per_line].rsplit(' ', 1)[0]
+            self.text(self.x, self.y, line)
+            self.y += LINE_HEIGHT
+        self.y += LINE_HEIGHT
+
+
+def _place_figure(layout, rng, number, position):
+    """Draw one captioned figure at the layout cursor and return its ground truth."""
+    height = float(rng.integers(130, 210))
+    caption_height = LINE_HEIGHT + CAPTION_GAP
+    if not layout.fits(height + caption_height + 2 * LINE_HEIGHT):
+        if not layout.next_column():
+            return None
+
+    width = layout.width * float(rng.uniform(0.7, 1.0))
+    # Leave room for tick and axis labels, which are drawn outside the axes
+    left, bottom, top = 34, 28, 6
+    top_y = layout.y + (caption_height if position == 'above' else 0)
+    panels = 2 if rng.random() < 0.25 else 1
+    panel_gap = 40
+    panel_width = (width - left - (panels - 1) * panel_gap) / panels
+
+    axes = []
+    for panel in range(panels):
+        rect = (
+            (layout.x + left + panel * (panel_width + panel_gap)) / PAGE_SIZE[0],
+            1 - (top_y + height - bottom) / PAGE_SIZE[1],
+            panel_width / PAGE_SIZE[0],
+            (height - bottom - top) / PAGE_SIZE[1]
+        )
+        ax = layout.fig.add_axes(rect)
+        FIGURE_KINDS[int(rng.integers(len(FIGURE_KINDS)))](ax, rng)
+        ax.tick_params(labelsize=7)
+        axes.append(ax)
+
+    renderer = layout.fig.canvas.get_renderer()
+    extents = [ax.get_tightbbox(renderer) for ax in axes]
+    x0 = min(e.x0 for e in extents)
+    x1 = max(e.x1 for e in extents)
+    y0 = min(e.y0 for e in extents)
+    y1 = max(e.y1 for e in extents)
+    figure_box = [round(x0, 2), round(PAGE_SIZE[1] - y1, 2), round(x1 - x0, 2), round(y1 - y0, 2)]
+
+    chars = int(layout.width / (FONT_SIZE * 0.5)) - 12
+    caption = f"Fig. {number}. " + _words(rng, 12)[:chars].rsplit(' ', 1)[0]
+    if position == 'below':
+        caption_y = figure_box[1] + figure_box[3] + CAPTION_GAP
+    else:
+        caption_y = figure_box[1] - CAPTION_GAP - LINE_HEIGHT
+    caption_text = layout.text(layout.x, caption_y, caption)
+    caption_box = _box_in_points(caption_text.get_window_extent(renderer), PAGE_SIZE[1])
+
+    layout.y = max(figure_box[1] + figure_box[3], caption_box[1] + caption_box[3]) + 2 * LINE_HEIGHT
+    return {
+        'bbox': figure_box,
+        'caption': caption,
+        'caption_bbox': caption_box,
+        'caption_position': position
+    }
+
+
+def generate_document(path, rng, pages, columns):
+    """
+    Write one synthetic PDF and its ground truth.
+
+    Args:
+        path (str): Output PDF path; the truth goes to the same path with .json
+        rng (numpy.random.Generator): Source of all layout decisions
+        pages (int): Number of pages
+        columns (int): Text columns per page, 1 or 2
+
+    Returns:
+        dict: Ground truth as written to the JSON file
+    """
+    truth = {'pages': pages, 'page_size': list(PAGE_SIZE), 'columns': columns, 'figures': []}
+    number = 0
+    # No creation date, so the same seed gives the same bytes
+    with PdfPages(path, metadata={'CreationDate': None}) as pdf:
+        for page in range(1, pages + 1):
+            fig = plt.figure(figsize=(PAGE_SIZE[0] / 72, PAGE_SIZE[1] / 72), dpi=72)
+            layout = _PageLayout(fig, columns)
+            figures_left = int(rng.integers(0, 2 * columns + 1))
+            while True:
+                layout.paragraph(rng, int(rng.integers(3, 9)))
+                if not layout.fits(LINE_HEIGHT * 3):
+                    if not layout.next_column():
+                        break
+                    continue
+                if figures_left:
+                    position = 'below' if rng.random() < 0.75 else 'above'
+                    placed = _place_figure(layout, rng, number + 1, position)
+                    if placed is None:
+                        break
+                    number += 1
+                    figures_left -= 1
+                    truth['figures'].append({'page': page, **placed})
+            pdf.savefig(fig)
+            plt.close(fig)
+
+    with open(os.path.splitext(path)[0] + '.json', 'w', encoding='utf-8') as f:
+        json.dump(truth, f, indent=2)
+    return truth
+
+
+def generate_corpus(output_dir, docs=6, seed=0):
+    """
+    Generate a corpus of synthetic PDFs.
+
+    Page counts cycle through PAGE_COUNTS and documents alternate between
+    one and two columns; everything else is drawn from the seed.
+
+    Args:
+        output_dir (str): Directory for the PDFs and truth files
+        docs (int): Number of documents
+        seed (int): Random seed
+
+    Returns:
+        list: Paths of the generated PDFs
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    plt.rcParams['pdf.fonttype'] = 42
+    rng = np.random.default_rng(seed)
+    paths = []
+    for index in range(docs):
+        path = os.path.join(output_dir, f'synthetic_{index:03d}.pdf')
+        generate_document(path, rng, PAGE_COUNTS[index % len(PAGE_COUNTS)], 1 + index % 2)
+        paths.append(path)
+    return paths
+
+
+def load_truth(pdf_path):
+    """Ground truth written next to a generated PDF."""
+    with open(os.path.splitext(pdf_path)[0] + '.json', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('output_dir')
+    parser.add_argument('--docs', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for path in generate_corpus(args.output_dir, args.docs, args.seed):
+        truth = load_truth(path)
+        print(f"{path}: {truth['pages']} pages, {len(truth['figures'])} figures")
+
+
+if __name__ == '__main__':
+    main()
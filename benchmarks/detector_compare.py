@@ -0,0 +1,164 @@
+"""
+Compare the connected-component figure detector with the original contour detector.
+
+Synthetic pages are drawn with OpenCV: paragraphs of glyph-sized marks plus
+figures that are deliberately fragmented (separate bars, scatter points,
+sub-panels split by white gutters). Each detector is timed over the same pages
+and scored on recall and precision against the known figure boxes.
+
+Usage:
+    python benchmarks/detector_compare.py [--pages 40] [--seed 0] [--batch 8]
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from figextractor.core.detector import detect_figure_boxes, detect_figure_boxes_batch
+from figextractor.core.figure_extractor import FigureExtractor
+
+PAGE_SHAPE = (1754, 1240)  # A4 at 150 DPI
+MIN_FIGURE_SIZE = 100
+
+
+def _draw_paragraph(page, rng, x, y, width, lines):
+    """Draw lines of glyph-sized marks and return the bottom edge."""
+    for line in range(lines):
+        cursor = x
+        top = y + line * 22
+        while cursor < x + width - 12:
+            glyph_width = int(rng.integers(5, 11))
+            cv2.rectangle(page, (cursor, top), (cursor + glyph_width, top + 13), 0, -1)
+            cursor += glyph_width + int(rng.choice([2, 2, 2, 9]))
+    return y + lines * 22
+
+
+def _draw_bar_chart(page, rng, x, y, w, h):
+    cv2.line(page, (x, y + h), (x + w, y + h), 0, 2)
+    cv2.line(page, (x, y), (x, y + h), 0, 2)
+    bars = int(rng.integers(4, 9))
+    step = (w - 20) // bars
+    for i in range(bars):
+        bar_h = int(rng.integers(h // 5, h - 10))
+        left = x + 14 + i * step
+        cv2.rectangle(page, (left, y + h - bar_h), (left + step // 2, y + h - 3), int(rng.integers(40, 200)), -1)
+        cv2.rectangle(page, (left, y + h + 6), (left + 8, y + h + 16), 0, -1)
+
+
+def _draw_scatter(page, rng, x, y, w, h):
+    # No frame: only the points and short ticks, so the plot is many small blobs
+    for _ in range(int(rng.integers(60, 150))):
+        px = int(rng.integers(x, x + w))
+        py = int(rng.integers(y, y + h))
+        cv2.circle(page, (px, py), 5, int(rng.integers(0, 150)), -1)
+    cv2.line(page, (x, y + h), (x + w, y + h), 0, 1)
+
+
+def _draw_panels(page, rng, x, y, w, h):
+    # Four sub-panels separated by white gutters
+    gutter = 16
+    pw = (w - gutter) // 2
+    ph = (h - gutter) // 2
+    for row in range(2):
+        for col in range(2):
+            px = x + col * (pw + gutter)
+            py = y + row * (ph + gutter)
+            cv2.rectangle(page, (px, py), (px + pw, py + ph), 0, 1)
+            _draw_scatter(page, rng, px + 8, py + 8, pw - 16, ph - 16)
+
+
+FIGURE_KINDS = (_draw_bar_chart, _draw_scatter, _draw_panels)
+
+
+def synthetic_page(rng):
+    """
+    Draw one grayscale page with text and figures.
+
+    Returns:
+        tuple: (page, list of ground-truth (x, y, w, h) figure boxes)
+    """
+    page = np.full(PAGE_SHAPE, 255, dtype=np.uint8)
+    truth = []
+    y = 100
+    while y < PAGE_SHAPE[0] - 400:
+        y = _draw_paragraph(page, rng, 100, y, 1040, int(rng.integers(3, 8))) + 40
+        if rng.random() < 0.7:
+            w = int(rng.integers(300, 900))
+            h = int(rng.integers(180, 320))
+            x = int(rng.integers(100, 1140 - w))
+            FIGURE_KINDS[int(rng.integers(len(FIGURE_KINDS)))](page, rng, x, y, w, h)
+            nonwhite = np.argwhere(page[y - 5:y + h + 25, x - 5:x + w + 5] < 240)
+            y0, x0 = nonwhite.min(axis=0)
+            y1, x1 = nonwhite.max(axis=0)
+            truth.append((x - 5 + x0, y - 5 + y0, x1 - x0 + 1, y1 - y0 + 1))
+            y += h + 60
+    return page, truth
+
+
+def _iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / (aw * ah + bw * bh - inter)
+
+
+def score(predicted, truth, min_iou=0.5):
+    """Count true positives, predictions and ground-truth boxes for one page."""
+    hits = sum(1 for t in truth if any(_iou(t, p) >= min_iou for p in predicted))
+    correct = sum(1 for p in predicted if any(_iou(t, p) >= min_iou for t in truth))
+    return hits, correct, len(predicted), len(truth)
+
+
+def run(pages, batch):
+    legacy = FigureExtractor(min_figure_size=MIN_FIGURE_SIZE, detector='contours')
+    engines = {
+        'contours': lambda grays: [legacy._detect_contour_boxes(g) for g in grays],
+        'components': lambda grays: [detect_figure_boxes(g, MIN_FIGURE_SIZE) for g in grays],
+        'components-batch': lambda grays: [
+            boxes
+            for start in range(0, len(grays), batch)
+            for boxes in detect_figure_boxes_batch(grays[start:start + batch], MIN_FIGURE_SIZE)
+        ],
+    }
+
+    grays = [page for page, _ in pages]
+    truths = [truth for _, truth in pages]
+
+    print(f"{'detector':<18}{'pages/s':>10}{'recall':>10}{'precision':>11}")
+    for name, engine in engines.items():
+        start = time.perf_counter()
+        predictions = engine(grays)
+        elapsed = time.perf_counter() - start
+
+        totals = np.zeros(4)
+        for predicted, truth in zip(predictions, truths):
+            totals += score([tuple(p) for p in predicted], truth)
+        hits, correct, num_predicted, num_truth = totals
+        recall = hits / num_truth if num_truth else 1.0
+        precision = correct / num_predicted if num_predicted else 1.0
+        print(f"{name:<18}{len(grays) / elapsed:>10.1f}{recall:>10.3f}{precision:>11.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch', type=int, default=8)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    pages = [synthetic_page(rng) for _ in range(args.pages)]
+    run(pages, args.batch)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,470 @@
+"""
+Benchmark the extraction pipeline on a synthetic PDF corpus.
+
+The corpus (see corpus.py) is generated from a seed, so every run measures
+the same documents. Each stage is timed on its own and end to end:
+
+    render      renderer.render_pdf
+    detect      FigureExtractor figure detection on rendered pages
+    html        pdftohtml conversion
+    captions    caption extraction from the xpdf HTML
+    end_to_end  pdf_processor.process_pdf with the cache disabled
+    page_memory Python-visible memory allocated per page between rendering
+                and saved figures, for the current page path and the legacy
+                one (PIL page -> array -> BGR -> gray, RGB copy per crop)
+
+For each benchmark the best of --repeat runs is reported as pages/s and
+figures/s together with the peak RSS while it ran. Detection, caption and
+figure-caption matching accuracy are scored against the ground truth.
+
+Results are written as JSON to --output. With --compare, the run is checked
+against an earlier result file and the script exits with status 1 when
+throughput drops or memory grows by more than --threshold, or an accuracy
+score drops by more than --accuracy-tolerance.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--docs 6] [--seed 0] [--repeat 3]
+        [--output benchmarks/results] [--compare benchmarks/results/baseline.json]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+import numpy as np
+import cv2
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import Config
+from figextractor.core.renderer import render_pdf
+from figextractor.core.figure_extractor import FigureExtractor, page_planes
+from figextractor.core.records import FigureRecord
+from figextractor.core.caption_parser import detect_page_captions
+from figextractor.core.pdf_processor import process_pdf, convert_to_html
+from figextractor.core.cache import tool_versions
+from figextractor.utils.metrics import peak_rss, reset_peak_rss
+
+from corpus import generate_corpus, load_truth
+
+RESULTS_VERSION = 1
+MIN_IOU = 0.5
+
+# Direction in which each reported value gets worse
+THROUGHPUT_KEYS = ('pages_per_second', 'figures_per_second')
+MEMORY_KEYS = ('peak_rss_mb', 'page_copies', 'peak_extra_mb_per_page')
+ACCURACY_KEYS = ('recall', 'precision', 'caption_recall', 'caption_precision', 'match_accuracy')
+
+
+def _iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / (aw * ah + bw * bh - inter)
+
+
+def _truth_boxes(truth, page, scale):
+    """Ground-truth figures of a page with boxes scaled from points to raster pixels."""
+    return [
+        (tuple(v * scale for v in figure['bbox']), figure)
+        for figure in truth['figures'] if figure['page'] == page
+    ]
+
+
+def _caption_label(text):
+    """'Fig. 3.' part of a caption, which identifies it."""
+    return ' '.join(text.split()[:2])
+
+
+class _Run:
+    """Accumulates timed sections and counts for one benchmark repetition."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.pages = 0
+        self.figures = 0
+
+    def timed(self, fn, *args, **kwargs):
+        cpu = time.process_time()
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.cpu_seconds += time.process_time() - cpu
+
+
+def _report(runs, peak, scores=None):
+    """Best repetition as a result record."""
+    best = min(runs, key=lambda run: run.seconds)
+    record = {
+        'seconds': round(best.seconds, 4),
+        'cpu_seconds': round(best.cpu_seconds, 4),
+        'pages': best.pages,
+        'figures': best.figures,
+        'pages_per_second': round(best.pages / best.seconds, 3) if best.seconds else None,
+        'figures_per_second': round(best.figures / best.seconds, 3) if best.seconds else None,
+        'peak_rss_mb': round(peak / 2 ** 20, 1) if peak else None
+    }
+    record.update(scores or {})
+    return record
+
+
+def _measure(repeat, body):
+    """Run body(run) repeat times, tracking the peak RSS across all repetitions."""
+    reset_peak_rss()
+    runs = []
+    scores = None
+    for _ in range(repeat):
+        run = _Run()
+        scores = body(run)
+        runs.append(run)
+    return _report(runs, peak_rss(), scores)
+
+
+def bench_render(pdf_paths, repeat):
+    def body(run):
+        for pdf_path in pdf_paths:
+            pages = run.timed(render_pdf, pdf_path, Config.DPI)
+            run.pages += len(pages)
+    return _measure(repeat, body)
+
+
+def bench_detect(pdf_paths, repeat):
+    extractor = FigureExtractor()
+    scale = Config.DPI / 72
+
+    def body(run):
+        hits = correct = predicted = expected = 0
+        for pdf_path in pdf_paths:
+            truth = load_truth(pdf_path)
+            for page_num, page in enumerate(render_pdf(pdf_path, Config.DPI), 1):
+                figures = run.timed(extractor._detect_figures, page, 'RGB')
+                boxes = [figure.bbox for figure in figures]
+                truth_boxes = [box for box, _ in _truth_boxes(truth, page_num, scale)]
+                hits += sum(1 for t in truth_boxes if any(_iou(t, p) >= MIN_IOU for p in boxes))
+                correct += sum(1 for p in boxes if any(_iou(t, p) >= MIN_IOU for t in truth_boxes))
+                predicted += len(boxes)
+                expected += len(truth_boxes)
+                run.pages += 1
+                run.figures += len(boxes)
+        return {
+            'recall': round(hits / expected, 4) if expected else 1.0,
+            'precision': round(correct / predicted, 4) if predicted else 1.0
+        }
+    return _measure(repeat, body)
+
+
+def _current_page_pass(extractor, page):
+    """Detect and encode one page the way the pipeline does; returns the bytes held after conversion."""
+    page, gray, channel_order = page_planes(page)
+    held = tracemalloc.get_traced_memory()[0]
+    for box in extractor._detect_figure_boxes(gray):
+        FigureRecord(box, page, channel_order).encode('.jpg')
+    return held
+
+
+def _legacy_page_pass(extractor, page_image):
+    """The per-page path before pages were kept in one buffer, for comparison."""
+    image = np.array(page_image)
+    cv_image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
+    held = tracemalloc.get_traced_memory()[0]
+    for x, y, w, h in extractor._detect_figure_boxes(gray):
+        crop = Image.fromarray(cv2.cvtColor(cv_image[y:y+h, x:x+w], cv2.COLOR_BGR2RGB))
+        crop.save(io.BytesIO(), 'JPEG')
+    return held
+
+
+def bench_page_memory(pdf_paths):
+    """
+    Memory allocated per page from the rendered page to the encoded figures.
+
+    Allocations are traced with tracemalloc, which sees NumPy and OpenCV
+    output arrays but not the renderer's or encoders' internal buffers.
+    page_copies is the memory held once the page is ready for detection, in
+    units of the rendered page; peak_extra_mb_per_page is the mean peak on top
+    of the rendered page over detection and encoding.
+
+    Returns:
+        dict: Result record with the current and legacy ('legacy_' prefix) figures
+    """
+    extractor = FigureExtractor()
+    totals = {'current': [0.0, 0.0], 'legacy': [0.0, 0.0]}
+    pages = 0
+    page_bytes = 0
+    for pdf_path in pdf_paths:
+        for page in render_pdf(pdf_path, Config.DPI):
+            pages += 1
+            page_bytes += page.nbytes
+            for name, page_pass, source in (('current', _current_page_pass, page),
+                                            ('legacy', _legacy_page_pass, Image.fromarray(page))):
+                tracemalloc.start()
+                try:
+                    held = page_pass(extractor, source)
+                    peak = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+                totals[name][0] += held / page.nbytes
+                totals[name][1] += peak / 2 ** 20
+
+    record = {'pages': pages, 'page_mb': round(page_bytes / pages / 2 ** 20, 2) if pages else None}
+    for name, prefix in (('current', ''), ('legacy', 'legacy_')):
+        copies, peak_mb = totals[name]
+        record[f'{prefix}page_copies'] = round(copies / pages, 2) if pages else None
+        record[f'{prefix}peak_extra_mb_per_page'] = round(peak_mb / pages, 2) if pages else None
+    return record
+
+
+def bench_html(pdf_paths, repeat, work_dir):
+    def body(run):
+        for pdf_path in pdf_paths:
+            html_dir = os.path.join(work_dir, os.path.splitext(os.path.basename(pdf_path))[0])
+            run.timed(convert_to_html, pdf_path, html_dir)
+            run.pages += load_truth(pdf_path)['pages']
+    return _measure(repeat, body)
+
+
+def bench_captions(pdf_paths, repeat, work_dir):
+    def body(run):
+        found = correct = detected = expected = 0
+        for pdf_path in pdf_paths:
+            truth = load_truth(pdf_path)
+            html_dir = os.path.join(work_dir, os.path.splitext(os.path.basename(pdf_path))[0])
+            for page_num in range(1, truth['pages'] + 1):
+                html_path = os.path.join(html_dir, f'page{page_num}.html')
+                captions, _ = run.timed(detect_page_captions, html_path)
+                labels = {_caption_label(c['text']) for c in captions}
+                truth_labels = {_caption_label(f['caption']) for f in truth['figures'] if f['page'] == page_num}
+                found += len(truth_labels & labels)
+                correct += sum(1 for c in captions if _caption_label(c['text']) in truth_labels)
+                detected += len(captions)
+                expected += len(truth_labels)
+                run.pages += 1
+                run.figures += len(captions)
+        return {
+            'caption_recall': round(found / expected, 4) if expected else 1.0,
+            'caption_precision': round(correct / detected, 4) if detected else 1.0
+        }
+    return _measure(repeat, body)
+
+
+def bench_end_to_end(pdf_paths, repeat):
+    scale = Config.DPI / 72
+
+    def body(run):
+        matched = expected = 0
+        for pdf_path in pdf_paths:
+            truth = load_truth(pdf_path)
+            data = run.timed(process_pdf, pdf_path)
+            figures = next(iter(data.values()))['figures']
+            run.pages += truth['pages']
+            run.figures += len(figures)
+
+            # A figure is matched when the figure overlapping it carries its caption
+            for page_num in range(1, truth['pages'] + 1):
+                predicted = [f for f in figures if f['page'] == page_num]
+                for box, figure in _truth_boxes(truth, page_num, scale):
+                    expected += 1
+                    best = max(predicted, key=lambda f: _iou(box, f['region_bb']), default=None)
+                    if (best is not None and _iou(box, best['region_bb']) >= MIN_IOU
+                            and _caption_label(best['caption_text']) == _caption_label(figure['caption'])):
+                        matched += 1
+        return {'match_accuracy': round(matched / expected, 4) if expected else 1.0}
+    return _measure(repeat, body)
+
+
+def _git_commit():
+    try:
+        completed = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                   capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return completed.stdout.strip() or None
+
+
+def environment():
+    """Versions and settings a result depends on."""
+    import matplotlib
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'matplotlib': matplotlib.__version__,
+        'tools': tool_versions(),
+        'commit': _git_commit(),
+        'settings': {
+            'dpi': Config.DPI,
+            'render_transport': Config.RENDER_TRANSPORT,
+            'page_workers': Config.PAGE_WORKERS,
+            'page_selection': Config.PAGE_SELECTION,
+            'figure_detector': Config.FIGURE_DETECTOR,
+            'caption_backend': Config.CAPTION_BACKEND,
+            'figure_format': Config.FIGURE_FORMAT
+        }
+    }
+
+
+def run_suite(pdf_paths, repeat, work_dir, only=None):
+    """
+    Run the benchmarks on a corpus.
+
+    Args:
+        pdf_paths (list): Generated PDFs with ground truth next to them
+        repeat (int): Repetitions per benchmark; the fastest is reported
+        work_dir (str): Scratch directory for HTML and extraction output
+        only (list, optional): Names of the benchmarks to run
+
+    Returns:
+        dict: Result record per benchmark name
+    """
+    html_dir = os.path.join(work_dir, 'html')
+    benchmarks = {
+        'render': lambda: bench_render(pdf_paths, repeat),
+        'detect': lambda: bench_detect(pdf_paths, repeat),
+        'html': lambda: bench_html(pdf_paths, repeat, html_dir),
+        'captions': lambda: bench_captions(pdf_paths, repeat, html_dir),
+        'end_to_end': lambda: bench_end_to_end(pdf_paths, repeat),
+        'page_memory': lambda: bench_page_memory(pdf_paths),
+    }
+    results = {}
+    for name, bench in benchmarks.items():
+        if only and name not in only:
+            continue
+        if name == 'captions' and not os.path.isdir(html_dir):
+            # Caption extraction reads the HTML written by the html benchmark
+            bench_html(pdf_paths, 1, html_dir)
+        results[name] = bench()
+        if name == 'page_memory':
+            result = results[name]
+            print(f"{name:<12}{result['page_copies']:>10.2f} page copies, {result['peak_extra_mb_per_page']:.1f} MB peak/page"
+                  f" (legacy {result['legacy_page_copies']:.2f}, {result['legacy_peak_extra_mb_per_page']:.1f} MB)")
+            continue
+        print(f"{name:<12}{results[name]['pages_per_second'] or 0:>10.2f} pages/s"
+              f"{results[name]['peak_rss_mb'] or 0:>10.1f} MB" +
+              ''.join(f"  {key}={results[name][key]}" for key in ACCURACY_KEYS if key in results[name]))
+    return results
+
+
+def compare(current, baseline, threshold, accuracy_tolerance):
+    """
+    Find regressions of a run against a baseline run.
+
+    Args:
+        current (dict): Result file contents of this run
+        baseline (dict): Result file contents of the baseline run
+        threshold (float): Allowed relative throughput drop or memory growth, e.g. 0.15
+        accuracy_tolerance (float): Allowed absolute accuracy drop
+
+    Returns:
+        list: Human readable regression descriptions
+    """
+    regressions = []
+    for name, result in current['benchmarks'].items():
+        reference = baseline.get('benchmarks', {}).get(name)
+        if not reference:
+            continue
+        for key in THROUGHPUT_KEYS:
+            old, new = reference.get(key), result.get(key)
+            if old and new is not None and new < old * (1 - threshold):
+                regressions.append(f"{name}.{key}: {new} < {old} (-{(1 - new / old) * 100:.1f}%)")
+        for key in MEMORY_KEYS:
+            old, new = reference.get(key), result.get(key)
+            if old and new is not None and new > old * (1 + threshold):
+                regressions.append(f"{name}.{key}: {new} > {old} (+{(new / old - 1) * 100:.1f}%)")
+        for key in ACCURACY_KEYS:
+            old, new = reference.get(key), result.get(key)
+            if old is not None and new is not None and new < old - accuracy_tolerance:
+                regressions.append(f"{name}.{key}: {new} < {old}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--docs', type=int, default=6, help="documents in the corpus")
+    parser.add_argument('--seed', type=int, default=0, help="corpus seed")
+    parser.add_argument('--repeat', type=int, default=3, help="repetitions per benchmark")
+    parser.add_argument('--only', nargs='+', help="benchmarks to run")
+    parser.add_argument('--corpus', help="directory to generate the corpus in (kept after the run)")
+    parser.add_argument('--output', default=os.path.join(ROOT, 'benchmarks', 'results'),
+                        help="directory for result files")
+    parser.add_argument('--compare', help="result file to check this run against")
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="allowed relative throughput drop or memory growth")
+    parser.add_argument('--accuracy-tolerance', type=float, default=0.02,
+                        help="allowed absolute accuracy drop")
+    parser.add_argument('--xpdf', default=Config.XPDF_PATH, help="pdftohtml executable")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='figextractor-bench-')
+    try:
+        # Keep benchmark output and caching out of the regular directories
+        Config.XPDF_PATH = args.xpdf
+        Config.OUTPUT_DIR = os.path.join(work_dir, 'output')
+        Config.TEMP_DIR = os.path.join(work_dir, 'temp')
+        Config.CACHE_ENABLED = False
+        Config.METRICS_ENABLED = False
+        os.makedirs(Config.OUTPUT_DIR)
+        os.makedirs(Config.TEMP_DIR)
+
+        corpus_dir = args.corpus or os.path.join(work_dir, 'corpus')
+        pdf_paths = generate_corpus(corpus_dir, args.docs, args.seed)
+        truths = [load_truth(path) for path in pdf_paths]
+        print(f"Corpus: {len(pdf_paths)} documents, {sum(t['pages'] for t in truths)} pages, "
+              f"{sum(len(t['figures']) for t in truths)} figures")
+
+        results = {
+            'version': RESULTS_VERSION,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'corpus': {
+                'docs': args.docs,
+                'seed': args.seed,
+                'pages': sum(t['pages'] for t in truths),
+                'figures': sum(len(t['figures']) for t in truths)
+            },
+            'repeat': args.repeat,
+            'environment': environment(),
+            'benchmarks': run_suite(pdf_paths, args.repeat, work_dir, args.only)
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    os.makedirs(args.output, exist_ok=True)
+    commit = results['environment']['commit'] or 'nocommit'
+    result_path = os.path.join(args.output, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(result_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {result_path}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('corpus') != results['corpus']:
+            print("Warning: baseline was measured on a different corpus")
+        regressions = compare(results, baseline, args.threshold, args.accuracy_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,18 +8,177 @@ class Config:
     INPUT_DIR = os.path.join(BASE_DIR, "input")
     OUTPUT_DIR = os.path.join(BASE_DIR, "output")
     TEMP_DIR = os.path.join(BASE_DIR, "temp")
+    CACHE_DIR = os.path.join(BASE_DIR, "cache")
     
     # Tool paths
     XPDF_PATH = os.path.join(BASE_DIR, "tools", "xpdf-tools", "bin64", "pdftohtml.exe")
+    PDFINFO_PATH = os.path.join(BASE_DIR, "tools", "xpdf-tools", "bin64", "pdfinfo.exe")
     IMAGEMAGICK_PATH = os.path.join(BASE_DIR, "tools", "imagemagick", "magick.exe")
     CHROME_DRIVER_PATH = os.path.join(BASE_DIR, "tools", "chromedriver", "chromedriver.exe")
     
+    # External tools (gs, magick, pdftohtml, pdfinfo) run supervised: renderers
+    # are killed after TOOL_TIMEOUT seconds per page, pdftohtml after
+    # HTML_TIMEOUT seconds per call, and (POSIX) each tool is limited to
+    # TOOL_MEMORY_LIMIT_MB of address space and TOOL_CPU_LIMIT_SECONDS of CPU
+    # (None for no limit). A call that times out, crashes or runs out of memory
+    # is retried TOOL_RETRIES times, renders at TOOL_RETRY_DPI_SCALE times the DPI
+    TOOL_TIMEOUT = 120
+    HTML_TIMEOUT = 600
+    TOOL_MEMORY_LIMIT_MB = 4096
+    TOOL_CPU_LIMIT_SECONDS = None
+    TOOL_RETRIES = 1
+    TOOL_RETRY_DPI_SCALE = 0.5
+    
     # Processing settings
     DPI = 150
     RASTER_SCALE = 3
+    RENDER_TRANSPORT = "pipe"  # "pipe": raw PPM over stdout, "png": temp PNG files
+    RENDER_CHUNK_PAGES = 8  # pages rasterised per renderer call in "png" mode
+    
+    # Two-pass rendering: when set (below DPI), pages are rendered at this DPI
+    # for detection and each detected figure is re-rendered alone at DPI.
+    # Below ~100 DPI text starts to merge into figure-sized components, so
+    # e.g. DPI = 300 with DETECTION_DPI = 100
+    DETECTION_DPI = None
+    
+    # Tiled pages: pages with more than TILE_PIXEL_BUDGET pixels at the render
+    # DPI (posters, maps, engineering drawings) are rendered and detected in
+    # full-width bands of at most TILE_PIXELS gray pixels, and their figures
+    # are rendered alone like in two-pass mode. Needs pdfinfo for page sizes
+    # (not run when it is missing); 0 disables tiling
+    TILE_PIXEL_BUDGET = 50_000_000
+    TILE_PIXELS = 16_000_000
+    
+    # Page selection: "all" renders every page, "captions" reads the text layer
+    # first and renders only pages with a caption candidate plus
+    # PAGE_SELECTION_MARGIN neighbouring pages on each side
+    PAGE_SELECTION = "all"
+    PAGE_SELECTION_MARGIN = 0
+    
+    # Batch settings
+    WORKERS = 1
+    RETRIES = 0
+    
+    # Pages of one PDF processed concurrently by threads of a worker; figure
+    # detection and caption parsing of the next pages overlap while the
+    # renderer produces later ones. WORKERS * PAGE_WORKERS should not exceed
+    # the core count
+    PAGE_WORKERS = 1
+    
+    # Sharded HTML conversion: with HTML_WORKERS above 1, documents longer than
+    # HTML_SHARD_PAGES are converted by that many concurrent pdftohtml calls
+    # over page ranges, and captions are read as each range finishes
+    # ('lxml' caption backend only)
+    HTML_WORKERS = 1
+    HTML_SHARD_PAGES = 16
+    
+    # Checkpoints: progress manifests updated as pages finish; RESUME skips
+    # finished PDFs and pages instead of starting over
+    CHECKPOINTS = True
+    RESUME = False
+    
+    # Daemon mode (main.py --daemon): INPUT_DIR is scanned every
+    # WATCH_POLL_INTERVAL seconds, a PDF is queued once its size and mtime
+    # have not changed for WATCH_SETTLE_SECONDS, at most WATCH_QUEUE_SIZE PDFs
+    # wait for a worker, and daemon_status.json is rewritten every
+    # WATCH_STATUS_INTERVAL seconds
+    WATCH_POLL_INTERVAL = 2.0
+    WATCH_SETTLE_SECONDS = 5.0
+    WATCH_QUEUE_SIZE = 100
+    WATCH_STATUS_INTERVAL = 10.0
+    
+    # Distributed mode (main.py --distributed): nodes sharing INPUT_DIR and
+    # OUTPUT_DIR claim PDFs through lease files in QUEUE_DIR (None uses
+    # OUTPUT_DIR/queue). Held leases are renewed every LEASE_HEARTBEAT seconds
+    # and a lease not renewed for LEASE_TTL seconds is taken over by another
+    # node; PDFs held by other nodes are checked every QUEUE_POLL_INTERVAL seconds.
+    # A PDF whose lease expired LEASE_MAX_TAKEOVERS times is taken to be killing
+    # its nodes and recorded as failed (0 never gives up)
+    QUEUE_DIR = None
+    LEASE_TTL = 300.0
+    LEASE_HEARTBEAT = 30.0
+    QUEUE_POLL_INTERVAL = 10.0
+    LEASE_MAX_TAKEOVERS = 3
+    
+    # HTTP service (main.py --serve): at most SERVER_MAX_CONCURRENCY PDFs are
+    # processed at once and SERVER_QUEUE_SIZE requests wait for a worker;
+    # beyond that requests get 429. Path requests may only name PDFs under
+    # SERVER_PATH_ROOTS (None allows INPUT_DIR only). Figure URLs expire after
+    # SERVER_RESULT_TTL seconds, and so do the output folders of uploaded PDFs
+    SERVER_HOST = "127.0.0.1"
+    SERVER_PORT = 8765
+    SERVER_MAX_CONCURRENCY = 2
+    SERVER_QUEUE_SIZE = 8
+    SERVER_REQUEST_TIMEOUT = 300
+    SERVER_MAX_UPLOAD_MB = 100
+    SERVER_PATH_ROOTS = None
+    SERVER_RESULT_TTL = 3600
+    
+    # Output: figure image format ("jpeg", "png", "webp" or "none" to skip
+    # image files), encoder quality (None for the encoder default) and the
+    # background writer that encodes and writes artefacts
+    FIGURE_FORMAT = "jpeg"
+    FIGURE_QUALITY = None
+    WRITER_THREADS = 2
+    WRITER_MAX_PENDING = 32
+    WRITER_FSYNC = False
+    
+    # Corpus index: finished PDFs are written to a SQLite database with a
+    # full-text index over captions (INDEX_PATH None uses OUTPUT_DIR/index.sqlite)
+    INDEX_ENABLED = True
+    INDEX_PATH = None
+    
+    # Figure deduplication: figures whose perceptual hash is within
+    # DEDUP_MAX_DISTANCE bits (of 64) of an earlier saved figure are recorded
+    # as a reference to it instead of being written again (hashes are kept in
+    # the index database)
+    DEDUP_ENABLED = False
+    DEDUP_MAX_DISTANCE = 4
+    
+    # Result cache: results, xpdf HTML and (optionally) rendered pages are
+    # stored under CACHE_DIR keyed by PDF content and settings. Cached pages are
+    # uncompressed rasters (tens of MB per page at 300 DPI), so they are opt-in.
+    # The cache is walked to enforce CACHE_MAX_BYTES when a process's running
+    # estimate exceeds it, and every CACHE_EVICT_INTERVAL commits to count
+    # entries written by other processes
+    CACHE_ENABLED = True
+    CACHE_PAGES = False
+    CACHE_MAX_BYTES = 2 * 1024 ** 3
+    CACHE_EVICT_INTERVAL = 50
+    
+    # Caption detection backend: "lxml" parses the xpdf HTML in-process,
+    # "selenium" lays the pages out in headless Chrome
+    CAPTION_BACKEND = "lxml"
+    
+    # Figure detection: "components" merges connected components into
+    # figures, "contours" keeps the original external-contour detector
+    FIGURE_DETECTOR = "components"
+    DETECTOR_THRESHOLD = 240  # pixels darker than this are foreground
+    DETECTOR_MERGE_GAP = 24  # gap in pixels bridged between parts of one graphic
+    DETECTOR_MERGE_OVERLAP = 0.0  # overlap ratio (see compute_overlap) needed to merge
+    DETECTOR_SEED_FRACTION = 0.25  # components this fraction of min_figure_size seed figures
+    
+    # Figure-caption matching priors: cost multipliers for captions placed
+    # above their figure and for captions in a different column
+    MATCH_ABOVE_PENALTY = 1.25
+    MATCH_SIDE_PENALTY = 1.5
+    
+    # Instrumentation: per-stage wall/CPU time, peak RSS and page/figure
+    # counts, stored in each metadata.json and in a run-level file
+    # ("jsonl" or "prometheus"; METRICS_PATH None writes to OUTPUT_DIR)
+    METRICS_ENABLED = False
+    METRICS_FORMAT = "jsonl"
+    METRICS_PATH = None
     
     # Chrome options
-    CHROME_OPTIONS = ["--headless"]
+    CHROME_OPTIONS = ["--headless", "--no-sandbox", "--disable-dev-shm-usage"]
+    
+    # Chrome driver pool: drivers stay warm across PDFs and are recycled after
+    # DRIVER_MAX_PAGES pages or once their process tree grows by DRIVER_MAX_RSS_GROWTH_MB
+    DRIVER_POOL_SIZE = 1
+    DRIVER_MAX_PAGES = 500
+    DRIVER_MAX_RSS_GROWTH_MB = 512
+    DRIVER_PAGE_LOAD_TIMEOUT = 30
 
     @classmethod
     def initialize(cls):
@@ -0,0 +1,317 @@
+"""
+Batch runner that spreads PDFs over a pool of worker processes.
+"""
+
+import os
+import time
+import json
+import shutil
+import logging
+import tempfile
+import multiprocessing.util
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from .pdf_processor import process_pdf
+from .checkpoint import RunManifest
+from .index import close_default_index
+from ..utils.driver_pool import get_default_pool, close_default_pool
+from ..utils.metrics import write_run_metrics
+from ..utils.supervisor import ToolError, tool_stats, tool_stats_since, merge_tool_stats
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+ORDERS = ('name', 'size', 'size-desc', 'mtime')
+
+# Heavy resources owned by the current worker process, created once by
+# _init_worker and reused for every PDF the worker handles
+_worker_state = {}
+
+
+def _init_worker():
+    """Initialize per-worker resources: OpenCV, a private temp dir and warm Chrome drivers."""
+    import cv2
+    # Each process works on its own PDF, so keep OpenCV from spawning
+    # a thread per core inside every worker
+    cv2.setNumThreads(1)
+
+    os.makedirs(Config.TEMP_DIR, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix=f'worker-{os.getpid()}-', dir=Config.TEMP_DIR)
+    tempfile.tempdir = temp_dir
+    _worker_state['temp_dir'] = temp_dir
+
+    # process_pdf borrows from the process-wide pool, which keeps drivers
+    # alive across PDFs and recycles them when they wear out
+    if Config.CAPTION_BACKEND == 'selenium':
+        get_default_pool().warm()
+
+    # Pool workers leave through os._exit, which skips atexit handlers; the
+    # multiprocessing finalizers still run when a worker process returns
+    multiprocessing.util.Finalize(None, _shutdown_worker, exitpriority=10)
+
+
+def _shutdown_worker():
+    """Release the resources created by _init_worker and used while processing."""
+    close_default_pool()
+    close_default_index()
+
+    temp_dir = _worker_state.pop('temp_dir', None)
+    if temp_dir:
+        if tempfile.tempdir == temp_dir:
+            tempfile.tempdir = None
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _run_one(pdf_path):
+    """
+    Process one PDF inside a worker, turning any failure into a result record.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+
+    Returns:
+        dict: Result record with status, timing and figure count or error
+    """
+    start = time.perf_counter()
+    tools = tool_stats()
+    try:
+        data = process_pdf(pdf_path)
+        figures = sum(len(entry['figures']) for entry in data.values())
+        result = {
+            'pdf': pdf_path,
+            'status': 'ok',
+            'figures': figures,
+            'seconds': time.perf_counter() - start,
+            'worker': os.getpid(),
+            'tools': tool_stats_since(tools)
+        }
+        metrics = next(iter(data.values())).get('metrics')
+        if metrics:
+            result['metrics'] = metrics
+        return result
+    except Exception as e:
+        result = {
+            'pdf': pdf_path,
+            'status': 'failed',
+            'error': f"{type(e).__name__}: {str(e)}",
+            'seconds': time.perf_counter() - start,
+            'worker': os.getpid(),
+            'tools': tool_stats_since(tools)
+        }
+        if isinstance(e, ToolError):
+            result['failure'] = e.kind
+        return result
+
+
+def order_pdfs(pdf_paths, order='name'):
+    """
+    Order PDF paths for submission to the pool.
+
+    Args:
+        pdf_paths (list): Paths to PDF files
+        order (str): 'name', 'size' (smallest first), 'size-desc' (largest first) or 'mtime'
+
+    Returns:
+        list: Ordered paths
+    """
+    if order == 'name':
+        return sorted(pdf_paths)
+    if order == 'size':
+        return sorted(pdf_paths, key=os.path.getsize)
+    if order == 'size-desc':
+        return sorted(pdf_paths, key=os.path.getsize, reverse=True)
+    if order == 'mtime':
+        return sorted(pdf_paths, key=os.path.getmtime)
+    raise ValueError(f"Unknown order: {order}")
+
+
+def run_batch(pdf_paths, workers=None, order='name', retries=0, summary_path=None, metrics_path=None):
+    """
+    Process PDFs on a pool of worker processes and collect a run summary.
+
+    Args:
+        pdf_paths (list): Paths to PDF files
+        workers (int, optional): Number of worker processes. Defaults to Config.WORKERS
+        order (str): Submission order, see order_pdfs
+        retries (int): How many times a failed PDF is retried
+        summary_path (str, optional): Where to write the summary as JSON
+        metrics_path (str, optional): Run-level metrics file when Config.METRICS_ENABLED
+            is set, see metrics.write_run_metrics
+
+    Returns:
+        dict: Run summary with per-file results and totals
+    """
+    workers = workers or Config.WORKERS
+    pending = order_pdfs(pdf_paths, order)
+    attempts = {pdf_path: 0 for pdf_path in pending}
+    results = {}
+    start = time.perf_counter()
+    
+    # Record finished PDFs as they complete; on resume, skip those already done
+    manifest = RunManifest(resume=Config.RESUME) if Config.CHECKPOINTS else None
+    if manifest and Config.RESUME:
+        for pdf_path in [p for p in pending if manifest.is_done(p)]:
+            pending.remove(pdf_path)
+            results[pdf_path] = {'pdf': pdf_path, 'status': 'ok', 'skipped': True,
+                                 'figures': manifest.pdfs[os.path.abspath(pdf_path)].get('figures') or 0}
+        if results:
+            logger.info(f"Resuming: skipping {len(results)} PDFs finished by an earlier run")
+    
+    def finished(pdf_path, result):
+        results[pdf_path] = result
+        if manifest:
+            manifest.record(result)
+
+    if workers <= 1:
+        _init_worker()
+        try:
+            while pending:
+                pdf_path = pending.pop(0)
+                attempts[pdf_path] += 1
+                result = _run_one(pdf_path)
+                if _should_retry(result, attempts, retries):
+                    pending.append(pdf_path)
+                else:
+                    finished(pdf_path, result)
+        finally:
+            _shutdown_worker()
+    else:
+        pending = deque(pending)
+        while pending:
+            suspects = _run_pool(pending, workers, attempts, retries, finished)
+            # A crash broke the pool; find the PDF that caused it by running each alone
+            for pdf_path in suspects:
+                _run_isolated(pdf_path, attempts, retries, finished)
+
+    summary = _summarize(results, attempts, workers, time.perf_counter() - start)
+    if summary_path:
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    if Config.METRICS_ENABLED:
+        write_run_metrics(summary, metrics_path)
+    return summary
+
+
+def _run_pool(pending, workers, attempts, retries, finished):
+    """
+    Drive one process pool with at most one PDF per worker in flight, until
+    all work is done or the pool breaks.
+
+    Args:
+        pending (deque): PDFs still to run; consumed from the left
+        finished (callable): Called with (pdf_path, result) for every final result
+
+    Returns:
+        list: PDFs that were in flight when a worker died hard (segfault, OOM
+            kill). Any of them may have caused it, so none is charged an attempt
+    """
+    suspects = []
+    broken = False
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {}
+        while futures or (pending and not broken):
+            # A broken pool takes no new work
+            while pending and not broken and len(futures) < workers:
+                pdf_path = pending.popleft()
+                try:
+                    futures[executor.submit(_run_one, pdf_path)] = pdf_path
+                except BrokenProcessPool:
+                    # The pool broke before any of its futures said so
+                    broken = True
+                    pending.appendleft(pdf_path)
+                    break
+                attempts[pdf_path] += 1
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                pdf_path = futures.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    attempts[pdf_path] -= 1
+                    suspects.append(pdf_path)
+                    continue
+
+                if _should_retry(result, attempts, retries):
+                    pending.appendleft(pdf_path)
+                else:
+                    finished(pdf_path, result)
+
+    return suspects
+
+
+def _run_isolated(pdf_path, attempts, retries, finished):
+    """
+    Run one PDF alone on a fresh single-worker pool, retrying as usual.
+
+    Used for the PDFs in flight when a pool broke: only a PDF that kills its
+    own worker is charged the attempt and, out of retries, recorded as failed.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        finished (callable): Called with (pdf_path, result) for the final result
+    """
+    while True:
+        attempts[pdf_path] += 1
+        result = _run_alone(pdf_path)
+        if not _should_retry(result, attempts, retries):
+            finished(pdf_path, result)
+            return
+
+
+def _run_alone(pdf_path, initializer=_init_worker):
+    """
+    Run one PDF once on a fresh single-worker pool.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        initializer (callable): Worker initializer for the pool
+
+    Returns:
+        dict: Result record; a failed one with failure 'crash' if the PDF killed the worker
+    """
+    with ProcessPoolExecutor(max_workers=1, initializer=initializer) as executor:
+        try:
+            return executor.submit(_run_one, pdf_path).result()
+        except BrokenProcessPool:
+            return {
+                'pdf': pdf_path,
+                'status': 'failed',
+                'error': 'BrokenProcessPool: worker process terminated abruptly',
+                'failure': 'crash'
+            }
+
+
+def _should_retry(result, attempts, retries):
+    """Decide whether a failed result gets another attempt."""
+    if result['status'] == 'ok':
+        return False
+    if attempts[result['pdf']] <= retries:
+        logger.warning(f"Retrying {result['pdf']} after failure: {result['error']}")
+        return True
+    logger.error(f"Error processing {result['pdf']}: {result['error']}")
+    return False
+
+
+def _summarize(results, attempts, workers, elapsed):
+    """Build the run summary from the collected results."""
+    records = []
+    for pdf_path, result in results.items():
+        record = dict(result)
+        record['attempts'] = attempts[pdf_path]
+        records.append(record)
+
+    succeeded = [r for r in records if r['status'] == 'ok']
+    failed = [r for r in records if r['status'] != 'ok']
+    return {
+        'workers': workers,
+        'total': len(records),
+        'succeeded': len(succeeded),
+        'failed': len(failed),
+        'figures': sum(r.get('figures', 0) for r in succeeded),
+        'seconds': elapsed,
+        'tools': merge_tool_stats(r.get('tools', {}) for r in records),
+        'results': records
+    }
@@ -0,0 +1,357 @@
+"""
+Content-addressed cache for extraction results and intermediate products.
+
+Entries are keyed by the SHA-256 of the PDF plus every setting that affects
+the product, so a changed file or setting simply misses. Three kinds of
+entries are kept, each invalidated by a different subset of settings:
+
+- ``pages``: rendered page rasters (DPI, raster scale, renderer version),
+  only kept when Config.CACHE_PAGES is set
+- ``html``: the xpdf HTML directory (pdftohtml version)
+- ``results``: saved figures, captions and metadata (all of the above plus
+  the extractor settings and the figure output format)
+
+Each entry is a directory that is written under a temporary name and renamed
+into place, and its mtime is refreshed on every hit so that eviction can drop
+the least recently used entries once the cache grows beyond its size budget.
+Each process keeps a running estimate of the cache size, so the cache is only
+walked when the estimate exceeds the budget or every Config.CACHE_EVICT_INTERVAL
+commits, which picks up entries written by other processes.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+from functools import lru_cache
+import numpy as np
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of cached entries or the extraction logic changes
+CACHE_FORMAT_VERSION = 1
+
+KINDS = ('pages', 'html', 'results')
+
+# Cache root -> [estimated size in bytes, commits since the last full scan]
+_usage = {}
+_usage_lock = threading.Lock()
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Compute the SHA-256 of a file without reading it into memory at once.
+
+    Args:
+        path (str): Path to the file
+        chunk_size (int): Bytes read per call
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def tool_versions():
+    """
+    Report the versions of the external renderer and HTML converter.
+
+    Returns:
+        dict: 'renderer' and 'html' version strings, 'unknown' if a tool can't be queried
+    """
+    if os.name == 'nt':
+        renderer = _first_output_line([Config.IMAGEMAGICK_PATH, '-version'])
+    else:
+        renderer = _first_output_line(['gs', '--version'])
+    return {
+        'renderer': renderer,
+        'html': _first_output_line([Config.XPDF_PATH, '-v'])
+    }
+
+
+def _first_output_line(command):
+    """Run a version command and return the first line it prints on stdout or stderr."""
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return 'unknown'
+    output = (completed.stdout or completed.stderr).strip()
+    return output.splitlines()[0] if output else 'unknown'
+
+
+def _key(*parts):
+    """Hash a sequence of JSON-serialisable parts into a cache key."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def cache_keys(pdf_path, extractor, dpi=None):
+    """
+    Derive the cache keys for a PDF and the current settings.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        extractor: FigureExtractor whose settings affect the results
+        dpi (int, optional): Render DPI. Defaults to Config.DPI
+
+    Returns:
+        dict: Keys for the 'pages', 'html' and 'results' entries, plus the
+            PDF's SHA-256 as 'pdf'
+    """
+    pdf_hash = file_digest(pdf_path)
+    versions = tool_versions()
+    # Pages rendered below the output DPI are detection-only and stored gray
+    colour = 'gray' if (dpi or Config.DPI) != Config.DPI else 'rgb'
+    pages_key = _key(CACHE_FORMAT_VERSION, 'pages', pdf_hash, dpi or Config.DPI, colour,
+                     Config.RASTER_SCALE, os.name, versions['renderer'])
+    html_key = _key(CACHE_FORMAT_VERSION, 'html', pdf_hash, versions['html'])
+    results_key = _key(CACHE_FORMAT_VERSION, 'results', pages_key, html_key, extractor.settings(),
+                       Config.FIGURE_FORMAT, Config.FIGURE_QUALITY, Config.DPI,
+                       Config.PAGE_SELECTION, Config.PAGE_SELECTION_MARGIN,
+                       Config.DEDUP_ENABLED, Config.DEDUP_MAX_DISTANCE)
+    return {'pages': pages_key, 'html': html_key, 'results': results_key, 'pdf': pdf_hash}
+
+
+class ResultCache:
+    def __init__(self, root=None, max_bytes=None):
+        """
+        Initialize the cache.
+
+        Args:
+            root (str, optional): Cache directory. Defaults to Config.CACHE_DIR
+            max_bytes (int, optional): Size budget for all entries. Defaults to Config.CACHE_MAX_BYTES
+        """
+        self.root = os.path.abspath(root or Config.CACHE_DIR)
+        self.max_bytes = max_bytes if max_bytes is not None else Config.CACHE_MAX_BYTES
+        for kind in KINDS:
+            os.makedirs(os.path.join(self.root, kind), exist_ok=True)
+
+    def keys_for(self, pdf_path, extractor, dpi=None):
+        """Derive the cache keys for a PDF and the current settings, see cache_keys."""
+        return cache_keys(pdf_path, extractor, dpi)
+
+    def _entry(self, kind, key):
+        return os.path.join(self.root, kind, key)
+
+    def _lookup(self, kind, key):
+        """Return the entry directory on a hit, refreshing its LRU timestamp."""
+        entry = self._entry(kind, key)
+        if not os.path.isdir(entry):
+            return None
+        try:
+            os.utime(entry)
+        except OSError:
+            return None
+        return entry
+
+    def _new_entry(self, kind):
+        """Create a private staging directory for an entry being written."""
+        return tempfile.mkdtemp(prefix='.staging-', dir=os.path.join(self.root, kind))
+
+    def _commit(self, kind, key, staging):
+        """Atomically publish a staged entry and enforce the size budget."""
+        try:
+            size = _tree_size(staging)
+            os.rename(staging, self._entry(kind, key))
+        except OSError:
+            # Another worker published the same entry first
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        with _usage_lock:
+            usage = _usage.get(self.root)
+            if usage is not None:
+                usage[0] += size
+                usage[1] += 1
+                if usage[0] <= self.max_bytes and usage[1] < Config.CACHE_EVICT_INTERVAL:
+                    return
+        self.evict()
+
+    # Results
+
+    def get_results(self, key, output_dir):
+        """
+        Restore cached artefacts into output_dir.
+
+        Args:
+            key (str): Results key from keys_for
+            output_dir (str): Directory to restore figures, captions and metadata into
+
+        Returns:
+            dict: The cached metadata, or None on a miss
+        """
+        entry = self._lookup('results', key)
+        if entry is None:
+            return None
+        try:
+            for name in os.listdir(entry):
+                shutil.copy2(os.path.join(entry, name), os.path.join(output_dir, name))
+            with open(os.path.join(entry, 'metadata.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable cache entry {entry}: {str(e)}")
+            return None
+
+    def put_results(self, key, output_dir):
+        """
+        Store metadata.json and the figures and captions it lists, so that files
+        left in output_dir by other runs or settings are not cached.
+
+        Args:
+            key (str): Results key from keys_for
+            output_dir (str): Directory holding the figures, captions and metadata.json
+        """
+        staging = self._new_entry('results')
+        try:
+            for name in _result_files(os.path.join(output_dir, 'metadata.json')):
+                shutil.copy2(os.path.join(output_dir, name), os.path.join(staging, name))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Not caching results from {output_dir}: {str(e)}")
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self._commit('results', key, staging)
+
+    # xpdf HTML
+
+    def get_html(self, key, html_dir):
+        """
+        Restore a cached xpdf HTML directory.
+
+        Args:
+            key (str): HTML key from keys_for
+            html_dir (str): Directory to restore into, replaced if it exists
+
+        Returns:
+            bool: True on a hit
+        """
+        entry = self._lookup('html', key)
+        if entry is None:
+            return False
+        if os.path.exists(html_dir):
+            shutil.rmtree(html_dir)
+        try:
+            shutil.copytree(entry, html_dir)
+        except OSError as e:
+            logger.warning(f"Ignoring unreadable cache entry {entry}: {str(e)}")
+            return False
+        return True
+
+    def put_html(self, key, html_dir):
+        """Store an xpdf HTML directory."""
+        staging = self._new_entry('html')
+        try:
+            # copytree needs a missing target (dirs_exist_ok is Python 3.8+), so the
+            # tree goes below the private staging directory and is published from there
+            tree = os.path.join(staging, 'html')
+            shutil.copytree(html_dir, tree)
+            self._commit('html', key, tree)
+        except OSError as e:
+            logger.warning(f"Not caching HTML from {html_dir}: {str(e)}")
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    # Rendered pages
+
+    def get_pages(self, key):
+        """
+        Stream cached page rasters.
+
+        Args:
+            key (str): Pages key from keys_for
+
+        Returns:
+            generator: (page_number, page array) pairs, or None on a miss
+        """
+        entry = self._lookup('pages', key)
+        if entry is None:
+            return None
+        return self._iter_pages(entry)
+
+    def _iter_pages(self, entry):
+        names = sorted(name for name in os.listdir(entry) if name.endswith('.npy'))
+        for name in names:
+            # Memory-mapped, so only the pages being worked on are resident
+            yield int(name[len('page'):-len('.npy')]), np.load(os.path.join(entry, name), mmap_mode='r')
+
+    def tee_pages(self, key, pages):
+        """
+        Pass pages through while storing them; the entry is published only once
+        the whole document has been consumed.
+
+        Args:
+            key (str): Pages key from keys_for
+            pages (iterable): (page_number, page) pairs from the renderer
+
+        Yields:
+            tuple: The same (page_number, page) pairs
+        """
+        staging = self._new_entry('pages')
+        completed = False
+        try:
+            for page_num, page in pages:
+                np.save(os.path.join(staging, f'page{page_num:05d}.npy'), np.asarray(page))
+                yield page_num, page
+            completed = True
+        finally:
+            if completed:
+                self._commit('pages', key, staging)
+            else:
+                shutil.rmtree(staging, ignore_errors=True)
+
+    # Eviction
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits its size budget."""
+        entries = []
+        total = 0
+        for kind in KINDS:
+            kind_dir = os.path.join(self.root, kind)
+            for name in os.listdir(kind_dir):
+                if name.startswith('.'):
+                    continue
+                entry = os.path.join(kind_dir, name)
+                try:
+                    size = _tree_size(entry)
+                    entries.append((os.path.getmtime(entry), size, entry))
+                except OSError:
+                    continue
+                total += size
+
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted cache entry {entry}")
+        with _usage_lock:
+            _usage[self.root] = [total, 0]
+
+
+def _result_files(metadata_path):
+    """List metadata.json and the artefact file names recorded in it."""
+    with open(metadata_path, encoding='utf-8') as f:
+        stored = json.load(f)
+    names = ['metadata.json']
+    for figure in next(iter(stored.values()))['figures']:
+        if figure.get('image_file'):
+            names.append(figure['image_file'])
+        if figure.get('caption_bb') is not None:
+            names.append(f"page_{figure['page']}_caption_{figure['figure_number']}.txt")
+    return names
+
+
+def _tree_size(path):
+    """Total size in bytes of the files below path."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            total += os.path.getsize(os.path.join(dirpath, name))
+    return total
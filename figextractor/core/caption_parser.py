@@ -0,0 +1,175 @@
+"""
+Browser-free caption detection that parses the HTML pages written by xpdf's pdftohtml.
+"""
+
+import os
+import re
+import logging
+from lxml import etree, html as lxml_html
+from ..utils.helpers import CAPTION_PREFIXES, is_caption_candidate
+
+logger = logging.getLogger(__name__)
+
+# pdftohtml positions every text line absolutely but does not emit its size,
+# so width and height are estimated from the span font sizes the same way a
+# browser lays out a single nowrap line.
+AVERAGE_CHAR_WIDTH_EM = 0.5
+LINE_HEIGHT_EM = 1.15
+
+_LEFT_RE = re.compile(r'left:\s*(-?[\d.]+)px')
+_TOP_RE = re.compile(r'top:\s*(-?[\d.]+)px')
+_FONT_SIZE_RE = re.compile(r'font-size:\s*([\d.]+)px')
+_WHITESPACE_RE = re.compile(r'\s+')
+_PAGE_FILE_RE = re.compile(r'^page(\d+)\.html$')
+
+
+def parse_html_page(html_path):
+    """
+    Parse the page size and all absolutely positioned text lines from an xpdf HTML page.
+
+    Args:
+        html_path (str): Path to a pageN.html file written by pdftohtml
+
+    Returns:
+        tuple: ((width, height) of the page background image or None,
+            list of dicts with 'bbox' (x, y, width, height) and 'text' for each line)
+    """
+    root = lxml_html.parse(html_path).getroot()
+
+    page_size = None
+    image = root.find('.//img')
+    if image is not None and image.get('width') and image.get('height'):
+        page_size = (int(image.get('width')), int(image.get('height')))
+
+    lines = []
+    for div in root.iter('div'):
+        style = div.get('style', '')
+        left = _LEFT_RE.search(style)
+        top = _TOP_RE.search(style)
+        if not left or not top:
+            continue
+
+        width = 0.0
+        font_size = 0.0
+        chunks = []
+        for span in div.iter('span'):
+            span_text = span.text_content()
+            size_match = _FONT_SIZE_RE.search(span.get('style', ''))
+            span_size = float(size_match.group(1)) if size_match else 0.0
+            width += len(span_text) * span_size * AVERAGE_CHAR_WIDTH_EM
+            font_size = max(font_size, span_size)
+            chunks.append(span_text)
+
+        text = ''.join(chunks) if chunks else div.text_content()
+        text = _WHITESPACE_RE.sub(' ', text).strip()
+        if not text:
+            continue
+
+        lines.append({
+            'bbox': (
+                int(float(left.group(1))),
+                int(float(top.group(1))),
+                int(round(width)),
+                int(round(font_size * LINE_HEIGHT_EM))
+            ),
+            'text': text
+        })
+
+    return page_size, lines
+
+
+def parse_text_divs(html_path):
+    """
+    Parse all absolutely positioned text lines from an xpdf HTML page.
+
+    Args:
+        html_path (str): Path to a pageN.html file written by pdftohtml
+
+    Returns:
+        list: Dicts with 'bbox' (x, y, width, height) and 'text' for each line
+    """
+    return parse_html_page(html_path)[1]
+
+
+def detect_page_captions(html_path):
+    """
+    Detect figure captions and the page size in an xpdf HTML page without a browser.
+
+    Args:
+        html_path (str): Path to a pageN.html file written by pdftohtml
+
+    Returns:
+        tuple: (detected captions with their bounding boxes and text,
+            (width, height) of the page in HTML pixels or None)
+    """
+    try:
+        page_size, lines = parse_html_page(html_path)
+    except (OSError, ValueError, etree.LxmlError) as e:
+        logger.error(f"Failed to parse {html_path}: {str(e)}")
+        return [], None
+
+    return [line for line in lines if line['text'].startswith(CAPTION_PREFIXES)], page_size
+
+
+def detect_captions(html_path):
+    """
+    Detect figure captions in an xpdf HTML page without a browser.
+
+    Args:
+        html_path (str): Path to a pageN.html file written by pdftohtml
+
+    Returns:
+        list: Detected captions with their bounding boxes and text
+    """
+    return detect_page_captions(html_path)[0]
+
+
+def count_html_pages(html_dir):
+    """
+    Number of pages in a pdftohtml output directory.
+
+    Args:
+        html_dir (str): Directory of pageN.html files written by pdftohtml
+
+    Returns:
+        int: Highest page number found, 0 if there are none
+    """
+    numbers = [int(match.group(1)) for match in map(_PAGE_FILE_RE.match, os.listdir(html_dir)) if match]
+    return max(numbers, default=0)
+
+
+def select_caption_pages(html_dir, margin=0):
+    """
+    Find the pages worth rasterising: those with a caption candidate in their
+    text layer, plus margin pages on either side for figures whose caption
+    sits on a neighbouring page.
+
+    Args:
+        html_dir (str): Directory of pageN.html files written by pdftohtml
+        margin (int): Neighbouring pages to add around each caption page
+
+    Returns:
+        tuple: (sorted list of 1-based page numbers to render, number of pages in the document)
+    """
+    page_count = 0
+    caption_pages = set()
+    for name in os.listdir(html_dir):
+        match = _PAGE_FILE_RE.match(name)
+        if not match:
+            continue
+        page_num = int(match.group(1))
+        page_count = max(page_count, page_num)
+        try:
+            lines = parse_text_divs(os.path.join(html_dir, name))
+        except (OSError, ValueError, etree.LxmlError) as e:
+            # Render pages whose text layer can't be read rather than lose figures
+            logger.warning(f"Failed to parse {name}, keeping the page: {str(e)}")
+            caption_pages.add(page_num)
+            continue
+        if any(is_caption_candidate(line['text']) for line in lines):
+            caption_pages.add(page_num)
+
+    selected = set()
+    for page_num in caption_pages:
+        selected.update(range(max(1, page_num - margin), min(page_count, page_num + margin) + 1))
+    return sorted(selected), page_count
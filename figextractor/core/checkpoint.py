@@ -0,0 +1,205 @@
+"""
+Progress manifests that let interrupted runs resume where they stopped.
+
+Each PDF's output directory holds a progress.json that lists the pages whose
+figures, captions and metadata entries are fully on disk. Pages finished since
+it was last written are appended to progress.jsonl, one record per line, and
+folded into progress.json when the PDF finishes or a run resumes, so recording
+a page costs the same on page 500 as on page 1. The batch runner keeps a
+run-level manifest of finished PDFs in the output directory. Manifests are
+replaced atomically, so a crash leaves either the previous or the new version,
+never a torn one; a torn last line of the page log is ignored.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from .writer import atomic_write
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'progress.json'
+PAGE_LOG_NAME = 'progress.jsonl'
+RUN_MANIFEST_NAME = 'run_progress.json'
+MANIFEST_VERSION = 1
+
+
+def _load(path):
+    """Read a manifest, or None if it is missing or unreadable."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable manifest {path}: {str(e)}")
+        return None
+
+
+def _load_page_log(path, key):
+    """
+    Read the page records appended under key, stopping at a torn or unreadable line.
+
+    Returns:
+        dict: str(page number) -> page entry; empty if the log is missing or for another key
+    """
+    pages = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            header = None
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if header is None:
+                    header = record
+                    if header.get('version') != MANIFEST_VERSION or header.get('key') != key:
+                        return {}
+                    continue
+                pages[str(record['page'])] = {'figures': record['figures']}
+    except FileNotFoundError:
+        pass
+    except (OSError, KeyError, TypeError) as e:
+        logger.warning(f"Ignoring unreadable page log {path}: {str(e)}")
+    return pages
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class PdfCheckpoint:
+    def __init__(self, output_dir, key, resume=False, fsync=None):
+        """
+        Open the progress manifest of one PDF.
+
+        Args:
+            output_dir (str): The PDF's output directory
+            key (str): Identifies the PDF content and every setting that affects
+                the results; a manifest written under another key is discarded
+            resume (bool): Keep the progress of an earlier run with the same key
+            fsync (bool, optional): fsync the manifest on every update. Defaults to Config.WRITER_FSYNC
+        """
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.log_path = os.path.join(output_dir, PAGE_LOG_NAME)
+        self.key = key
+        self.fsync = Config.WRITER_FSYNC if fsync is None else fsync
+        self._lock = threading.Lock()
+        self._log_started = False
+
+        previous = _load(self.path) if resume else None
+        if (previous and previous.get('version') == MANIFEST_VERSION
+                and previous.get('key') == key):
+            self.state = previous
+        else:
+            self.state = {'version': MANIFEST_VERSION, 'key': key, 'status': 'running', 'pages': {}}
+            # Stale progress must not vouch for pages this run has not redone
+            _remove(self.path)
+        if not resume:
+            _remove(self.log_path)
+        logged = _load_page_log(self.log_path, key) if resume else {}
+        if logged:
+            self.state['pages'].update(logged)
+            self._compact()
+
+    @property
+    def complete(self):
+        """True when an earlier run finished the whole PDF."""
+        return self.state['status'] == 'done'
+
+    def completed_pages(self):
+        """
+        Pages finished by an earlier run.
+
+        Returns:
+            dict: page number -> list of the page's figure metadata entries
+        """
+        return {int(page): entry['figures'] for page, entry in self.state['pages'].items()}
+
+    def page_done(self, page_num, figures):
+        """
+        Record a page whose artefacts are all on disk. Safe to call from writer threads.
+
+        Args:
+            page_num (int): 1-based page number
+            figures (list): The page's figure metadata entries
+        """
+        with self._lock:
+            self.state['pages'][str(page_num)] = {'figures': figures}
+            lines = []
+            if not self._log_started:
+                lines.append(json.dumps({'version': MANIFEST_VERSION, 'key': self.key}))
+            lines.append(json.dumps({'page': page_num, 'figures': figures}))
+            # The first record of this run replaces any log left by another key or run
+            with open(self.log_path, 'a' if self._log_started else 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._log_started = True
+
+    def finish(self):
+        """Mark the PDF as complete and fold the page log into the manifest."""
+        with self._lock:
+            self.state['status'] = 'done'
+            self._compact()
+
+    def _compact(self):
+        """Write every known page to the manifest, then drop the log it supersedes."""
+        atomic_write(self.path, json.dumps(self.state), self.fsync)
+        _remove(self.log_path)
+        self._log_started = False
+
+
+class RunManifest:
+    def __init__(self, output_dir=None, resume=False):
+        """
+        Open the run-level manifest of finished PDFs.
+
+        Args:
+            output_dir (str, optional): Where the manifest lives. Defaults to Config.OUTPUT_DIR
+            resume (bool): Keep the entries of an earlier run
+        """
+        self.path = os.path.join(output_dir or Config.OUTPUT_DIR, RUN_MANIFEST_NAME)
+        previous = _load(self.path) if resume else None
+        self.pdfs = previous.get('pdfs', {}) if previous else {}
+
+    @staticmethod
+    def _stamp(pdf_path):
+        stat = os.stat(pdf_path)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def is_done(self, pdf_path):
+        """True when the PDF finished in an earlier run and has not changed since."""
+        entry = self.pdfs.get(os.path.abspath(pdf_path))
+        if not entry or entry.get('status') != 'ok':
+            return False
+        try:
+            return {'size': entry['size'], 'mtime': entry['mtime']} == self._stamp(pdf_path)
+        except (OSError, KeyError):
+            return False
+
+    def record(self, result):
+        """
+        Store the outcome of one PDF and save the manifest.
+
+        Args:
+            result (dict): Result record from the batch runner
+        """
+        pdf_path = result['pdf']
+        entry = {'status': result['status'], 'figures': result.get('figures'), 'time': time.time()}
+        try:
+            entry.update(self._stamp(pdf_path))
+        except OSError:
+            pass
+        self.pdfs[os.path.abspath(pdf_path)] = entry
+        atomic_write(self.path, json.dumps({'version': MANIFEST_VERSION, 'pdfs': self.pdfs}, indent=2))
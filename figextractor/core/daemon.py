@@ -0,0 +1,349 @@
+"""
+Long-running daemon that watches the input directory and processes new PDFs.
+
+The input directory is polled with os.scandir; a PDF is picked up once its
+size and modification time have stayed the same for Config.WATCH_SETTLE_SECONDS,
+so files that are still being copied in are left alone. Ready PDFs go into a
+bounded queue served by a pool of worker processes (the same workers as the
+batch runner). Finished PDFs are recorded in the run manifest, so a restarted
+daemon only picks up new or changed files.
+
+SIGTERM and SIGINT stop the intake; PDFs already being processed are finished
+before the daemon exits, and queued PDFs are picked up again on the next start.
+"""
+
+import os
+import time
+import json
+import queue
+import signal
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .batch import _init_worker, _shutdown_worker, _run_one, _run_alone
+from ..utils.supervisor import merge_tool_stats
+from ..utils.metrics import append_pdf_metrics, write_run_metrics
+from .checkpoint import RunManifest
+from .writer import atomic_write
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+STATUS_NAME = 'daemon_status.json'
+
+# Latencies kept for the percentiles in the status file
+LATENCY_WINDOW = 1000
+
+
+def _init_daemon_worker():
+    """Worker initializer that leaves shutdown to the daemon process."""
+    # Service managers signal the whole process group; the workers must keep
+    # going until the daemon has collected their in-flight results
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _init_worker()
+
+
+def _summarize_latencies(values):
+    """Count, mean, median, 95th percentile and maximum of a list of seconds."""
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'p50': ordered[len(ordered) // 2],
+        'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        'max': ordered[-1]
+    }
+
+
+class WatchDaemon:
+    def __init__(self, input_dir=None, workers=None, poll_interval=None, settle_seconds=None,
+                 queue_size=None, retries=None, status_path=None):
+        """
+        Set up the daemon; nothing runs until run() is called.
+
+        Args:
+            input_dir (str, optional): Directory to watch. Defaults to Config.INPUT_DIR
+            workers (int, optional): Number of worker processes. Defaults to Config.WORKERS
+            poll_interval (float, optional): Seconds between scans. Defaults to Config.WATCH_POLL_INTERVAL
+            settle_seconds (float, optional): How long a file must stay unchanged before it
+                is processed. Defaults to Config.WATCH_SETTLE_SECONDS
+            queue_size (int, optional): Capacity of the work queue. Defaults to Config.WATCH_QUEUE_SIZE
+            retries (int, optional): How many times a failed PDF is retried. Defaults to Config.RETRIES
+            status_path (str, optional): Status file rewritten every Config.WATCH_STATUS_INTERVAL
+                seconds. Defaults to daemon_status.json in Config.OUTPUT_DIR
+        """
+        self.input_dir = input_dir or Config.INPUT_DIR
+        self.workers = workers or Config.WORKERS
+        self.poll_interval = poll_interval or Config.WATCH_POLL_INTERVAL
+        self.settle_seconds = Config.WATCH_SETTLE_SECONDS if settle_seconds is None else settle_seconds
+        self.retries = Config.RETRIES if retries is None else retries
+        self.status_path = status_path or os.path.join(Config.OUTPUT_DIR, STATUS_NAME)
+
+        self.queue = queue.Queue(queue_size or Config.WATCH_QUEUE_SIZE)
+        self.manifest = RunManifest(resume=True) if Config.CHECKPOINTS else None
+
+        # path -> (signature, time first seen with that signature) for files settling
+        self._candidates = {}
+        # path -> signature of the version already queued or processed
+        self._handled = {}
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._threads = []
+        self._started = None
+        self._in_flight = 0
+        self._processed = 0
+        self._failed = 0
+        self._figures = 0
+        self._tools = {}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._waits = deque(maxlen=LATENCY_WINDOW)
+
+    def scan(self):
+        """
+        Check the input directory once and queue PDFs that have settled.
+
+        Returns:
+            list: Paths queued by this scan
+        """
+        now = time.time()
+        present = set()
+        queued = []
+        try:
+            entries = list(os.scandir(self.input_dir))
+        except OSError as e:
+            logger.error(f"Cannot scan {self.input_dir}: {str(e)}")
+            return queued
+
+        for entry in entries:
+            if not entry.name.endswith('.pdf') or entry.name.startswith('.'):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue  # removed between listing and stat
+            path = entry.path
+            present.add(path)
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self._handled.get(path) == signature:
+                continue
+
+            previous = self._candidates.get(path)
+            if previous is None or previous[0] != signature:
+                # New or still growing; wait until it stops changing
+                self._candidates[path] = (signature, now)
+                continue
+            if now - previous[1] < self.settle_seconds or stat.st_size == 0:
+                continue
+
+            if self.manifest and self.manifest.is_done(path):
+                self._handled[path] = signature
+                del self._candidates[path]
+                continue
+            try:
+                self.queue.put_nowait((path, time.time()))
+            except queue.Full:
+                # Stays a settled candidate and is offered again on the next scan
+                logger.debug(f"Work queue full, deferring {entry.name}")
+                continue
+            self._handled[path] = signature
+            del self._candidates[path]
+            queued.append(path)
+            logger.info(f"Queued {entry.name} (queue depth {self.queue.qsize()})")
+
+        # Forget files that disappeared, so a new file with the same name is picked up
+        for path in list(self._candidates):
+            if path not in present:
+                del self._candidates[path]
+        for path in list(self._handled):
+            if path not in present:
+                del self._handled[path]
+        return queued
+
+    def _process(self, pdf_path):
+        """Run one PDF on the worker pool, or in this process with a single worker."""
+        executor = self._executor
+        if executor is None:
+            return _run_one(pdf_path)
+        try:
+            return executor.submit(_run_one, pdf_path).result()
+        except BrokenProcessPool:
+            # A worker died hard and broke the pool for every thread using it;
+            # the first thread to notice replaces it
+            with self._lock:
+                if self._executor is executor:
+                    logger.error("Worker pool broke, starting a new one")
+                    executor.shutdown(wait=False)
+                    self._executor = self._new_executor()
+        # Any PDF in flight may have caused it, so each runs again alone and
+        # only the one that kills its own worker fails
+        logger.warning(f"Rerunning {os.path.basename(pdf_path)} alone after the worker pool broke")
+        return _run_alone(pdf_path, initializer=_init_daemon_worker)
+
+    def _serve(self):
+        """Dispatcher thread: feed queued PDFs to the workers until the daemon stops."""
+        while not self._stopping.is_set():
+            try:
+                pdf_path, enqueued = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if self._stopping.is_set():
+                # Left for the next start, which finds it unfinished in the manifest
+                self.queue.task_done()
+                break
+
+            started = time.time()
+            with self._lock:
+                self._in_flight += 1
+            attempts = 0
+            tools = []
+            while True:
+                attempts += 1
+                result = self._process(pdf_path)
+                tools.append(result.get('tools', {}))
+                if result['status'] == 'ok' or attempts > self.retries:
+                    break
+                logger.warning(f"Retrying {pdf_path} after failure: {result['error']}")
+
+            finished = time.time()
+            with self._lock:
+                self._in_flight -= 1
+                self._waits.append(started - enqueued)
+                self._latencies.append(finished - enqueued)
+                if result['status'] == 'ok':
+                    self._processed += 1
+                    self._figures += result.get('figures', 0)
+                else:
+                    self._failed += 1
+                self._tools = merge_tool_stats([self._tools] + tools)
+                if self.manifest:
+                    self.manifest.record(result)
+                # There is no end of run to summarise PDFs at, so each is written as it finishes
+                if Config.METRICS_ENABLED and Config.METRICS_FORMAT == 'jsonl' and result.get('metrics'):
+                    append_pdf_metrics(os.path.basename(pdf_path), result['metrics'])
+            self.queue.task_done()
+
+            name = os.path.basename(pdf_path)
+            if result['status'] == 'ok':
+                logger.info(f"Processed {name}: {result['figures']} figures, "
+                            f"{finished - enqueued:.1f}s after queueing (queue depth {self.queue.qsize()})")
+            else:
+                logger.error(f"Error processing {name}: {result['error']}")
+
+    def stats(self):
+        """
+        Current queue and throughput figures.
+
+        Returns:
+            dict: Queue depth and capacity, PDFs in flight, processed and failed
+                counts, per-tool statistics (see utils.supervisor), and summaries
+                of the queue wait (queued to started) and latency (queued to
+                finished) in seconds
+        """
+        with self._lock:
+            waits = list(self._waits)
+            latencies = list(self._latencies)
+            return {
+                'time': time.time(),
+                'uptime_seconds': time.time() - self._started if self._started else 0.0,
+                'workers': self.workers,
+                'queue_depth': self.queue.qsize(),
+                'queue_capacity': self.queue.maxsize,
+                'in_flight': self._in_flight,
+                'processed': self._processed,
+                'failed': self._failed,
+                'figures': self._figures,
+                'tools': self._tools,
+                'stopping': self._stopping.is_set(),
+                'wait_seconds': _summarize_latencies(waits),
+                'latency_seconds': _summarize_latencies(latencies)
+            }
+
+    def write_status(self):
+        """Replace the status file with the current stats."""
+        try:
+            atomic_write(self.status_path, json.dumps(self.stats(), indent=2))
+        except OSError as e:
+            logger.warning(f"Failed to write daemon status: {str(e)}")
+
+    def stop(self, signum=None, frame=None):
+        """Stop taking new work; PDFs already being processed are finished. Usable as a signal handler."""
+        if not self._stopping.is_set():
+            reason = f" on {signal.Signals(signum).name}" if signum else ""
+            logger.info(f"Stopping{reason}; finishing {self._in_flight} PDFs in progress")
+        self._stopping.set()
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_daemon_worker)
+
+    def run(self):
+        """Watch and process until stop() is called or SIGTERM/SIGINT arrives."""
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+        self._started = time.time()
+        if self.workers <= 1:
+            _init_worker()
+        else:
+            self._executor = self._new_executor()
+        self._threads = [
+            threading.Thread(target=self._serve, name=f'daemon-dispatch-{index}', daemon=True)
+            for index in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Watching {self.input_dir} with {self.workers} workers")
+
+        last_status = 0.0
+        try:
+            while not self._stopping.is_set():
+                self.scan()
+                if time.time() - last_status >= Config.WATCH_STATUS_INTERVAL:
+                    self.write_status()
+                    last_status = time.time()
+                self._stopping.wait(self.poll_interval)
+        finally:
+            self._stopping.set()
+            for thread in self._threads:
+                thread.join()
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+            else:
+                _shutdown_worker()
+            self.write_status()
+            stats = self.stats()
+            if Config.METRICS_ENABLED:
+                write_run_metrics({
+                    'workers': self.workers,
+                    'total': stats['processed'] + stats['failed'],
+                    'succeeded': stats['processed'],
+                    'failed': stats['failed'],
+                    'figures': stats['figures'],
+                    'seconds': stats['uptime_seconds'],
+                    'tools': stats['tools'],
+                    'results': []
+                })
+            logger.info(f"Daemon stopped: {stats['processed']} processed, {stats['failed']} failed, "
+                        f"{stats['queue_depth']} left queued for the next start")
+        return self.stats()
+
+
+def run_daemon(**kwargs):
+    """
+    Run a WatchDaemon in the foreground until it is signalled to stop.
+
+    Args:
+        **kwargs: See WatchDaemon
+
+    Returns:
+        dict: Final stats, see WatchDaemon.stats
+    """
+    return WatchDaemon(**kwargs).run()
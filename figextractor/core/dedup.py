@@ -0,0 +1,238 @@
+"""
+Perceptual-hash deduplication of figures across documents.
+
+Every detected figure gets a 64-bit difference hash (dHash) computed from
+the gray detection page. Hashes of saved figures are stored in the figure
+index database and loaded into a BK-tree, so a new figure is looked up by
+Hamming distance in roughly logarithmic time. A figure within
+Config.DEDUP_MAX_DISTANCE bits of an earlier one with the same aspect ratio
+is not encoded or written again; its metadata entry references the earlier
+image instead.
+"""
+
+import os
+import logging
+import threading
+import cv2
+import numpy as np
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8
+
+# Largest relative difference in aspect ratio between duplicates; keeps
+# different charts that happen to share a coarse gradient layout apart
+MAX_ASPECT_DIFFERENCE = 0.1
+
+
+def dhash(gray, hash_size=HASH_SIZE):
+    """
+    Difference hash of a grayscale image.
+
+    The image is shrunk to (hash_size + 1) x hash_size and each bit records
+    whether a pixel is brighter than its left neighbour, so the hash survives
+    rescaling, recompression and small rendering differences.
+
+    Args:
+        gray: 2-D uint8 array
+        hash_size (int): Bits per row and rows; the hash has hash_size ** 2 bits
+
+    Returns:
+        int: The hash, or None for an empty image
+    """
+    if gray.size == 0:
+        return None
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a, b):
+    """Number of differing bits between two hashes."""
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over hashes with the Hamming distance.
+
+    Each node keeps its children keyed by their distance to it; by the
+    triangle inequality a search within radius r only descends into children
+    at distance d - r .. d + r from each visited node.
+    """
+
+    __slots__ = ('root', 'size')
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        """
+        Insert an item under a hash.
+
+        Args:
+            value (int): Hash
+            item: Payload returned by search
+        """
+        self.size += 1
+        if self.root is None:
+            self.root = (value, [item], {})
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, [item], {})
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """
+        Find items whose hash is within max_distance of value.
+
+        Returns:
+            list: (distance, item) pairs, nearest first
+        """
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= max_distance:
+                found.extend((distance, item) for item in items)
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+    def __len__(self):
+        return self.size
+
+
+class FigureDeduplicator:
+    def __init__(self, index, max_distance=None, output_root=None):
+        """
+        In-memory BK-tree over the hashes stored in the figure index.
+
+        Args:
+            index (FigureIndex): Database holding the persistent hashes
+            max_distance (int, optional): Largest Hamming distance between duplicates.
+                Defaults to Config.DEDUP_MAX_DISTANCE
+            output_root (str, optional): Directory image paths are relative to.
+                Defaults to Config.OUTPUT_DIR
+        """
+        self.index = index
+        self.max_distance = Config.DEDUP_MAX_DISTANCE if max_distance is None else max_distance
+        self.output_root = output_root or Config.OUTPUT_DIR
+        self.tree = BKTree()
+        self._lock = threading.Lock()
+        self._last_id = 0
+        # Image -> (hash, width, height) of its latest version; tree entries
+        # holding an older hash of a rewritten image are ignored
+        self._images = {}
+        # Images registered by this process whose files may not be written yet
+        self._pending = set()
+
+    def _add(self, value, width, height, image):
+        """Make value the current hash of an image."""
+        current = self._images.get(image)
+        self._images[image] = (value, width, height)
+        if current is None or current[0] != value:
+            self.tree.add(value, (image, value))
+
+    def _refresh(self):
+        """Load hashes stored since the last lookup, including other processes'."""
+        for row_id, value, width, height, image in self.index.hashes_since(self._last_id):
+            self._last_id = max(self._last_id, row_id)
+            if image not in self._pending:
+                self._add(value, width, height, image)
+
+    def find(self, value, width, height, exclude_dir=None):
+        """
+        Find an earlier figure that this one duplicates.
+
+        Args:
+            value (int): The figure's dHash
+            width (int): Figure width in output pixels
+            height (int): Figure height in output pixels
+            exclude_dir (str, optional): Output folder (relative to the output root)
+                whose stored images are ignored, normally the PDF's own folder, which
+                is being rewritten; figures registered during this run still count
+
+        Returns:
+            tuple: (image path relative to the output root, distance), or None
+        """
+        with self._lock:
+            self._refresh()
+            candidates = self.tree.search(value, self.max_distance)
+            for distance, (image, stored) in candidates:
+                current = self._images.get(image)
+                if current is None or current[0] != stored:
+                    continue
+                other_width, other_height = current[1:]
+                ours, theirs = width * other_height, other_width * height
+                if abs(ours - theirs) > MAX_ASPECT_DIFFERENCE * max(ours, theirs):
+                    continue
+                if image in self._pending:
+                    return image, distance
+                if exclude_dir and os.path.dirname(image) == exclude_dir:
+                    continue
+                if os.path.exists(os.path.join(self.output_root, image)):
+                    return image, distance
+        return None
+
+    def register(self, value, width, height, image):
+        """
+        Make a figure that is about to be written available as a duplicate target.
+
+        Call persist once the image file is on disk so other processes see it
+        too, or discard if writing it failed. Registering an image path again,
+        e.g. when a PDF is reprocessed, replaces its earlier hash.
+
+        Args:
+            value (int): The figure's dHash
+            width (int): Figure width in output pixels
+            height (int): Figure height in output pixels
+            image (str): Image path relative to the output root
+        """
+        with self._lock:
+            self._pending.add(image)
+            self._add(value, width, height, image)
+
+    def persist(self, value, width, height, image):
+        """Store a registered figure's hash once its image is on disk."""
+        self.index.add_hash(value, width, height, image)
+        with self._lock:
+            self._pending.discard(image)
+
+    def discard(self, image):
+        """Withdraw a registered figure whose image could not be written."""
+        with self._lock:
+            if image in self._pending:
+                self._pending.discard(image)
+                self._images.pop(image, None)
+
+
+_default_deduplicator = None
+_default_deduplicator_lock = threading.Lock()
+
+
+def get_default_deduplicator():
+    """Process-wide deduplicator over the default figure index."""
+    from .index import get_default_index
+
+    global _default_deduplicator
+    index = get_default_index()
+    with _default_deduplicator_lock:
+        if _default_deduplicator is None or _default_deduplicator.index is not index:
+            _default_deduplicator = FigureDeduplicator(index)
+        return _default_deduplicator
@@ -0,0 +1,343 @@
+"""
+Connected-component figure detector.
+
+Pages are binarised once and split into connected components with
+``cv2.connectedComponentsWithStats``. Components large enough to be part of
+a graphic (blobs, bars, axes, frames, image tiles) are used as seeds and merged
+whenever their gap-expanded boxes overlap, using the same overlap ratio as
+``helpers.compute_overlap`` (intersection over the smaller area). Small
+components such as glyphs are only absorbed into a seed group they touch,
+so tick labels join their plot but paragraphs never chain into a figure.
+
+Everything after the component pass works on (N, 4) arrays of
+(x, y, width, height) boxes; no pixels are copied and crops are left to the
+caller. Pages too large to hold whole are labelled band by band and their
+components joined across the seams (detect_figure_boxes_tiled), which gives
+the same component boxes and so the same figures.
+"""
+
+import cv2
+import numpy as np
+from config import Config
+
+# Pairwise overlaps are computed at most this many pairs at a time
+MERGE_BLOCK = 1 << 18
+
+
+def overlap_matrix(boxes_a, boxes_b):
+    """
+    Pairwise overlap ratios, vectorised form of helpers.compute_overlap.
+
+    Args:
+        boxes_a: (N, 4) array of (x, y, width, height)
+        boxes_b: (M, 4) array of (x, y, width, height)
+
+    Returns:
+        numpy.ndarray: (N, M) intersection area divided by the smaller box area,
+            or -1 where the boxes are disjoint
+    """
+    a = boxes_a[:, None, :].astype(np.float64)
+    b = boxes_b[None, :, :].astype(np.float64)
+    width = np.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2]) - np.maximum(a[..., 0], b[..., 0])
+    height = np.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3]) - np.maximum(a[..., 1], b[..., 1])
+    smaller = np.maximum(np.minimum(a[..., 2] * a[..., 3], b[..., 2] * b[..., 3]), 1.0)
+    # compute_overlap treats touching boxes (zero-width intersection) as overlapping
+    return np.where((width >= 0) & (height >= 0), np.maximum(width, 0) * np.maximum(height, 0) / smaller, -1.0)
+
+
+def _expand(boxes, gap):
+    """Grow boxes by gap pixels on every side."""
+    return boxes + np.array([-gap, -gap, 2 * gap, 2 * gap], dtype=boxes.dtype)
+
+
+def _union_by_label(boxes, labels):
+    """Bounding box of each group of boxes sharing a label."""
+    _, groups = np.unique(labels, return_inverse=True)
+    count = groups.max() + 1
+    x0 = np.full(count, np.iinfo(np.int64).max)
+    y0 = np.full(count, np.iinfo(np.int64).max)
+    x1 = np.full(count, np.iinfo(np.int64).min)
+    y1 = np.full(count, np.iinfo(np.int64).min)
+    np.minimum.at(x0, groups, boxes[:, 0])
+    np.minimum.at(y0, groups, boxes[:, 1])
+    np.maximum.at(x1, groups, boxes[:, 0] + boxes[:, 2])
+    np.maximum.at(y1, groups, boxes[:, 1] + boxes[:, 3])
+    return np.stack([x0, y0, x1 - x0, y1 - y0], axis=1)
+
+
+def _roots(parent, index):
+    """Roots of a parent-pointer forest for an array of indices."""
+    roots = parent[index]
+    while True:
+        up = parent[roots]
+        if np.array_equal(up, roots):
+            return roots
+        roots = up
+
+
+def _join(parent, u, v):
+    """Join the sets holding u[k] and v[k] for every k; roots always point to smaller indices."""
+    while len(u):
+        root_u, root_v = _roots(parent, u), _roots(parent, v)
+        differ = root_u != root_v
+        u, v = u[differ], v[differ]
+        np.minimum.at(parent, np.maximum(root_u, root_v)[differ], np.minimum(root_u, root_v)[differ])
+
+
+def _adjacent_groups(boxes, min_overlap):
+    """
+    Label the connected groups of overlapping boxes.
+
+    Boxes are swept in order of their left edge, so each one is only compared
+    with the boxes starting before its right edge, a block of rows at a time;
+    memory stays proportional to the number of boxes rather than its square.
+
+    Returns:
+        numpy.ndarray: Per box, the smallest index in its group
+    """
+    count = len(boxes)
+    order = np.argsort(boxes[:, 0], kind='stable')
+    ordered = boxes[order]
+    lefts = ordered[:, 0]
+    rights = ordered[:, 0] + ordered[:, 2]
+    parent = np.arange(count)
+    rows = max(1, MERGE_BLOCK // count)
+    for start in range(0, count, rows):
+        stop = min(start + rows, count)
+        # Boxes further right start past every right edge of this block
+        end = int(np.searchsorted(lefts, rights[start:stop].max(), side='right'))
+        overlap = overlap_matrix(ordered[start:stop], ordered[start:end])
+        adjacent = overlap > min_overlap if min_overlap > 0 else overlap >= 0
+        u, v = np.nonzero(adjacent)
+        _join(parent, u + start, v + start)
+
+    # Name each group after its smallest index in the caller's order
+    roots = _roots(parent, np.arange(count))
+    first = np.full(count, count)
+    np.minimum.at(first, roots, order)
+    labels = np.empty(count, dtype=np.int64)
+    labels[order] = first[roots]
+    return labels
+
+
+def merge_boxes(boxes, gap=0, min_overlap=0.0):
+    """
+    Merge boxes whose gap-expanded extents overlap, until no pair does.
+
+    Args:
+        boxes: (N, 4) int array of (x, y, width, height)
+        gap (int): Boxes closer than this many pixels are merged
+        min_overlap (float): Overlap ratio (see overlap_matrix) above which boxes merge
+
+    Returns:
+        numpy.ndarray: (M, 4) int64 array of merged boxes, M <= N
+    """
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    while len(boxes) > 1:
+        labels = _adjacent_groups(_expand(boxes, gap), min_overlap)
+        merged = _union_by_label(boxes, labels)
+        if len(merged) == len(boxes):
+            break
+        # Unions can grow into boxes that neither part touched, so repeat
+        boxes = merged
+    return boxes
+
+
+def _component_boxes(binary):
+    """Bounding boxes of the foreground connected components of a binary image."""
+    # 16-bit labels halve the memory traffic of the label image; pages with
+    # more than 65535 components (dense halftones, noise) overflow and retry
+    try:
+        _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8, ltype=cv2.CV_16U)
+    except cv2.error:
+        _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8, ltype=cv2.CV_32S)
+    # Row 0 is the background
+    return stats[1:, :4].astype(np.int64)
+
+
+def _boxes_from_components(components, min_size, merge_gap, min_overlap, seed_fraction):
+    """Group component boxes into figure boxes and drop those below min_size."""
+    if len(components) == 0:
+        return np.zeros((0, 4), dtype=np.int64)
+
+    # Seeds are blobs with some extent in both directions, or long strokes
+    # such as axes and frames; runs of joined glyphs are neither
+    seed_size = max(1, int(min_size * seed_fraction))
+    widths, heights = components[:, 2], components[:, 3]
+    is_seed = ((widths >= seed_size) & (heights >= seed_size)) | (np.maximum(widths, heights) >= min_size)
+    groups = merge_boxes(components[is_seed], merge_gap, min_overlap)
+
+    # Absorb small components (labels, tick marks, glyphs) that touch a group,
+    # in a single pass so that text can't chain from one line to the next
+    small = components[~is_seed]
+    if len(groups) and len(small):
+        expanded = _expand(small, max(1, merge_gap // 2))
+        owner = np.full(len(small), -1)
+        rows = max(1, MERGE_BLOCK // len(groups))
+        for start in range(0, len(small), rows):
+            touching = overlap_matrix(expanded[start:start + rows], groups) >= 0
+            owner[start:start + rows] = np.where(touching.any(axis=1), touching.argmax(axis=1), -1)
+        absorbed = owner >= 0
+        if absorbed.any():
+            labels = np.concatenate([np.arange(len(groups)), owner[absorbed]])
+            groups = _union_by_label(np.concatenate([groups, small[absorbed]]), labels)
+            groups = merge_boxes(groups, 0, min_overlap)
+
+    keep = (groups[:, 2] >= min_size) & (groups[:, 3] >= min_size)
+    return groups[keep]
+
+
+def _defaults(threshold, merge_gap, min_overlap, seed_fraction):
+    return (
+        Config.DETECTOR_THRESHOLD if threshold is None else threshold,
+        Config.DETECTOR_MERGE_GAP if merge_gap is None else merge_gap,
+        Config.DETECTOR_MERGE_OVERLAP if min_overlap is None else min_overlap,
+        Config.DETECTOR_SEED_FRACTION if seed_fraction is None else seed_fraction
+    )
+
+
+def detect_figure_boxes(gray, min_size, threshold=None, merge_gap=None, min_overlap=None, seed_fraction=None):
+    """
+    Detect figure regions on a grayscale page.
+
+    Args:
+        gray: (H, W) uint8 page image
+        min_size (int): Minimum width and height of a figure in pixels
+        threshold (int, optional): Pixels darker than this are foreground. Defaults to Config.DETECTOR_THRESHOLD
+        merge_gap (int, optional): Gap in pixels bridged between graphic parts. Defaults to Config.DETECTOR_MERGE_GAP
+        min_overlap (float, optional): Overlap ratio needed to merge. Defaults to Config.DETECTOR_MERGE_OVERLAP
+        seed_fraction (float, optional): Components at least this fraction of min_size
+            in both width and height seed figures, as do components at least min_size
+            long in either direction. Defaults to Config.DETECTOR_SEED_FRACTION
+
+    Returns:
+        numpy.ndarray: (N, 4) int64 array of (x, y, width, height) boxes
+    """
+    threshold, merge_gap, min_overlap, seed_fraction = _defaults(threshold, merge_gap, min_overlap, seed_fraction)
+    _, binary = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY_INV)
+    return _boxes_from_components(_component_boxes(binary), min_size, merge_gap, min_overlap, seed_fraction)
+
+
+def _find(parent, index):
+    """Root of a union-find set, halving the path on the way."""
+    while parent[index] != index:
+        parent[index] = parent[parent[index]]
+        index = parent[index]
+    return index
+
+
+def _shift(row, dx):
+    """row[x + dx] for every x, zero outside the row."""
+    if dx == 0:
+        return row
+    shifted = np.zeros_like(row)
+    if dx > 0:
+        shifted[:-dx] = row[dx:]
+    else:
+        shifted[-dx:] = row[:dx]
+    return shifted
+
+
+def tiled_component_boxes(bands, threshold=None):
+    """
+    Connected-component boxes of a page delivered as horizontal bands.
+
+    Each band is labelled on its own. Where a foreground pixel in the first
+    row of a band touches one in the last row of the band above (8-connected),
+    their components are joined. Only the band being labelled and one row of
+    the band above are held.
+
+    Args:
+        bands (iterable): (y, gray) pairs covering the page top to bottom, where
+            gray is a (rows, W) uint8 band starting at page row y
+        threshold (int, optional): See detect_figure_boxes
+
+    Returns:
+        numpy.ndarray: (N, 4) int64 component boxes in page coordinates, the same
+            set as whole-page labelling gives, ordered by band and label
+    """
+    if threshold is None:
+        threshold = Config.DETECTOR_THRESHOLD
+    pieces = []
+    parent = []
+    previous = None
+    for y, gray in bands:
+        _, binary = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY_INV)
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8, ltype=cv2.CV_32S)
+        del binary
+
+        # Band label l (> 0) is global piece offset + l - 1
+        offset = len(parent)
+        boxes = stats[1:, :4].astype(np.int64)
+        boxes[:, 1] += y
+        pieces.append(boxes)
+        parent.extend(range(offset, offset + count - 1))
+
+        if previous is not None:
+            top = labels[0]
+            for dx in (-1, 0, 1):
+                above = _shift(previous, dx)
+                touching = (top > 0) & (above > 0)
+                if not touching.any():
+                    continue
+                pairs = np.unique(np.stack([top[touching] + offset - 1, above[touching] - 1], axis=1), axis=0)
+                for a, b in pairs.tolist():
+                    root_a, root_b = _find(parent, a), _find(parent, b)
+                    # The smaller id, first in raster order, stays the root
+                    if root_a != root_b:
+                        parent[max(root_a, root_b)] = min(root_a, root_b)
+        # Global piece ids plus one along the band's last row, 0 for background
+        bottom = labels[-1]
+        previous = np.where(bottom > 0, bottom + offset, 0)
+        del labels
+
+    if not parent:
+        return np.zeros((0, 4), dtype=np.int64)
+    roots = np.array([_find(parent, index) for index in range(len(parent))])
+    return _union_by_label(np.concatenate(pieces), roots)
+
+
+def detect_figure_boxes_tiled(bands, min_size, threshold=None, merge_gap=None, min_overlap=None, seed_fraction=None):
+    """
+    Detect figure regions on a page delivered as horizontal bands.
+
+    Gives the same boxes as detect_figure_boxes on the assembled page.
+
+    Args:
+        bands (iterable): (y, gray) pairs, see tiled_component_boxes
+        min_size (int): Minimum width and height of a figure in pixels
+        threshold, merge_gap, min_overlap, seed_fraction: See detect_figure_boxes
+
+    Returns:
+        numpy.ndarray: (N, 4) int64 array of (x, y, width, height) boxes
+    """
+    threshold, merge_gap, min_overlap, seed_fraction = _defaults(threshold, merge_gap, min_overlap, seed_fraction)
+    components = tiled_component_boxes(bands, threshold)
+    return _boxes_from_components(components, min_size, merge_gap, min_overlap, seed_fraction)
+
+
+def detect_figure_boxes_batch(grays, min_size, threshold=None, merge_gap=None, min_overlap=None, seed_fraction=None):
+    """
+    Detect figure regions on a batch of grayscale pages.
+
+    Pages of a document share one shape, so a single binary buffer is
+    thresholded into for the whole batch instead of allocating one per page.
+
+    Args:
+        grays (iterable): (H, W) uint8 page images
+        min_size (int): Minimum width and height of a figure in pixels
+        threshold, merge_gap, min_overlap, seed_fraction: See detect_figure_boxes
+
+    Returns:
+        list: (N, 4) int64 box arrays, one per page
+    """
+    threshold, merge_gap, min_overlap, seed_fraction = _defaults(threshold, merge_gap, min_overlap, seed_fraction)
+
+    results = []
+    binary = None
+    for gray in grays:
+        if binary is None or binary.shape != gray.shape:
+            binary = np.empty(gray.shape, dtype=np.uint8)
+        cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY_INV, dst=binary)
+        results.append(_boxes_from_components(_component_boxes(binary), min_size, merge_gap, min_overlap, seed_fraction))
+    return results
@@ -0,0 +1,494 @@
+"""
+Multi-node batch processing over a shared filesystem queue.
+
+Several nodes (machines, or several main.py processes on one machine)
+pointed at the same input and output directories claim PDFs through lease
+files in a shared queue directory, instead of each processing every file:
+
+    leases/<key>.lease   held by the node processing the PDF; created with
+                         O_CREAT | O_EXCL, so exactly one node wins a claim
+    done/<key>.json      result record of a finished (or finally failed) PDF,
+                         which is never claimed again
+
+A node renews its leases by touching them every Config.LEASE_HEARTBEAT
+seconds. A lease not renewed for Config.LEASE_TTL seconds belongs to a node
+that crashed or hung, and is taken over by renaming it away, which again
+only one node can do. Lease ages are measured against a file touched in the
+same directory, i.e. on the file server's clock, so nodes need no
+synchronised clocks.
+
+Lock files are used rather than a SQLite database because SQLite's locking
+is not reliable on NFS.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import socket
+import hashlib
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from .batch import _init_worker, _shutdown_worker, _run_one, _run_isolated, _should_retry, _summarize, order_pdfs
+from .writer import atomic_write
+from ..utils.metrics import write_run_metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+QUEUE_NAME = 'queue'
+
+
+def _safe_name(text):
+    return re.sub(r'[^\w.-]', '_', text)
+
+
+def default_node_id():
+    """Identifier of this process among the nodes sharing a queue."""
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class LeaseQueue:
+    def __init__(self, queue_dir=None, node=None, ttl=None, input_dir=None):
+        """
+        Open (creating if needed) a queue directory shared by several nodes.
+
+        Args:
+            queue_dir (str, optional): Shared queue directory. Defaults to
+                Config.QUEUE_DIR, or OUTPUT_DIR/queue
+            node (str, optional): This node's identifier. Defaults to host name and PID
+            ttl (float, optional): Seconds after which an unrenewed lease is taken over.
+                Defaults to Config.LEASE_TTL
+            input_dir (str, optional): Directory PDF keys are relative to, so that nodes
+                mounting it at different paths agree. Defaults to Config.INPUT_DIR
+        """
+        self.queue_dir = queue_dir or Config.QUEUE_DIR or os.path.join(Config.OUTPUT_DIR, QUEUE_NAME)
+        self.node = node or default_node_id()
+        self.ttl = Config.LEASE_TTL if ttl is None else ttl
+        self.input_dir = os.path.abspath(input_dir or Config.INPUT_DIR)
+        self.lease_dir = os.path.join(self.queue_dir, 'leases')
+        self.done_dir = os.path.join(self.queue_dir, 'done')
+        os.makedirs(self.lease_dir, exist_ok=True)
+        os.makedirs(self.done_dir, exist_ok=True)
+        self._clock_path = os.path.join(self.lease_dir, '.clock-' + _safe_name(self.node))
+
+        # Lease key -> (lease path, token written into it) for the leases this node holds
+        self._held = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def key(self, pdf_path):
+        """File-name-safe key of a PDF, from its path relative to the input directory."""
+        path = os.path.abspath(pdf_path)
+        if path.startswith(self.input_dir + os.sep):
+            path = os.path.relpath(path, self.input_dir)
+        name = _safe_name(path)[-80:]
+        return f"{name}-{hashlib.sha1(path.encode('utf-8')).hexdigest()[:12]}"
+
+    def _lease_path(self, pdf_path):
+        return os.path.join(self.lease_dir, self.key(pdf_path) + '.lease')
+
+    def _done_path(self, pdf_path):
+        return os.path.join(self.done_dir, self.key(pdf_path) + '.json')
+
+    def _now(self):
+        """Current time on the file server, read from a freshly touched file."""
+        with open(self._clock_path, 'a'):
+            pass
+        os.utime(self._clock_path, None)
+        return os.stat(self._clock_path).st_mtime
+
+    def _age(self, path):
+        """Seconds since a lease was created or renewed, or None when it is gone."""
+        try:
+            return self._now() - os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _create(self, path, pdf_path, attempt):
+        """Create a lease file; raises FileExistsError when another node holds it."""
+        token = uuid.uuid4().hex
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'node': self.node, 'token': token, 'pdf': pdf_path, 'attempt': attempt}, f)
+        return token
+
+    def is_done(self, pdf_path):
+        """True when some node has recorded the PDF as finished."""
+        return os.path.exists(self._done_path(pdf_path))
+
+    def claim(self, pdf_path):
+        """
+        Try to take the lease on a PDF.
+
+        Args:
+            pdf_path (str): Path to the PDF file
+
+        Returns:
+            int: Attempt number of this claim, above 1 when the PDF was taken over
+                from nodes whose leases expired; None when the PDF is finished or
+                held by a live node
+        """
+        if self.is_done(pdf_path):
+            return None
+        path = self._lease_path(pdf_path)
+        attempt = 1
+        try:
+            token = self._create(path, pdf_path, attempt)
+        except FileExistsError:
+            age = self._age(path)
+            if age is None or age <= self.ttl:
+                return None
+            # Renaming is atomic, so only one node takes an expired lease over
+            stale = f'{path}.{uuid.uuid4().hex}.stale'
+            try:
+                os.rename(path, stale)
+            except FileNotFoundError:
+                return None
+            if self._age(stale) <= self.ttl:
+                # Renewed just before the rename; hand it back unless it was already replaced
+                try:
+                    os.link(stale, path)
+                except OSError:
+                    pass
+                os.remove(stale)
+                return None
+            previous = self._read(stale)
+            os.remove(stale)
+            attempt = previous.get('attempt', 1) + 1
+            logger.warning(f"Taking over {os.path.basename(pdf_path)} from node "
+                           f"{previous.get('node')}, whose lease expired")
+            try:
+                token = self._create(path, pdf_path, attempt)
+            except FileExistsError:
+                return None
+
+        with self._lock:
+            self._held[self.key(pdf_path)] = (path, token)
+        # Another node may have finished it between the check and the claim
+        if self.is_done(pdf_path):
+            self.release(pdf_path)
+            return None
+        return attempt
+
+    def renew(self):
+        """
+        Touch every lease this node holds.
+
+        Returns:
+            list: Keys of leases found taken over by another node; they are dropped
+        """
+        lost = []
+        with self._lock:
+            held = list(self._held.items())
+        for key, (path, token) in held:
+            if self._read(path).get('token') == token:
+                try:
+                    os.utime(path, None)
+                    continue
+                except FileNotFoundError:
+                    pass
+            lost.append(key)
+            with self._lock:
+                self._held.pop(key, None)
+            logger.warning(f"Lease {key} was taken over by another node")
+        return lost
+
+    def release(self, pdf_path):
+        """Give up the lease on a PDF, e.g. when stopping before it finished."""
+        with self._lock:
+            path, token = self._held.pop(self.key(pdf_path), (None, None))
+        if path and self._read(path).get('token') == token:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def complete(self, pdf_path, result):
+        """
+        Record a PDF as finished and release its lease.
+
+        Args:
+            pdf_path (str): Path to the PDF file
+            result (dict): Result record, see batch._run_one
+        """
+        record = dict(result, node=self.node, finished=time.time())
+        atomic_write(self._done_path(pdf_path), json.dumps(record, indent=2))
+        self.release(pdf_path)
+
+    def start_heartbeat(self, interval=None):
+        """
+        Renew the held leases on a background thread.
+
+        Args:
+            interval (float, optional): Seconds between renewals. Defaults to Config.LEASE_HEARTBEAT
+        """
+        interval = interval or Config.LEASE_HEARTBEAT
+
+        def beat():
+            while not self._stop.wait(interval):
+                try:
+                    self.renew()
+                except OSError as e:
+                    logger.warning(f"Failed to renew leases: {str(e)}")
+
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=beat, name='lease-heartbeat', daemon=True)
+        self._heartbeat.start()
+
+    def close(self):
+        """Stop the heartbeat and release every lease still held."""
+        self._stop.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+            self._heartbeat = None
+        with self._lock:
+            held = list(self._held.values())
+            self._held.clear()
+        for path, token in held:
+            if self._read(path).get('token') == token:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        try:
+            os.remove(self._clock_path)
+        except FileNotFoundError:
+            pass
+
+
+class _Claims:
+    """
+    Hands out PDFs this node has claimed, in submission order.
+
+    PDFs held by other nodes are set aside and tried again every
+    Config.QUEUE_POLL_INTERVAL seconds, until they are finished or their
+    leases expire and can be taken over.
+    """
+
+    def __init__(self, queue, pdf_paths, attempts, max_takeovers=None):
+        self.queue = queue
+        self.attempts = attempts
+        self.max_takeovers = Config.LEASE_MAX_TAKEOVERS if max_takeovers is None else max_takeovers
+        self.takeovers = {}
+        self.pending = deque(pdf_paths)
+        self.held = []
+        self.skipped = 0
+        self._recheck = time.monotonic() + Config.QUEUE_POLL_INTERVAL
+
+    @property
+    def exhausted(self):
+        """True when every PDF has been handed out or finished elsewhere."""
+        return not self.pending and not self.held
+
+    def next(self):
+        """
+        Claim the next PDF.
+
+        Returns:
+            str: Path of a claimed PDF, or None when none can be claimed right now
+        """
+        while True:
+            while self.pending:
+                pdf_path = self.pending.popleft()
+                if self.queue.is_done(pdf_path):
+                    self.skipped += 1
+                    continue
+                attempt = self.queue.claim(pdf_path)
+                if attempt is not None:
+                    # Nodes that died holding the PDF don't use up its retries
+                    self.attempts[pdf_path] = 0
+                    self.takeovers[pdf_path] = attempt - 1
+                    return pdf_path
+                self.held.append(pdf_path)
+            if not self.held or time.monotonic() < self._recheck:
+                return None
+            self.pending.extend(self.held)
+            self.held = []
+            self._recheck = time.monotonic() + Config.QUEUE_POLL_INTERVAL
+
+    def abandoned(self, pdf_path):
+        """
+        Check whether so many nodes died holding a claimed PDF that it is
+        likely the cause, in which case it is failed instead of processed.
+
+        Returns:
+            dict: Failed result record, or None when the PDF should be processed
+        """
+        takeovers = self.takeovers.get(pdf_path, 0)
+        if not self.max_takeovers or takeovers < self.max_takeovers:
+            return None
+        return {
+            'pdf': pdf_path,
+            'status': 'failed',
+            'error': f"Abandoned after {takeovers} nodes died holding its lease",
+            'failure': 'lease'
+        }
+
+
+def run_distributed(pdf_paths, workers=None, order='name', retries=0, summary_path=None, metrics_path=None,
+                    queue=None):
+    """
+    Process PDFs as one of several nodes sharing a lease queue.
+
+    The node keeps claiming PDFs until every PDF in pdf_paths is finished by
+    some node. Claims and completions are a few file operations per PDF, so
+    throughput scales with the number of nodes. Failed PDFs are recorded as
+    finished too, after their retries; delete their done records to queue
+    them again.
+
+    Args:
+        pdf_paths (list): Paths to PDF files, the same list on every node
+        workers (int, optional): Worker processes on this node. Defaults to Config.WORKERS
+        order (str): Claim order, see batch.order_pdfs
+        retries (int): How many times a failed PDF is retried on this node. Runs cut
+            short by a node dying are limited by Config.LEASE_MAX_TAKEOVERS instead
+        summary_path (str, optional): Where to write this node's summary as JSON
+        metrics_path (str, optional): Run-level metrics file when Config.METRICS_ENABLED
+            is set, see metrics.write_run_metrics
+        queue (LeaseQueue, optional): Queue to use. Defaults to LeaseQueue()
+
+    Returns:
+        dict: Run summary of the PDFs this node processed, with the node id and
+            the number of PDFs skipped because other nodes had finished them
+    """
+    workers = workers or Config.WORKERS
+    queue = queue or LeaseQueue()
+    attempts = {}
+    results = {}
+    start = time.perf_counter()
+    claims = _Claims(queue, order_pdfs(pdf_paths, order), attempts)
+
+    def finished(pdf_path, result):
+        results[pdf_path] = result
+        queue.complete(pdf_path, dict(result, attempts=attempts[pdf_path]))
+
+    logger.info(f"Node {queue.node} processing from queue {queue.queue_dir}")
+    queue.start_heartbeat()
+    try:
+        if workers <= 1:
+            _init_worker()
+            try:
+                _run_claims(claims, attempts, retries, finished)
+            finally:
+                _shutdown_worker()
+        else:
+            while True:
+                rerun = _run_pool(claims, workers, attempts, retries, finished)
+                if not rerun:
+                    break
+                # A crash broke the pool; find the PDF that caused it by running each alone
+                for pdf_path in rerun:
+                    _run_isolated(pdf_path, attempts, retries, finished)
+    finally:
+        queue.close()
+
+    summary = _summarize(results, attempts, workers, time.perf_counter() - start)
+    summary['node'] = queue.node
+    summary['skipped'] = claims.skipped
+    if summary_path:
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    if Config.METRICS_ENABLED:
+        write_run_metrics(summary, metrics_path)
+    return summary
+
+
+def _run_claims(claims, attempts, retries, finished):
+    """Process claimed PDFs one at a time in this process."""
+    while True:
+        pdf_path = claims.next()
+        if pdf_path is None:
+            if claims.exhausted:
+                return
+            time.sleep(Config.QUEUE_POLL_INTERVAL)
+            continue
+        abandoned = claims.abandoned(pdf_path)
+        if abandoned:
+            finished(pdf_path, abandoned)
+            continue
+        while True:
+            attempts[pdf_path] += 1
+            result = _run_one(pdf_path)
+            if not _should_retry(result, attempts, retries):
+                break
+        finished(pdf_path, result)
+
+
+def _run_pool(claims, workers, attempts, retries, finished):
+    """
+    Drive one process pool, keeping every worker busy with claimed PDFs,
+    until no PDF is left to claim or the pool breaks.
+
+    Returns:
+        list: Claimed PDFs to rerun one at a time after a worker died hard:
+            those in flight, none of which is charged an attempt since any of
+            them may have caused it, and failed ones whose retry was due
+    """
+    rerun = []
+    broken = False
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {}
+        while True:
+            # A broken pool takes no new work
+            while not broken and len(futures) < workers:
+                pdf_path = claims.next()
+                if pdf_path is None:
+                    break
+                abandoned = claims.abandoned(pdf_path)
+                if abandoned:
+                    finished(pdf_path, abandoned)
+                    continue
+                try:
+                    futures[executor.submit(_run_one, pdf_path)] = pdf_path
+                except BrokenProcessPool:
+                    # The pool broke before any of its futures said so; the
+                    # claim is kept and rerun alone like the PDFs in flight
+                    broken = True
+                    rerun.append(pdf_path)
+                    break
+                attempts[pdf_path] += 1
+
+            if not futures:
+                if broken or claims.exhausted:
+                    break
+                time.sleep(Config.QUEUE_POLL_INTERVAL)
+                continue
+
+            # With idle workers, look for PDFs freed by other nodes now and then
+            timeout = Config.QUEUE_POLL_INTERVAL if len(futures) < workers and not claims.exhausted else None
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                pdf_path = futures.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    # The lease is still held, and no done record is written
+                    broken = True
+                    attempts[pdf_path] -= 1
+                    rerun.append(pdf_path)
+                    continue
+
+                if not _should_retry(result, attempts, retries):
+                    finished(pdf_path, result)
+                elif broken:
+                    # _run_isolated counts the retry
+                    rerun.append(pdf_path)
+                else:
+                    attempts[pdf_path] += 1
+                    futures[executor.submit(_run_one, pdf_path)] = pdf_path
+
+    return rerun
@@ -6,33 +6,81 @@ import os
 import cv2
 import numpy as np
 import logging
-from PIL import Image
-from selenium.webdriver.common.by import By
-from ..utils.helpers import get_bounding_box, compute_overlap, find_caption_text
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ..utils.helpers import get_bounding_box, get_page_dimensions, compute_overlap, find_caption_text, CAPTION_PREFIXES
+from ..utils.metrics import NULL_METRICS
+from .caption_parser import detect_page_captions
+from .matcher import match_page
+from .detector import detect_figure_boxes, detect_figure_boxes_tiled
+from .records import FigureRecord, ClippedFigureRecord
+from .renderer import TiledPage
+from .dedup import dhash
+from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Longest side of the reduced page that figures on tiled pages are hashed from
+TILED_HASH_SIZE = 2048
+
+def page_planes(page_image):
+    """
+    Split a rendered page into the buffer figures are cropped from and the
+    gray plane detection runs on, allocating at most the gray plane.
+    
+    Args:
+        page_image: (height, width, 3) RGB or (height, width) gray page; PIL images
+            are accepted too and converted once
+        
+    Returns:
+        tuple: (page, gray, channel_order) where page is the page buffer itself
+            and channel_order is 'RGB' or 'GRAY'
+    """
+    page = np.asarray(page_image)
+    if page.ndim == 2:
+        return page, page, 'GRAY'
+    return page, cv2.cvtColor(page, cv2.COLOR_RGB2GRAY), 'RGB'
+
 class FigureExtractor:
-    def __init__(self, min_figure_size=100, caption_distance_threshold=50):
+    def __init__(self, min_figure_size=100, caption_distance_threshold=50, caption_backend=None, detector=None):
         """
         Initialize the figure extractor.
         
         Args:
             min_figure_size (int): Minimum size in pixels for a region to be considered a figure
             caption_distance_threshold (int): Maximum distance between figure and caption
+            caption_backend (str, optional): 'lxml' or 'selenium'. Defaults to Config.CAPTION_BACKEND
+            detector (str, optional): 'components' or 'contours'. Defaults to Config.FIGURE_DETECTOR
         """
         self.min_figure_size = min_figure_size
         self.caption_distance_threshold = caption_distance_threshold
+        self.caption_backend = caption_backend
+        self.detector = detector
+
+    def settings(self):
+        """Settings that change extraction results, e.g. for cache keys."""
+        return {
+            'min_figure_size': self.min_figure_size,
+            'caption_distance_threshold': self.caption_distance_threshold,
+            'caption_backend': self.caption_backend or Config.CAPTION_BACKEND,
+            'detector': self.detector or Config.FIGURE_DETECTOR,
+            'detector_threshold': Config.DETECTOR_THRESHOLD,
+            'detector_merge_gap': Config.DETECTOR_MERGE_GAP,
+            'detector_merge_overlap': Config.DETECTOR_MERGE_OVERLAP,
+            'detector_seed_fraction': Config.DETECTOR_SEED_FRACTION,
+            'match_above_penalty': Config.MATCH_ABOVE_PENALTY,
+            'match_side_penalty': Config.MATCH_SIDE_PENALTY
+        }
 
-    def extract_figures_and_captions(self, pdf_path, html_dir, images, driver):
+    def extract_figures_and_captions(self, pdf_path, html_dir, images, driver=None):
         """
         Extract figures and their associated captions from a PDF document.
         
         Args:
             pdf_path (str): Path to the PDF file
             html_dir (str): Directory containing HTML version of the PDF
-            images (list): List of PIL Image objects for each page
-            driver: Selenium WebDriver instance
+            images (list): RGB page images (PIL Images or numpy arrays) for each page
+            driver: Selenium WebDriver instance, only used by the 'selenium' caption backend
             
         Returns:
             tuple: Lists of figures and captions for each page
@@ -40,86 +88,350 @@ class FigureExtractor:
         figures = []
         captions = []
         
-        for page_num, page_image in enumerate(images, 1):
-            # Convert PIL image to OpenCV format
-            cv_image = cv2.cvtColor(np.array(page_image), cv2.COLOR_RGB2BGR)
+        pages = enumerate(images, 1)
+        for _, matched_figures, matched_captions in self.iter_figures_and_captions(
+                pdf_path, html_dir, pages, driver):
+            figures.append(matched_figures)
+            captions.append(matched_captions)
             
-            # Process HTML page
-            html_path = os.path.join(html_dir, f'page{page_num}.html')
-            if not os.path.exists(html_path):
-                continue
-                
-            # Find figures in the page
-            page_figures = self._detect_figures(cv_image)
+        return figures, captions
+        
+    def iter_figures_and_captions(self, pdf_path, html_dir, pages, driver=None, metrics=None, render_dpi=None,
+                                  page_workers=None, html_ready=None):
+        """
+        Extract figures and captions page by page as rendered pages arrive.
+        
+        With several page workers, pages are processed on a thread pool (OpenCV
+        and lxml release the GIL) while the next pages are rendered; results are
+        still yielded in page order and match the sequential ones.
+        
+        Args:
+            pdf_path (str): Path to the PDF file
+            html_dir (str): Directory containing HTML version of the PDF
+            pages (iterable): (page_number, page) pairs with RGB or gray pages, e.g. from
+                renderer.iter_pdf_pages; gray pages are only valid in two-pass mode.
+                A renderer.TiledPage is detected band by band
+            driver: Selenium WebDriver instance, only used by the 'selenium' caption backend
+            metrics (PdfMetrics, optional): Collector for per-stage timings
+            render_dpi (int, optional): DPI the pages were rendered at. When it is below
+                Config.DPI, figures are detected on these pages and each figure is
+                re-rendered at Config.DPI from the PDF when it is saved (two-pass mode);
+                boxes are reported at Config.DPI either way
+            page_workers (int, optional): Pages processed concurrently. Defaults to
+                Config.PAGE_WORKERS; the 'selenium' backend always runs sequentially
+            html_ready (callable, optional): Called with a page number before that
+                page's HTML is read, blocking until it exists (sharded conversion)
+            
+        Yields:
+            tuple: (page_number, matched figures, matched captions)
+        """
+        metrics = metrics or NULL_METRICS
+        scale = Config.DPI / render_dpi if render_dpi and render_dpi != Config.DPI else 1.0
+        workers = page_workers or Config.PAGE_WORKERS
+        if (self.caption_backend or Config.CAPTION_BACKEND) == 'selenium':
+            # A WebDriver can only load one page at a time
+            workers = 1
+        
+        if workers <= 1:
+            for page_num, page_image in pages:
+                result = self._process_page(pdf_path, html_dir, page_num, page_image, driver, metrics, scale,
+                                            html_ready)
+                if result is not None:
+                    yield result
+            return
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='page') as executor:
+            pending = deque()
+            try:
+                for page_num, page_image in pages:
+                    pending.append(executor.submit(self._process_page, pdf_path, html_dir, page_num,
+                                                   page_image, driver, metrics, scale, html_ready))
+                    # Hold at most two pages per worker; finished pages leave in order
+                    while pending and (len(pending) >= 2 * workers or pending[0].done()):
+                        result = pending.popleft().result()
+                        if result is not None:
+                            yield result
+                while pending:
+                    result = pending.popleft().result()
+                    if result is not None:
+                        yield result
+            finally:
+                for future in pending:
+                    future.cancel()
+        
+    def _process_page(self, pdf_path, html_dir, page_num, page_image, driver, metrics, scale, html_ready=None):
+        """
+        Detect figures and captions on one page and match them.
+        
+        Args:
+            pdf_path (str): Path to the PDF file
+            html_dir (str): Directory containing HTML version of the PDF
+            page_num (int): 1-based page number
+            page_image: Rendered RGB or gray page, or a TiledPage
+            driver: Selenium WebDriver instance, or None
+            metrics (PdfMetrics): Collector for per-stage timings
+            scale (float): Ratio of Config.DPI to the page's resolution
+            html_ready (callable, optional): Blocks until the page's HTML exists
             
-            # Find captions in the HTML
-            page_captions = self._detect_captions(driver, html_path)
+        Returns:
+            tuple: (page_number, matched figures, matched captions), or None when
+                the page has no HTML
+        """
+        # Process HTML page
+        if html_ready is not None:
+            with metrics.stage('html'):
+                html_ready(page_num)
+        html_path = os.path.join(html_dir, f'page{page_num}.html')
+        if not os.path.exists(html_path):
+            return None
             
-            # Match figures with captions
+        with metrics.stage('detect_figures', pages=1) as stage:
+            if isinstance(page_image, TiledPage):
+                page_figures, image_shape = self._detect_tiled_figures(pdf_path, page_num, page_image, scale)
+            else:
+                page_figures, image_shape = self._detect_page_figures(pdf_path, page_num, page_image, scale)
+            stage.figures = len(page_figures)
+        
+        # Find captions in the HTML
+        with metrics.stage('detect_captions', pages=1):
+            page_captions, page_size = self._detect_captions(driver, html_path)
+        
+        # Match figures with captions
+        with metrics.stage('match', pages=1, figures=len(page_figures)):
             matched_figures, matched_captions = self._match_figures_and_captions(
                 page_figures,
                 page_captions,
-                cv_image.shape
+                image_shape,
+                page_size
             )
+        
+        return page_num, matched_figures, matched_captions
+        
+    def _detect_page_figures(self, pdf_path, page_num, page_image, scale):
+        """
+        Detect figures on a rendered page.
+        
+        Args:
+            pdf_path (str): Path to the PDF file
+            page_num (int): 1-based page number
+            page_image: Rendered RGB or gray page
+            scale (float): Ratio of Config.DPI to the page's resolution
             
-            figures.append(matched_figures)
-            captions.append(matched_captions)
+        Returns:
+            tuple: (figures, shape of the page at Config.DPI)
+        """
+        # The page buffer is kept as rendered; detection only needs its gray plane
+        page, gray, channel_order = page_planes(page_image)
+        
+        # Find figures in the page
+        if scale == 1.0:
+            page_figures = [
+                FigureRecord(box, page, channel_order) for box in self._detect_figure_boxes(gray)
+            ]
+            image_shape = page.shape
+        else:
+            image_shape = (round(page.shape[0] * scale), round(page.shape[1] * scale))
+            page_figures = [
+                ClippedFigureRecord(box, pdf_path, page_num, Config.DPI, image_shape[0])
+                for box in self._detect_figure_boxes(gray, scale)
+            ]
+        if Config.DEDUP_ENABLED:
+            self._hash_figures(page_figures, gray, scale)
+        return page_figures, image_shape
+        
+    def _detect_tiled_figures(self, pdf_path, page_num, page, scale):
+        """
+        Detect figures on a page too large to render whole.
+        
+        The page is rendered and labelled one band at a time (see
+        detector.detect_figure_boxes_tiled), so a figure crossing bands is found
+        in one piece. Its pixels are rendered from the PDF in one region when it
+        is saved, like in two-pass mode. Tiled pages always use the
+        'components' detector.
+        
+        Args:
+            pdf_path (str): Path to the PDF file
+            page_num (int): 1-based page number
+            page (TiledPage): The page
+            scale (float): Ratio of Config.DPI to the page's resolution
             
-        return figures, captions
+        Returns:
+            tuple: (figures, shape of the page at Config.DPI)
+        """
+        height, width = page.shape
+        image_shape = (round(height * scale), round(width * scale))
+        
+        # Hashes come from a reduced copy of the page assembled from the bands
+        factor = min(1.0, TILED_HASH_SIZE / max(height, width))
+        reduced = []
+        
+        def bands():
+            for y, band in page.iter_bands():
+                if Config.DEDUP_ENABLED:
+                    top, bottom = round(y * factor), round((y + band.shape[0]) * factor)
+                    if bottom > top:
+                        reduced.append(cv2.resize(band, (max(1, round(width * factor)), bottom - top),
+                                                  interpolation=cv2.INTER_AREA))
+                yield y, band
+        
+        min_size = max(1, round(self.min_figure_size / scale))
+        merge_gap = round(Config.DETECTOR_MERGE_GAP / scale)
+        boxes = [tuple(int(v) for v in box) for box in detect_figure_boxes_tiled(bands(), min_size, merge_gap=merge_gap)]
+        page_figures = [
+            ClippedFigureRecord(box, pdf_path, page_num, Config.DPI, image_shape[0])
+            for box in self._scale_boxes(boxes, page.shape, scale)
+        ]
+        if Config.DEDUP_ENABLED and reduced:
+            self._hash_figures(page_figures, np.vstack(reduced), scale / factor)
+        return page_figures, image_shape
+        
+    def _detect_figures(self, image, channel_order='BGR'):
+        """
+        Detect potential figure regions in an image.
+        
+        Args:
+            image: Page as a numpy array
+            channel_order (str): 'BGR', 'RGB' or 'GRAY', the layout of image
+            
+        Returns:
+            list: FigureRecord per detected region, viewing into image without copying
+        """
+        if channel_order == 'GRAY':
+            gray = image
+        else:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY if channel_order == 'BGR' else cv2.COLOR_RGB2GRAY)
+        # Pixels are only converted and encoded when a figure is saved
+        figures = [FigureRecord(box, image, channel_order) for box in self._detect_figure_boxes(gray)]
+        if Config.DEDUP_ENABLED:
+            self._hash_figures(figures, gray)
+        return figures
+        
+    def _hash_figures(self, figures, gray, scale=1.0):
+        """
+        Set the perceptual hash of each figure from the gray detection page, so
+        that duplicates are recognised without rendering their pixels.
+        
+        Args:
+            figures (list): FigureRecords with boxes at the output resolution
+            gray: Grayscale page the figures were detected on
+            scale (float): Ratio of the output resolution to the page's
+        """
+        for figure in figures:
+            x, y, w, h = (int(round(v / scale)) for v in figure.bbox)
+            figure.phash = dhash(gray[y:y+h, x:x+w])
+        
+    def _detect_figure_boxes(self, gray, scale=1.0):
+        """
+        Detect figure bounding boxes in a page.
+        
+        Args:
+            gray: Grayscale page
+            scale (float): Ratio of the output resolution to the image's. Pixel
+                thresholds (minimum size, merge gap) are given at the output
+                resolution and are scaled down, and the boxes are scaled up
+                (see _scale_boxes)
+            
+        Returns:
+            list: (x, y, width, height) boxes at the output resolution
+        """
+        min_size = max(1, round(self.min_figure_size / scale))
         
-    def _detect_figures(self, image):
+        detector = self.detector or Config.FIGURE_DETECTOR
+        if detector == 'components':
+            merge_gap = round(Config.DETECTOR_MERGE_GAP / scale)
+            boxes = [tuple(int(v) for v in box) for box in detect_figure_boxes(gray, min_size, merge_gap=merge_gap)]
+        elif detector == 'contours':
+            boxes = self._detect_contour_boxes(gray, min_size)
+        else:
+            raise ValueError(f"Unknown figure detector: {detector}")
+        
+        return self._scale_boxes(boxes, gray.shape, scale)
+        
+    def _scale_boxes(self, boxes, shape, scale):
         """
-        Detect potential figure regions in an image using contour detection.
+        Scale boxes from the detection image to the output resolution, padded by
+        one image pixel to cover partially covered edge pixels.
         
         Args:
-            image: OpenCV image
+            boxes (list): (x, y, width, height) boxes in image pixels
+            shape (tuple): (height, width) of the image
+            scale (float): Ratio of the output resolution to the image's
             
         Returns:
-            list: Detected figure regions with their bounding boxes
+            list: (x, y, width, height) boxes at the output resolution
         """
-        # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if scale == 1.0:
+            return boxes
         
+        height, width = round(shape[0] * scale), round(shape[1] * scale)
+        pad = int(np.ceil(scale))
+        scaled = []
+        for x, y, w, h in boxes:
+            x0 = max(0, int(np.floor(x * scale)) - pad)
+            y0 = max(0, int(np.floor(y * scale)) - pad)
+            x1 = min(width, int(np.ceil((x + w) * scale)) + pad)
+            y1 = min(height, int(np.ceil((y + h) * scale)) + pad)
+            scaled.append((x0, y0, x1 - x0, y1 - y0))
+        return scaled
+        
+    def _detect_contour_boxes(self, gray, min_size=None):
+        """
+        Detect figure bounding boxes from the external contours of a grayscale page.
+        
+        Args:
+            gray: Grayscale OpenCV image
+            min_size (int, optional): Minimum width and height. Defaults to min_figure_size
+            
+        Returns:
+            list: (x, y, width, height) boxes
+        """
+        min_size = min_size or self.min_figure_size
         # Threshold the image
-        _, thresh = cv2.threshold(gray, 240, 255, cv2.THRESH_BINARY_INV)
+        _, thresh = cv2.threshold(gray, Config.DETECTOR_THRESHOLD, 255, cv2.THRESH_BINARY_INV)
         
         # Find contours
         contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
-        figures = []
+        boxes = []
         for contour in contours:
             x, y, w, h = cv2.boundingRect(contour)
             
             # Filter small regions
-            if w < self.min_figure_size or h < self.min_figure_size:
+            if w < min_size or h < min_size:
                 continue
                 
-            # Extract the region
-            region = image[y:y+h, x:x+w]
+            boxes.append((x, y, w, h))
             
-            figures.append({
-                'bbox': (x, y, w, h),
-                'image': Image.fromarray(cv2.cvtColor(region, cv2.COLOR_BGR2RGB))
-            })
-            
-        return figures
+        return boxes
         
     def _detect_captions(self, driver, html_path):
         """
         Detect figure captions in the HTML version of the page.
         
         Args:
-            driver: Selenium WebDriver instance
+            driver: Selenium WebDriver instance, or None for the 'lxml' backend
             html_path (str): Path to the HTML file
             
         Returns:
-            list: Detected captions with their bounding boxes and text
+            tuple: (detected captions with their bounding boxes and text,
+                (width, height) of the HTML page or None)
         """
+        backend = self.caption_backend or Config.CAPTION_BACKEND
+        if backend == 'lxml':
+            return detect_page_captions(html_path)
+        if backend != 'selenium':
+            raise ValueError(f"Unknown caption backend: {backend}")
+        if driver is None:
+            raise ValueError("The 'selenium' caption backend requires a WebDriver")
+        
+        from selenium.webdriver.common.by import By
+        
         driver.get(f'file://{html_path}')
         
         captions = []
         # Find elements that might be captions (starting with "Figure" or "Fig.")
-        elements = driver.find_elements(By.XPATH, "//div[starts-with(text(),'Figure') or starts-with(text(),'Fig.')]")
+        condition = ' or '.join(f"starts-with(text(),'{prefix}')" for prefix in CAPTION_PREFIXES)
+        elements = driver.find_elements(By.XPATH, f"//div[{condition}]")
         
         for element in elements:
             bbox = get_bounding_box(element)
@@ -130,68 +442,44 @@ class FigureExtractor:
                     'bbox': bbox,
                     'text': text
                 })
+        
+        # The page background image spans the whole page
+        page_size = None
+        images = driver.find_elements(By.TAG_NAME, 'img')
+        if images:
+            width, height = get_page_dimensions(images[0])
+            if width and height:
+                page_size = (width, height)
                 
-        return captions
+        return captions, page_size
         
-    def _match_figures_and_captions(self, figures, captions, image_shape):
+    def _match_figures_and_captions(self, figures, captions, image_shape, page_size=None):
         """
         Match detected figures with their corresponding captions based on proximity and layout.
         
+        Caption boxes are in HTML pixels and are scaled to the page raster before
+        the min-cost assignment is solved (see matcher.match_page).
+        
         Args:
             figures (list): Detected figures
             captions (list): Detected captions
             image_shape (tuple): Shape of the page image
+            page_size (tuple, optional): (width, height) of the HTML page
             
         Returns:
             tuple: Matched figures and captions
         """
-        matched_figures = []
-        matched_captions = []
-        
-        used_captions = set()
-        
-        for figure in figures:
-            best_caption = None
-            best_distance = float('inf')
-            
-            fig_bbox = figure['bbox']
-            
-            for i, caption in enumerate(captions):
-                if i in used_captions:
-                    continue
-                    
-                cap_bbox = caption['bbox']
-                
-                # Calculate distance between figure and caption
-                distance = self._calculate_distance(fig_bbox, cap_bbox)
-                
-                if distance < self.caption_distance_threshold and distance < best_distance:
-                    best_caption = caption
-                    best_caption_idx = i
-                    best_distance = distance
-                    
-            if best_caption:
-                matched_figures.append(figure)
-                matched_captions.append(best_caption)
-                used_captions.add(best_caption_idx)
-            else:
-                # Figure without caption
-                matched_figures.append(figure)
-                matched_captions.append(None)
-                
-        return matched_figures, matched_captions
+        scale = image_shape[1] / page_size[0] if page_size and page_size[0] else 1.0
         
-    def _calculate_distance(self, bbox1, bbox2):
-        """Calculate the minimum distance between two bounding boxes."""
-        x1, y1, w1, h1 = bbox1
-        x2, y2, w2, h2 = bbox2
+        fig_boxes = [figure.bbox for figure in figures]
+        cap_boxes = np.asarray([caption['bbox'] for caption in captions], dtype=np.float64).reshape(-1, 4) * scale
         
-        # Calculate centers
-        center1 = (x1 + w1/2, y1 + h1/2)
-        center2 = (x2 + w2/2, y2 + h2/2)
+        matches = match_page(fig_boxes, cap_boxes, self.caption_distance_threshold)
         
-        return np.sqrt((center1[0] - center2[0])**2 + (center1[1] - center2[1])**2)
+        matched_captions = [captions[index] if index >= 0 else None for index in matches]
+        return list(figures), matched_captions
 
 # Create a default instance
 extractor = FigureExtractor()
 extract_figures_and_captions = extractor.extract_figures_and_captions
+iter_figures_and_captions = extractor.iter_figures_and_captions
@@ -0,0 +1,236 @@
+"""
+Sharded xpdf HTML conversion.
+
+A single pdftohtml call on a long document has to finish before any caption
+can be read. In sharded mode the document is split into page ranges, each
+converted by its own pdftohtml process (-f/-l) into a separate directory,
+and as each shard finishes its pages are moved into the usual
+pageN.html layout, so caption extraction of early pages overlaps with the
+conversion of later ones.
+"""
+
+import os
+import re
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ..utils.supervisor import ToolError, run_tool, record_retry
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_PAGES_RE = re.compile(r'^Pages:\s*(\d+)', re.MULTILINE)
+_PAGE_SIZE_RE = re.compile(r'^Page\s+(\d+) size:\s*([\d.]+) x ([\d.]+) pts', re.MULTILINE)
+_PAGE_ROT_RE = re.compile(r'^Page\s+(\d+) rot:\s*(-?\d+)', re.MULTILINE)
+_PAGE_FILE_RE = re.compile(r'^page(\d+)\.')
+
+
+def _pdfinfo(pdf_path, options=(), quiet=False):
+    """pdfinfo's output for a PDF, or None when it cannot be run."""
+    try:
+        completed = run_tool('pdfinfo', [Config.PDFINFO_PATH, *options, pdf_path], timeout=60, capture_stdout=True)
+    except ToolError as e:
+        (logger.debug if quiet else logger.warning)(f"Could not run pdfinfo on {pdf_path}: {str(e)}")
+        return None
+    return completed.stdout.decode('utf-8', 'replace')
+
+
+def pdfinfo_available():
+    """True when Config.PDFINFO_PATH names an executable, checked without running it."""
+    return shutil.which(Config.PDFINFO_PATH) is not None
+
+
+def pdf_page_count(pdf_path, quiet=False):
+    """
+    Number of pages in a PDF according to xpdf's pdfinfo.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        quiet (bool): Log a failure at debug level only
+
+    Returns:
+        int: Page count, or None when pdfinfo is unavailable or fails
+    """
+    output = _pdfinfo(pdf_path, quiet=quiet)
+    match = _PAGES_RE.search(output) if output else None
+    return int(match.group(1)) if match else None
+
+
+def pdf_page_sizes(pdf_path, quiet=False):
+    """
+    Size of every page as rendered, according to xpdf's pdfinfo.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        quiet (bool): Log a failure at debug level only
+
+    Returns:
+        dict: 1-based page number -> (width, height) in points with the page
+            rotation applied, or None when pdfinfo is unavailable or fails
+    """
+    page_count = pdf_page_count(pdf_path, quiet)
+    if not page_count:
+        return None
+    output = _pdfinfo(pdf_path, ('-f', '1', '-l', str(page_count)), quiet)
+    if output is None:
+        return None
+    rotations = {int(page): int(rotation) for page, rotation in _PAGE_ROT_RE.findall(output)}
+    sizes = {}
+    for page, width, height in _PAGE_SIZE_RE.findall(output):
+        page, width, height = int(page), float(width), float(height)
+        if rotations.get(page, 0) % 180 == 90:
+            width, height = height, width
+        sizes[page] = (width, height)
+    return sizes
+
+
+def run_pdftohtml(pdf_path, output_path, first_page=None, last_page=None):
+    """
+    Run xpdf's pdftohtml under supervision.
+
+    A call that times out, crashes or runs out of memory is retried
+    Config.TOOL_RETRIES times; other failures are raised at once.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        output_path (str): Directory to create, replaced if it exists
+        first_page (int, optional): First page to convert
+        last_page (int, optional): Last page to convert
+
+    Raises:
+        ToolError: When the conversion failed
+    """
+    command = [Config.XPDF_PATH]
+    if first_page is not None:
+        command += ['-f', str(first_page)]
+    if last_page is not None:
+        command += ['-l', str(last_page)]
+    command += [pdf_path, output_path]
+
+    attempt = 0
+    while True:
+        # pdftohtml refuses to write into an existing directory
+        if os.path.exists(output_path):
+            shutil.rmtree(output_path)
+        try:
+            run_tool('pdftohtml', command, timeout=Config.HTML_TIMEOUT)
+            return
+        except ToolError as e:
+            if not e.retryable or attempt >= Config.TOOL_RETRIES:
+                raise
+            attempt += 1
+            record_retry('pdftohtml')
+            logger.warning(f"Retrying pdftohtml on {os.path.basename(pdf_path)} after {e.kind}")
+
+
+def shard_ranges(page_count, shard_pages):
+    """
+    Split pages 1..page_count into consecutive ranges.
+
+    Returns:
+        list: (first_page, last_page) pairs, inclusive
+    """
+    return [(first, min(first + shard_pages - 1, page_count))
+            for first in range(1, page_count + 1, shard_pages)]
+
+
+class ShardedHtmlConversion:
+    def __init__(self, pdf_path, output_path, page_count, shard_pages=None, workers=None):
+        """
+        Convert a PDF to HTML with concurrent pdftohtml calls over page ranges.
+
+        Shards are started in page order as soon as the object is created.
+
+        Args:
+            pdf_path (str): Path to the PDF file
+            output_path (str): Directory that receives the pageN.html files,
+                replaced if it exists
+            page_count (int): Pages in the PDF
+            shard_pages (int, optional): Pages per shard. Defaults to Config.HTML_SHARD_PAGES
+            workers (int, optional): Concurrent pdftohtml processes. Defaults to Config.HTML_WORKERS
+        """
+        self.pdf_path = pdf_path
+        self.output_path = output_path
+        self.shard_pages = shard_pages or Config.HTML_SHARD_PAGES
+        self.ranges = shard_ranges(page_count, self.shard_pages)
+        self.shard_root = output_path + '.shards'
+        for path in (output_path, self.shard_root):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+        os.makedirs(output_path)
+        os.makedirs(self.shard_root)
+
+        self._merge_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers or Config.HTML_WORKERS,
+                                            thread_name_prefix='pdftohtml')
+        self._futures = [self._executor.submit(self._convert, first, last) for first, last in self.ranges]
+
+    def _convert(self, first_page, last_page):
+        """Convert one page range and move its files into the output directory."""
+        shard_dir = os.path.join(self.shard_root, f'{first_page}-{last_page}')
+        try:
+            run_pdftohtml(self.pdf_path, shard_dir, first_page, last_page)
+        except ToolError as e:
+            logger.error(f"Error converting pages {first_page}-{last_page} to HTML: {str(e)}")
+            raise
+
+        with self._merge_lock:
+            for name in sorted(os.listdir(shard_dir)):
+                target = os.path.join(self.output_path, name)
+                # Page files are unique to their shard; shared files (index.html, fonts) come from
+                # the first shard, even when a later one is merged before it
+                if _PAGE_FILE_RE.match(name) or first_page == 1 or not os.path.exists(target):
+                    os.replace(os.path.join(shard_dir, name), target)
+            shutil.rmtree(shard_dir, ignore_errors=True)
+
+    def wait_page(self, page_num):
+        """
+        Block until the shard containing a page has been converted.
+
+        Raises:
+            ToolError: When that shard's pdftohtml call failed
+        """
+        index = (page_num - 1) // self.shard_pages
+        if 0 <= index < len(self._futures):
+            self._futures[index].result()
+
+    def wait(self):
+        """Block until every shard has been converted, raising the first failure."""
+        for future in self._futures:
+            future.result()
+        shutil.rmtree(self.shard_root, ignore_errors=True)
+
+    def close(self):
+        """Stop starting new shards and wait for running ones."""
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        shutil.rmtree(self.shard_root, ignore_errors=True)
+
+
+def start_html_conversion(pdf_path, output_path):
+    """
+    Start a sharded conversion when it applies.
+
+    Sharding needs more than one HTML worker, a document longer than one
+    shard and the 'lxml' caption backend: xpdf numbers font files per call,
+    so merged shards only keep the first shard's fonts, which matters for
+    browser layout but not for the text positions lxml reads.
+
+    Args:
+        pdf_path (str): Path to the PDF file
+        output_path (str): Directory that receives the pageN.html files
+
+    Returns:
+        ShardedHtmlConversion: The running conversion, or None when the caller
+            should convert the whole document in one call
+    """
+    if Config.HTML_WORKERS <= 1 or Config.CAPTION_BACKEND != 'lxml':
+        return None
+    page_count = pdf_page_count(pdf_path)
+    if not page_count or page_count <= Config.HTML_SHARD_PAGES:
+        return None
+    conversion = ShardedHtmlConversion(pdf_path, output_path, page_count)
+    logger.info(f"Converting {os.path.basename(pdf_path)} to HTML in {len(conversion.ranges)} shards")
+    return conversion
@@ -0,0 +1,406 @@
+"""
+Corpus-wide SQLite index of extracted figures and captions.
+
+process_pdf writes every finished PDF into a single database (by default
+index.sqlite in Config.OUTPUT_DIR) in one transaction per document, so the
+whole corpus can be searched without loading each metadata.json:
+
+    documents  one row per PDF: name, path, SHA-256, output directory, counts
+    pages      pages that were annotated, with their figure counts
+    figures    bbox, caption text and bbox, image file and its SHA-256, or the
+               image it duplicates (see dedup.py)
+    figures_fts  FTS5 index over the caption text, kept in sync by triggers
+    figure_hashes  perceptual hashes of saved figure images, for deduplication
+
+The database runs in WAL mode with a busy timeout so that several worker
+processes can write to it. Where SQLite is built without FTS5, searches fall
+back to a LIKE match on the caption text.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from .cache import file_digest
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = 'index.sqlite'
+SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    pdf_path TEXT,
+    pdf_sha256 TEXT,
+    output_dir TEXT NOT NULL,
+    pages INTEGER NOT NULL,
+    figures INTEGER NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_sha256 ON documents (pdf_sha256);
+CREATE TABLE IF NOT EXISTS pages (
+    document_id INTEGER NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+    page INTEGER NOT NULL,
+    figures INTEGER NOT NULL,
+    PRIMARY KEY (document_id, page)
+);
+CREATE TABLE IF NOT EXISTS figures (
+    id INTEGER PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents (id) ON DELETE CASCADE,
+    page INTEGER NOT NULL,
+    figure_number INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    caption_text TEXT NOT NULL,
+    caption_x REAL,
+    caption_y REAL,
+    caption_width REAL,
+    caption_height REAL,
+    image_file TEXT,
+    image_sha256 TEXT,
+    duplicate_of TEXT
+);
+CREATE INDEX IF NOT EXISTS figures_document ON figures (document_id, page);
+CREATE INDEX IF NOT EXISTS figures_image_sha256 ON figures (image_sha256);
+CREATE TABLE IF NOT EXISTS figure_hashes (
+    id INTEGER PRIMARY KEY,
+    dhash INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    image TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS figure_hashes_image ON figure_hashes (image);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS figures_fts USING fts5(
+    caption_text, content='figures', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS figures_fts_insert AFTER INSERT ON figures BEGIN
+    INSERT INTO figures_fts (rowid, caption_text) VALUES (new.id, new.caption_text);
+END;
+CREATE TRIGGER IF NOT EXISTS figures_fts_delete AFTER DELETE ON figures BEGIN
+    INSERT INTO figures_fts (figures_fts, rowid, caption_text) VALUES ('delete', old.id, old.caption_text);
+END;
+"""
+
+
+def fts_quote(query):
+    """
+    Turn free text into an FTS5 query matching captions that contain every
+    word, quoting each word so punctuation ('cell-cycle', 'Fig. 3') is not
+    read as query syntax.
+    """
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+
+class FigureIndex:
+    def __init__(self, path=None, timeout=30.0):
+        """
+        Open (and create if needed) the index database.
+
+        Args:
+            path (str, optional): Database file. Defaults to Config.INDEX_PATH, or
+                index.sqlite in Config.OUTPUT_DIR
+            timeout (float): Seconds to wait for another process's write transaction
+        """
+        self.path = path or Config.INDEX_PATH or os.path.join(Config.OUTPUT_DIR, INDEX_NAME)
+        # One connection shared by the threads of a process; transactions nest on one thread
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.path, timeout=timeout, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('PRAGMA foreign_keys=ON')
+        # executescript commits on its own; the statements are idempotent
+        self._conn.executescript(_SCHEMA)
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] == 1:
+            self._conn.execute('ALTER TABLE figures ADD COLUMN duplicate_of TEXT')
+        self._conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+        try:
+            self._conn.executescript(_FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite FTS5 unavailable, caption search falls back to LIKE: {str(e)}")
+            self.fts = False
+
+    def _transaction(self):
+        return _Transaction(self._conn, self._lock)
+
+    def index_document(self, name, metadata, output_dir, pdf_path=None, pdf_sha256=None):
+        """
+        Replace the index entries of one PDF in a single transaction.
+
+        Args:
+            name (str): PDF file name, the document's key in the index
+            metadata (dict): The PDF's entry of the data process_pdf returns
+            output_dir (str): Directory holding the PDF's figures
+            pdf_path (str, optional): Path of the PDF
+            pdf_sha256 (str, optional): SHA-256 of the PDF; computed from pdf_path when omitted
+
+        Returns:
+            int: Figures indexed
+        """
+        if pdf_sha256 is None and pdf_path and os.path.exists(pdf_path):
+            pdf_sha256 = file_digest(pdf_path)
+
+        figures = metadata.get('figures', [])
+        figure_rows = []
+        for figure in figures:
+            x, y, width, height = figure['region_bb']
+            caption_bb = figure.get('caption_bb') or (None, None, None, None)
+            image_file = figure.get('image_file')
+            image_path = os.path.join(output_dir, image_file) if image_file else None
+            image_sha256 = file_digest(image_path) if image_path and os.path.exists(image_path) else None
+            figure_rows.append((
+                figure['page'], figure['figure_number'], x, y, width, height,
+                figure.get('caption_text') or '', *caption_bb, image_file, image_sha256,
+                figure.get('duplicate_of')
+            ))
+        per_page = {page: 0 for page in metadata.get('pages_annotated', [])}
+        for figure in figures:
+            per_page[figure['page']] = per_page.get(figure['page'], 0) + 1
+
+        with self._transaction():
+            self._conn.execute('DELETE FROM documents WHERE name = ?', (name,))
+            document_id = self._conn.execute(
+                'INSERT INTO documents (name, pdf_path, pdf_sha256, output_dir, pages, figures, indexed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (name, os.path.abspath(pdf_path) if pdf_path else None, pdf_sha256,
+                 os.path.abspath(output_dir), len(per_page), len(figures), time.time())
+            ).lastrowid
+            self._conn.executemany(
+                'INSERT INTO pages (document_id, page, figures) VALUES (?, ?, ?)',
+                [(document_id, page, count) for page, count in sorted(per_page.items())]
+            )
+            self._conn.executemany(
+                'INSERT INTO figures (document_id, page, figure_number, x, y, width, height, caption_text, '
+                'caption_x, caption_y, caption_width, caption_height, image_file, image_sha256, duplicate_of) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(document_id, *row) for row in figure_rows]
+            )
+        return len(figures)
+
+    def add_hash(self, value, width, height, image):
+        """
+        Store the perceptual hash of a saved figure image.
+
+        Args:
+            value (int): 64-bit hash
+            width (int): Figure width in pixels
+            height (int): Figure height in pixels
+            image (str): Image path relative to the output directory
+        """
+        # SQLite integers are signed 64-bit
+        signed = value - (1 << 64) if value >= 1 << 63 else value
+        with self._transaction():
+            # A reprocessed PDF replaces the hashes of its earlier images
+            self._conn.execute('DELETE FROM figure_hashes WHERE image = ?', (image,))
+            self._conn.execute('INSERT INTO figure_hashes (dhash, width, height, image) VALUES (?, ?, ?, ?)',
+                               (signed, width, height, image))
+
+    def hashes_since(self, last_id=0):
+        """
+        Perceptual hashes stored after a given row.
+
+        Returns:
+            list: (id, hash, width, height, image) tuples in insertion order
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id, dhash, width, height, image FROM figure_hashes WHERE id > ? ORDER BY id', (last_id,)
+            ).fetchall()
+        return [(row[0], row[1] & ((1 << 64) - 1), row[2], row[3], row[4]) for row in rows]
+
+    def remove_document(self, name):
+        """Drop a PDF and its figures from the index."""
+        with self._transaction():
+            self._conn.execute('DELETE FROM documents WHERE name = ?', (name,))
+
+    def search(self, query, limit=20, document=None, raw=False):
+        """
+        Find figures whose caption matches a query.
+
+        Args:
+            query (str): Words that must all occur in the caption, e.g. 'cell-cycle
+                Fig. 3'; with raw, an FTS5 query such as 'kinase AND inhibitor'
+                (a plain substring either way when FTS5 is unavailable)
+            limit (int): Maximum number of results
+            document (str, optional): Restrict to the PDF with this file name
+            raw (bool): Pass the query to FTS5 MATCH unchanged
+
+        Returns:
+            list: dicts with the document, page, figure number, bbox, caption,
+                image path and a highlighted snippet, best matches first
+
+        Raises:
+            sqlite3.OperationalError: When a raw query is not valid FTS5 syntax
+        """
+        where = ' AND d.name = ?' if document else ''
+        match = query if raw else fts_quote(query)
+        if self.fts and not match:
+            return []
+        params = [match] + ([document] if document else []) + [limit]
+        if self.fts:
+            sql = (
+                "SELECT d.name AS document, f.*, d.output_dir, "
+                "snippet(figures_fts, 0, '[', ']', '...', 12) AS snippet "
+                "FROM figures_fts JOIN figures f ON f.id = figures_fts.rowid "
+                "JOIN documents d ON d.id = f.document_id "
+                f"WHERE figures_fts MATCH ?{where} ORDER BY bm25(figures_fts) LIMIT ?"
+            )
+        else:
+            params[0] = f'%{query}%'
+            sql = (
+                "SELECT d.name AS document, f.*, d.output_dir, f.caption_text AS snippet "
+                "FROM figures f JOIN documents d ON d.id = f.document_id "
+                f"WHERE f.caption_text LIKE ?{where} ORDER BY d.name, f.page, f.figure_number LIMIT ?"
+            )
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [_figure_result(row) for row in rows]
+
+    def stats(self):
+        """Document, page and figure counts of the index."""
+        with self._lock:
+            counts = {
+                table: self._conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('documents', 'pages', 'figures')
+            }
+        counts['fts'] = self.fts
+        return counts
+
+    def backfill(self, output_dir=None, batch_size=200):
+        """
+        Index every metadata.json under an output directory, e.g. results
+        produced before the index existed.
+
+        Args:
+            output_dir (str, optional): Defaults to Config.OUTPUT_DIR
+            batch_size (int): Documents committed per transaction
+
+        Returns:
+            int: Documents indexed
+        """
+        output_dir = output_dir or Config.OUTPUT_DIR
+        indexed = 0
+        batch = []
+        for entry in sorted(os.scandir(output_dir), key=lambda e: e.name):
+            metadata_path = os.path.join(entry.path, 'metadata.json')
+            if not entry.is_dir() or not os.path.isfile(metadata_path):
+                continue
+            try:
+                with open(metadata_path, encoding='utf-8') as f:
+                    stored = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable {metadata_path}: {str(e)}")
+                continue
+            for name, metadata in stored.items():
+                batch.append((name, metadata, entry.path))
+            if len(batch) >= batch_size:
+                indexed += self._index_batch(batch)
+                batch = []
+        if batch:
+            indexed += self._index_batch(batch)
+        return indexed
+
+    def _index_batch(self, batch):
+        """Index several documents in one transaction."""
+        with self._transaction():
+            for name, metadata, output_dir in batch:
+                # Nested calls reuse the open transaction
+                self.index_document(name, metadata, output_dir)
+        logger.info(f"Indexed {len(batch)} documents")
+        return len(batch)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _Transaction:
+    """
+    BEGIN IMMEDIATE ... COMMIT around a block, rolled back on error. Holds the
+    connection's lock throughout; nested blocks on the same thread join the
+    outer transaction.
+    """
+
+    def __init__(self, conn, lock):
+        self.conn = conn
+        self.lock = lock
+        self.outer = False
+
+    def __enter__(self):
+        self.lock.acquire()
+        if not self.conn.in_transaction:
+            self.outer = True
+            try:
+                self.conn.execute('BEGIN IMMEDIATE')
+            except BaseException:
+                self.lock.release()
+                raise
+        return self.conn
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            if self.outer:
+                self.conn.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        finally:
+            self.lock.release()
+        return False
+
+
+def _figure_result(row):
+    return {
+        'document': row['document'],
+        'page': row['page'],
+        'figure_number': row['figure_number'],
+        'region_bb': [row['x'], row['y'], row['width'], row['height']],
+        'caption_text': row['caption_text'],
+        'caption_bb': ([row['caption_x'], row['caption_y'], row['caption_width'], row['caption_height']]
+                       if row['caption_x'] is not None else None),
+        'image_path': _image_path(row),
+        'image_sha256': row['image_sha256'],
+        'snippet': row['snippet']
+    }
+
+
+def _image_path(row):
+    """Where a figure's image is: its own file, or the file it duplicates."""
+    if row['image_file']:
+        return os.path.join(row['output_dir'], row['image_file'])
+    if row['duplicate_of']:
+        # duplicate_of is relative to the output directory holding every PDF's folder
+        return os.path.join(os.path.dirname(row['output_dir']), row['duplicate_of'])
+    return None
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_default_index():
+    """Process-wide index connection used by process_pdf."""
+    global _default_index
+    with _default_index_lock:
+        path = Config.INDEX_PATH or os.path.join(Config.OUTPUT_DIR, INDEX_NAME)
+        if _default_index is None or _default_index.path != path:
+            _default_index = FigureIndex(path)
+        return _default_index
+
+
+def close_default_index():
+    """Close the process-wide index connection, if it was ever opened."""
+    global _default_index
+    with _default_index_lock:
+        if _default_index is not None:
+            _default_index.close()
+            _default_index = None
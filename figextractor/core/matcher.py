@@ -0,0 +1,181 @@
+"""
+Figure-caption assignment as a vectorised min-cost matching problem.
+
+For every page a figure x caption cost matrix is built in one NumPy
+operation from the gap between the boxes, weighted by layout priors
+(captions usually sit below their figure and share its column). The
+matching is then solved globally with the Hungarian algorithm, so an early
+figure can no longer take a caption that fits a later one better.
+"""
+
+import numpy as np
+from config import Config
+
+# Cost given to pairs further apart than the threshold; larger than any
+# feasible total, so the solver maximises the number of real matches first
+INFEASIBLE_COST = 1e12
+
+
+def _as_boxes(boxes):
+    """Convert a sequence of (x, y, width, height) tuples to an (N, 4) float array."""
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def box_gaps(fig_boxes, cap_boxes):
+    """
+    Minimum distance between every figure box and every caption box.
+
+    Args:
+        fig_boxes: (..., F, 4) array of (x, y, width, height)
+        cap_boxes: (..., C, 4) array of (x, y, width, height)
+
+    Returns:
+        numpy.ndarray: (..., F, C) Euclidean gaps, 0 for touching or overlapping boxes
+    """
+    f = fig_boxes[..., :, None, :]
+    c = cap_boxes[..., None, :, :]
+    dx = np.maximum(0, np.maximum(c[..., 0] - (f[..., 0] + f[..., 2]), f[..., 0] - (c[..., 0] + c[..., 2])))
+    dy = np.maximum(0, np.maximum(c[..., 1] - (f[..., 1] + f[..., 3]), f[..., 1] - (c[..., 1] + c[..., 3])))
+    return np.hypot(dx, dy)
+
+
+def layout_weights(fig_boxes, cap_boxes, above_penalty=None, side_penalty=None):
+    """
+    Multiplicative layout priors for every figure-caption pair.
+
+    Captions whose centre lies above the figure's centre are weighted by
+    above_penalty, and captions that share no horizontal extent with the
+    figure (a different column) by side_penalty.
+
+    Args:
+        fig_boxes: (..., F, 4) array of (x, y, width, height)
+        cap_boxes: (..., C, 4) array of (x, y, width, height)
+        above_penalty (float, optional): Defaults to Config.MATCH_ABOVE_PENALTY
+        side_penalty (float, optional): Defaults to Config.MATCH_SIDE_PENALTY
+
+    Returns:
+        numpy.ndarray: (..., F, C) weights >= 1
+    """
+    above_penalty = Config.MATCH_ABOVE_PENALTY if above_penalty is None else above_penalty
+    side_penalty = Config.MATCH_SIDE_PENALTY if side_penalty is None else side_penalty
+
+    f = fig_boxes[..., :, None, :]
+    c = cap_boxes[..., None, :, :]
+    above = (c[..., 1] + c[..., 3] / 2) < (f[..., 1] + f[..., 3] / 2)
+    disjoint = (c[..., 0] >= f[..., 0] + f[..., 2]) | (f[..., 0] >= c[..., 0] + c[..., 2])
+    return np.where(above, above_penalty, 1.0) * np.where(disjoint, side_penalty, 1.0)
+
+
+def linear_sum_assignment(cost):
+    """
+    Solve the rectangular assignment problem with the Hungarian algorithm.
+
+    The inner column scan is vectorised, so each augmenting step costs one
+    pass of NumPy operations over the columns.
+
+    Args:
+        cost: (N, M) cost matrix
+
+    Returns:
+        tuple: (rows, cols) index arrays of the min-cost assignment, one pair
+            per row when N <= M, else one per column
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    if n == 0:
+        empty = np.zeros(0, dtype=np.intp)
+        return empty, empty
+
+    # Potentials and the column -> row assignment use 1-based indices, with
+    # column 0 as the virtual source of each augmenting path
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    assignment = np.zeros(m + 1, dtype=np.intp)
+    way = np.zeros(m + 1, dtype=np.intp)
+
+    for row in range(1, n + 1):
+        assignment[0] = row
+        col = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+
+        while True:
+            used[col] = True
+            current_row = assignment[col]
+            free = ~used[1:]
+
+            slack = cost[current_row - 1] - u[current_row] - v[1:]
+            improved = free & (slack < min_slack[1:])
+            min_slack[1:][improved] = slack[improved]
+            way[1:][improved] = col
+
+            candidates = np.where(free, min_slack[1:], np.inf)
+            next_col = int(np.argmin(candidates)) + 1
+            delta = candidates[next_col - 1]
+
+            u[assignment[used]] += delta
+            v[used] -= delta
+            min_slack[1:][free] -= delta
+
+            col = next_col
+            if assignment[col] == 0:
+                break
+
+        # Flip the augmenting path
+        while col:
+            previous = way[col]
+            assignment[col] = assignment[previous]
+            col = previous
+
+    cols = np.flatnonzero(assignment[1:])
+    rows = assignment[1:][cols] - 1
+    order = np.argsort(rows)
+    rows, cols = rows[order], cols[order]
+    if transposed:
+        rows, cols = cols, rows
+        order = np.argsort(rows)
+        rows, cols = rows[order], cols[order]
+    return rows, cols
+
+
+def _solve(distance, weights, threshold):
+    """Assign captions to figures for one page, returning a caption index or -1 per figure."""
+    num_figures, num_captions = distance.shape
+    matches = np.full(num_figures, -1, dtype=np.intp)
+    if num_figures == 0 or num_captions == 0:
+        return matches
+
+    feasible = distance < threshold
+    if not feasible.any():
+        return matches
+
+    cost = np.where(feasible, distance * weights, INFEASIBLE_COST)
+    rows, cols = linear_sum_assignment(cost)
+    keep = feasible[rows, cols]
+    matches[rows[keep]] = cols[keep]
+    return matches
+
+
+def match_page(fig_boxes, cap_boxes, threshold, above_penalty=None, side_penalty=None):
+    """
+    Find the min-cost assignment of captions to figures on one page.
+
+    Args:
+        fig_boxes: Figure boxes as (x, y, width, height)
+        cap_boxes: Caption boxes as (x, y, width, height), in the same coordinate space
+        threshold (float): Maximum gap between a figure and its caption
+        above_penalty (float, optional): Cost weight for captions above the figure
+        side_penalty (float, optional): Cost weight for captions in another column
+
+    Returns:
+        numpy.ndarray: Caption index per figure, -1 for figures without a caption
+    """
+    fig_boxes = _as_boxes(fig_boxes)
+    cap_boxes = _as_boxes(cap_boxes)
+    distance = box_gaps(fig_boxes, cap_boxes)
+    weights = layout_weights(fig_boxes, cap_boxes, above_penalty, side_penalty)
+    return _solve(distance, weights, threshold)
+
@@ -5,40 +5,43 @@ PDF processing module for extracting figures and captions from PDF documents.
 import os
 import json
 import logging
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from ..utils.helpers import get_page_dimensions, create_output_directory
-from .renderer import render_pdf
-from .figure_extractor import extract_figures_and_captions
+from functools import partial
+from ..utils.helpers import create_output_directory
+from ..utils.driver_pool import get_default_pool
+from ..utils.metrics import create_metrics
+from ..utils.supervisor import ToolError
+from .renderer import iter_pdf_pages, oversized_pages
+from .caption_parser import select_caption_pages, count_html_pages
+from .figure_extractor import extractor, iter_figures_and_captions
+from .cache import ResultCache, cache_keys as compute_cache_keys
+from .checkpoint import PdfCheckpoint
+from .index import get_default_index
+from .dedup import get_default_deduplicator
+from .html_converter import start_html_conversion, run_pdftohtml
+from .writer import ArtifactWriter, MetadataStream
 from config import Config
 
 logger = logging.getLogger(__name__)
 
-def setup_chrome_driver():
-    """Initialize Chrome WebDriver with appropriate options."""
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    
-    return webdriver.Chrome(
-        executable_path=Config.CHROME_DRIVER_PATH,
-        options=chrome_options
-    )
-
-def process_pdf(pdf_path):
+def process_pdf(pdf_path, driver=None, cache=None):
     """
     Process a single PDF file to extract figures and captions.
     
     Args:
         pdf_path (str): Path to the PDF file to process
+        driver (optional): Selenium WebDriver to use. When omitted and the 'selenium'
+            caption backend is selected, a warm driver is borrowed from the process-wide pool
+        cache (ResultCache, optional): Cache to use. Defaults to a cache under
+            Config.CACHE_DIR when Config.CACHE_ENABLED is set
         
     Returns:
-        dict: Extracted data containing figures and their metadata
+        dict: Extracted data containing figures and their metadata, plus
+            per-stage 'metrics' when Config.METRICS_ENABLED is set
     """
     try:
         pdf_name = os.path.basename(pdf_path)
         logger.info(f"Processing PDF: {pdf_name}")
+        metrics = create_metrics(pdf_name)
         
         # Create output directories
         output_dir = create_output_directory(pdf_name)
@@ -46,78 +49,287 @@ def process_pdf(pdf_path):
         if not os.path.exists(xpdf_dir):
             os.makedirs(xpdf_dir)
             
-        # Initialize data structure
-        data = {pdf_name: {'figures': [], 'pages_annotated': []}}
+        metadata_path = os.path.join(output_dir, 'metadata.json')
         
-        # Render PDF pages
-        images = render_pdf(pdf_path, customize_dpi=Config.DPI)
-        logger.info(f"Successfully rendered {len(images)} pages")
+        if cache is None and Config.CACHE_ENABLED:
+            cache = ResultCache()
+        # Two-pass mode renders whole pages at the detection DPI only
+        render_dpi = Config.DETECTION_DPI or Config.DPI
+        cache_keys = cache.keys_for(pdf_path, extractor, dpi=render_dpi) if cache else None
         
+        # Reuse stored results when neither the PDF nor the settings changed
+        if cache:
+            with metrics.stage('cache'):
+                cached = cache.get_results(cache_keys['results'], output_dir)
+            if cached is not None:
+                logger.info(f"Restored {pdf_name} from cache")
+                data = _restore_metadata(cached, pdf_name, metadata_path, metrics)
+                _index_results(pdf_path, output_dir, data, cache_keys)
+                return data
+        
+        # Track finished pages so an interrupted run can resume where it stopped
+        checkpoint = None
+        done_pages = {}
+        if Config.CHECKPOINTS:
+            results_key = (cache_keys or compute_cache_keys(pdf_path, extractor, dpi=render_dpi))['results']
+            checkpoint = PdfCheckpoint(output_dir, results_key, resume=Config.RESUME)
+            if checkpoint.complete and os.path.exists(metadata_path):
+                with open(metadata_path, encoding='utf-8') as f:
+                    finished = json.load(f)
+                logger.info(f"Skipping {pdf_name}, completed by an earlier run")
+                data = _restore_metadata(finished, pdf_name, metadata_path, metrics)
+                _index_results(pdf_path, output_dir, data, cache_keys)
+                return data
+            done_pages = checkpoint.completed_pages()
+            
         # Convert PDF to HTML using XPDF
         pdf_html_path = os.path.join(xpdf_dir, os.path.splitext(pdf_name)[0])
-        convert_to_html(pdf_path, pdf_html_path)
+        html_conversion = None
+        with metrics.stage('html'):
+            if not (cache and cache.get_html(cache_keys['html'], pdf_html_path)):
+                # Long documents are converted in page-range shards whose pages are used as they finish
+                html_conversion = start_html_conversion(pdf_path, pdf_html_path)
+                if html_conversion is None:
+                    convert_to_html(pdf_path, pdf_html_path)
+                    if cache:
+                        cache.put_html(cache_keys['html'], pdf_html_path)
+            # Page selection and resuming read every page's text first
+            if html_conversion and (Config.PAGE_SELECTION == 'captions' or done_pages):
+                try:
+                    html_conversion.wait()
+                except BaseException:
+                    html_conversion.close()
+                    raise
+        
+        # Use the text layer to skip rasterising pages without caption candidates
+        selected = None
+        if Config.PAGE_SELECTION == 'captions':
+            with metrics.stage('select'):
+                selected, page_count = select_caption_pages(pdf_html_path, Config.PAGE_SELECTION_MARGIN)
+            logger.info(f"Rendering {len(selected)} of {page_count} pages with caption candidates")
+        elif Config.PAGE_SELECTION != 'all':
+            raise ValueError(f"Unknown page selection: {Config.PAGE_SELECTION}")
+        
+        # Pages finished by an earlier run are merged from the manifest, not redone
+        if done_pages:
+            if selected is None:
+                selected = list(range(1, count_html_pages(pdf_html_path) + 1))
+            selected = [page_num for page_num in selected if page_num not in done_pages]
+            logger.info(f"Resuming {pdf_name}: {len(done_pages)} pages already done")
+        
+        # Pages above the pixel budget are rendered and detected in bands
+        page_count, tiled = oversized_pages(pdf_path, render_dpi)
+        if tiled:
+            if selected is None:
+                selected = list(range(1, page_count + 1))
+            wanted = set(selected)
+            tiled = {page_num: size for page_num, size in tiled.items() if page_num in wanted}
+            logger.info(f"Rendering {len(tiled)} oversized pages of {pdf_name} in bands")
+        
+        # Render PDF pages lazily so extraction runs as pages arrive
+        pages = cache.get_pages(cache_keys['pages']) if cache and Config.CACHE_PAGES and not tiled else None
+        if pages is not None:
+            if selected is not None:
+                wanted = set(selected)
+                pages = ((page_num, page) for page_num, page in pages if page_num in wanted)
+        else:
+            # In two-pass mode the pages are only used for detection, so gray is enough
+            pages = iter_pdf_pages(pdf_path, customize_dpi=render_dpi, pages=selected,
+                                   gray=render_dpi != Config.DPI, tiled=tiled)
+            # Only a full render can be stored as the document's pages
+            if cache and Config.CACHE_PAGES and selected is None:
+                pages = cache.tee_pages(cache_keys['pages'], pages)
+        pages = metrics.iter_stage('render', pages)
         
-        # Setup Chrome driver
-        driver = setup_chrome_driver()
+        # Borrow a Chrome driver, only needed for browser-based caption layout
+        pool = get_default_pool() if driver is None and Config.CAPTION_BACKEND == 'selenium' else None
+        if pool:
+            driver = pool.acquire()
+        driver_failed = False
         
         try:
-            # Extract figures and captions
-            figures, captions = extract_figures_and_captions(
+            # Extract figures and captions, saving each page's results as it completes
+            results = iter_figures_and_captions(
                 pdf_path=pdf_path,
-                html_dir=xpdf_dir,
-                images=images,
-                driver=driver
+                html_dir=pdf_html_path,
+                pages=pages,
+                driver=driver,
+                metrics=metrics,
+                render_dpi=render_dpi,
+                html_ready=html_conversion.wait_page if html_conversion else None
             )
             
-            # Process and save results
-            for page_num, (page_figures, page_captions) in enumerate(zip(figures, captions), 1):
-                for fig_num, (figure, caption) in enumerate(zip(page_figures, page_captions), 1):
-                    figure_data = {
-                        'page': page_num,
-                        'figure_number': fig_num,
-                        'region_bb': figure['bbox'],
-                        'caption_text': caption['text'] if caption else '',
-                        'caption_bb': caption['bbox'] if caption else None
-                    }
-                    
-                    # Save figure image
-                    figure_path = os.path.join(output_dir, f'page_{page_num}_figure_{fig_num}.jpg')
-                    figure['image'].save(figure_path)
+            # Encoding and writing happen on the writer's threads while the next
+            # page is detected; the metadata file grows as figures are added and
+            # is the only record of them until it is read back once complete
+            metadata = MetadataStream(metadata_path, pdf_name)
+            
+            def add_page(page_num, page_entries):
+                for figure_data in page_entries:
+                    metadata.add_figure(figure_data)
+                metadata.add_page(page_num)
+            
+            # Figures that duplicate an earlier image are referenced instead of written
+            deduper = None
+            if Config.DEDUP_ENABLED and Config.FIGURE_FORMAT != 'none':
+                deduper = get_default_deduplicator()
+            output_name = os.path.basename(output_dir)
+            
+            resumed = sorted(done_pages.items())
+            try:
+                with ArtifactWriter(metrics=metrics) as writer:
+                    for page_num, page_figures, page_captions in results:
+                        # Keep page order when merging pages from an earlier run
+                        while resumed and resumed[0][0] < page_num:
+                            add_page(*resumed.pop(0))
+                        
+                        page_entries = []
+                        for fig_num, (figure, caption) in enumerate(zip(page_figures, page_captions), 1):
+                            duplicate = None
+                            if deduper and figure.phash is not None:
+                                duplicate = deduper.find(figure.phash, figure.bbox[2], figure.bbox[3],
+                                                         exclude_dir=output_name)
+                            
+                            # Save figure image
+                            if duplicate is None:
+                                figure_path = writer.submit_figure(
+                                    figure,
+                                    os.path.join(output_dir, f'page_{page_num}_figure_{fig_num}')
+                                )
+                            else:
+                                figure_path = None
+                                figure.release()
+                            
+                            figure_data = {
+                                'page': page_num,
+                                'figure_number': fig_num,
+                                'region_bb': figure.bbox,
+                                'caption_text': caption['text'] if caption else '',
+                                'caption_bb': caption['bbox'] if caption else None,
+                                'image_file': os.path.basename(figure_path) if figure_path else None
+                            }
+                            if deduper:
+                                figure_data['phash'] = f'{figure.phash:016x}' if figure.phash is not None else None
+                                if duplicate:
+                                    figure_data['duplicate_of'], figure_data['duplicate_distance'] = duplicate
+                                elif figure_path and figure.phash is not None:
+                                    image = os.path.relpath(figure_path, Config.OUTPUT_DIR)
+                                    deduper.register(figure.phash, figure.bbox[2], figure.bbox[3], image)
+                                    writer.when_written(partial(deduper.persist, figure.phash,
+                                                                figure.bbox[2], figure.bbox[3], image),
+                                                        on_error=partial(deduper.discard, image))
+                            
+                            # Save caption text
+                            if caption:
+                                caption_path = os.path.join(output_dir, f'page_{page_num}_caption_{fig_num}.txt')
+                                writer.submit_text(caption_path, caption['text'])
+                            
+                            page_entries.append(figure_data)
+                        
+                        add_page(page_num, page_entries)
+                        if checkpoint:
+                            # The page counts as done once its files are on disk
+                            writer.when_written(partial(checkpoint.page_done, page_num, page_entries))
                     
-                    # Save caption text
-                    if caption:
-                        caption_path = os.path.join(output_dir, f'page_{page_num}_caption_{fig_num}.txt')
-                        with open(caption_path, 'w', encoding='utf-8') as f:
-                            f.write(caption['text'])
+                    for page_num, page_entries in resumed:
+                        add_page(page_num, page_entries)
                     
-                    data[pdf_name]['figures'].append(figure_data)
+                    if html_conversion:
+                        # Shards past the last rendered page have not been waited for
+                        with metrics.stage('html'):
+                            html_conversion.wait()
                 
-                data[pdf_name]['pages_annotated'].append(page_num)
+                # Publish metadata only once every artefact it lists is on disk
+                pdf_metrics = None
+                if metrics.enabled:
+                    pdf_metrics = metrics.finish(
+                        pages=len(metadata.pages_annotated),
+                        figures=metadata.figure_count
+                    )
+                metadata.close(pdf_metrics)
+            except BaseException:
+                metadata.abort()
+                raise
+            
+            with open(metadata_path, encoding='utf-8') as f:
+                data = json.load(f)
+            
+            if checkpoint:
+                checkpoint.finish()
+            
+            if cache and html_conversion:
+                cache.put_html(cache_keys['html'], pdf_html_path)
+            if cache:
+                cache.put_results(cache_keys['results'], output_dir)
             
-            # Save metadata
-            metadata_path = os.path.join(output_dir, 'metadata.json')
-            with open(metadata_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2)
+            with metrics.stage('index'):
+                _index_results(pdf_path, output_dir, data, cache_keys)
             
             logger.info(f"Successfully processed {pdf_name}")
             return data
             
+        except Exception as e:
+            driver_failed = type(e).__module__.startswith('selenium')
+            raise
+            
         finally:
-            driver.quit()
+            if pool:
+                pool.release(driver, failed=driver_failed)
+            if html_conversion:
+                html_conversion.close()
             
     except Exception as e:
         logger.error(f"Error processing {pdf_path}: {str(e)}")
         raise
         
+def _restore_metadata(stored, pdf_name, metadata_path, metrics):
+    """
+    Rewrite stored metadata (from the cache or an earlier run) for this run.
+    
+    Args:
+        stored (dict): Metadata as loaded from a metadata.json
+        pdf_name (str): Current file name of the PDF
+        metadata_path (str): Where to write metadata.json
+        metrics: This run's metrics collector
+        
+    Returns:
+        dict: Extracted data in the same form process_pdf returns
+    """
+    # The same content may have been stored under another file name
+    data = {pdf_name: next(iter(stored.values()))}
+    # Stored metrics describe the run that produced the results
+    data[pdf_name].pop('metrics', None)
+    if metrics.enabled:
+        data[pdf_name]['metrics'] = metrics.finish(
+            pages=len(data[pdf_name]['pages_annotated']),
+            figures=len(data[pdf_name]['figures'])
+        )
+    with open(metadata_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    return data
+
+def _index_results(pdf_path, output_dir, data, cache_keys=None):
+    """
+    Write a finished PDF into the corpus index when Config.INDEX_ENABLED is set.
+    
+    The results are already on disk, so an index failure is logged and does
+    not fail the PDF; a backfill picks it up later.
+    """
+    if not Config.INDEX_ENABLED:
+        return
+    pdf_name, metadata = next(iter(data.items()))
+    try:
+        get_default_index().index_document(
+            pdf_name, metadata, output_dir, pdf_path=pdf_path,
+            pdf_sha256=cache_keys['pdf'] if cache_keys else None
+        )
+    except Exception as e:
+        logger.warning(f"Failed to index {pdf_name}: {type(e).__name__}: {str(e)}")
+
 def convert_to_html(pdf_path, output_path):
     """Convert PDF to HTML using XPDF tools."""
     try:
-        command = [
-            Config.XPDF_PATH,
-            pdf_path,
-            output_path
-        ]
-        subprocess.run(command, check=True)
-    except subprocess.CalledProcessError as e:
+        run_pdftohtml(pdf_path, output_path)
+    except ToolError as e:
         logger.error(f"Error converting PDF to HTML: {str(e)}")
         raise
@@ -0,0 +1,159 @@
+"""
+Compact, lazy representation of a detected figure.
+"""
+
+import cv2
+import numpy as np
+from PIL import Image
+from .renderer import render_region
+
+# OpenCV encoder parameters per output extension; the JPEG quality matches
+# PIL's default so saved figures look the same as before
+_ENCODE_PARAMS = {
+    '.jpg': lambda quality: [cv2.IMWRITE_JPEG_QUALITY, 75 if quality is None else quality],
+    '.jpeg': lambda quality: [cv2.IMWRITE_JPEG_QUALITY, 75 if quality is None else quality],
+    '.png': lambda quality: [cv2.IMWRITE_PNG_COMPRESSION, 6 if quality is None else quality],
+    '.webp': lambda quality: [cv2.IMWRITE_WEBP_QUALITY, 80 if quality is None else quality],
+}
+
+
+class FigureRecord:
+    """
+    A detected figure region that references its page instead of copying pixels.
+
+    The record holds the bounding box and a view into the page buffer. Pixels
+    are only converted or encoded when the figure is saved, so detection costs
+    no copies and discarded regions cost nothing at all.
+
+    For compatibility with the dicts used previously, record['bbox'] and
+    record['image'] are supported; the latter builds the PIL image on demand.
+    """
+
+    __slots__ = ('bbox', 'page_buffer', 'channel_order', 'phash')
+
+    def __init__(self, bbox, page_buffer, channel_order='BGR'):
+        """
+        Initialize the record.
+
+        Args:
+            bbox (tuple): (x, y, width, height) in page pixels
+            page_buffer: Page image as a numpy array, referenced rather than copied
+            channel_order (str): 'BGR', 'RGB' or 'GRAY', the layout of page_buffer
+        """
+        self.bbox = tuple(int(v) for v in bbox)
+        self.page_buffer = page_buffer
+        self.channel_order = channel_order
+        # Perceptual hash, set by the extractor when deduplication is enabled
+        self.phash = None
+
+    @property
+    def view(self):
+        """Zero-copy view of the figure region in the page buffer."""
+        x, y, w, h = self.bbox
+        return self.page_buffer[y:y+h, x:x+w]
+
+    def _bgr(self):
+        """
+        The region in OpenCV channel order. An RGB region is converted straight
+        from the page view into a crop-sized buffer; BGR and gray regions are
+        encoded from the view as they are.
+        """
+        if self.channel_order == 'RGB':
+            return cv2.cvtColor(self.view, cv2.COLOR_RGB2BGR)
+        return self.view
+
+    def to_image(self):
+        """
+        Build a PIL image of the figure.
+
+        Returns:
+            PIL.Image.Image: RGB (or grayscale) copy of the region
+        """
+        if self.channel_order == 'BGR':
+            return Image.fromarray(cv2.cvtColor(self.view, cv2.COLOR_BGR2RGB))
+        # RGB and gray regions are already in PIL's order
+        return Image.fromarray(np.ascontiguousarray(self.view))
+
+    def encode(self, ext='.jpg', quality=None):
+        """
+        Encode the figure straight from the page buffer.
+
+        Args:
+            ext (str): Output extension, '.jpg', '.png' or '.webp'
+            quality (int, optional): JPEG/WebP quality or PNG compression level
+
+        Returns:
+            bytes: Encoded image
+        """
+        ext = ext.lower()
+        if ext not in _ENCODE_PARAMS:
+            raise ValueError(f"Unsupported figure format: {ext}")
+        ok, buffer = cv2.imencode(ext, self._bgr(), _ENCODE_PARAMS[ext](quality))
+        if not ok:
+            raise ValueError(f"Failed to encode figure {self.bbox} as {ext}")
+        return buffer.tobytes()
+
+    def save(self, path, quality=None):
+        """
+        Encode the figure and write it to path, with the format taken from the extension.
+
+        Args:
+            path (str): Output file path
+            quality (int, optional): See encode
+        """
+        data = self.encode(path[path.rfind('.'):], quality)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def release(self):
+        """Drop the page reference once the figure has been saved."""
+        self.page_buffer = None
+
+    def __getitem__(self, key):
+        if key == 'bbox':
+            return self.bbox
+        if key == 'image':
+            return self.to_image()
+        raise KeyError(key)
+
+    def __repr__(self):
+        return f"FigureRecord(bbox={self.bbox})"
+
+
+class ClippedFigureRecord(FigureRecord):
+    """
+    A figure detected on a low-resolution page whose pixels come from a
+    separate high-resolution render of just its bounding box.
+
+    The region is rasterised the first time the pixels are needed, normally
+    on a writer thread while the next page is being detected.
+    """
+
+    __slots__ = ('pdf_path', 'page_num', 'dpi', 'page_height')
+
+    def __init__(self, bbox, pdf_path, page_num, dpi, page_height):
+        """
+        Initialize the record.
+
+        Args:
+            bbox (tuple): (x, y, width, height) in pixels at dpi
+            pdf_path (str): PDF the figure is rendered from
+            page_num (int): 1-based page number
+            dpi (int): Output resolution of the figure
+            page_height (int): Page height in pixels at dpi
+        """
+        super().__init__(bbox, None, 'RGB')
+        self.pdf_path = pdf_path
+        self.page_num = page_num
+        self.dpi = dpi
+        self.page_height = page_height
+
+    @property
+    def view(self):
+        """The figure region, rendered on first access."""
+        if self.page_buffer is None:
+            self.page_buffer = render_region(self.pdf_path, self.page_num, self.bbox, self.dpi, self.page_height)
+        return self.page_buffer
+
+    def __repr__(self):
+        return f"ClippedFigureRecord(bbox={self.bbox}, page={self.page_num}, dpi={self.dpi})"
@@ -1,11 +1,21 @@
+import io
 import os
 import re
+import logging
 import tempfile
-import subprocess
 import shutil
+import cv2
+import numpy as np
 from PIL import Image
+from ..utils.supervisor import ToolError, open_tool, run_tool, record_retry
 from config import Config
 
+logger = logging.getLogger(__name__)
+
+# Lowest resolution a failed render is retried at; below ~100 DPI text
+# merges into figure-sized components (see Config.DETECTION_DPI)
+MIN_RETRY_DPI = 100
+
 def render_pdf(filename, customize_dpi=None):
     """
     Renders PDF pages as images using ImageMagick or Ghostscript.
@@ -15,54 +25,499 @@ def render_pdf(filename, customize_dpi=None):
         customize_dpi (int, optional): Custom DPI setting. Defaults to Config.DPI
         
     Returns:
-        list: List of PIL Image objects, one per page
+        list: Page images, one RGB numpy array per page
+    """
+    return [page_im for _, page_im in iter_pdf_pages(filename, customize_dpi)]
+
+def iter_pdf_pages(filename, customize_dpi=None, chunk_size=None, pages=None, gray=False, tiled=None):
+    """
+    Renders PDF pages lazily.
+    
+    With Config.RENDER_TRANSPORT = 'pipe' the renderer streams raw PPM frames
+    over stdout and each page is read straight into a NumPy array. With 'png'
+    the document is rasterised to temporary PNG files a small page range at a
+    time. Either way only one page is held by the generator, so memory stays
+    flat regardless of page count and callers can start working on the first
+    page before the last is rendered.
+    
+    Renderer calls are supervised (see utils.supervisor). When one times out,
+    crashes or runs out of memory, the remaining pages are rendered again at a
+    lower DPI and scaled back up, so pages keep the requested geometry.
+    
+    Args:
+        filename (str): Path to the PDF file
+        customize_dpi (int, optional): Custom DPI setting. Defaults to Config.DPI
+        chunk_size (int, optional): Pages rendered per tool call in 'png' mode. Defaults to Config.RENDER_CHUNK_PAGES
+        pages (list, optional): Sorted 1-based page numbers to render. Defaults to every page
+        gray (bool): Render single-channel pages, for pages that are only used
+            for detection; a third of the size of RGB pages
+        tiled (dict, optional): Page number -> (width, height) in pixels of pages
+            too large to render whole (see oversized_pages); these are yielded as
+            TiledPage objects in their place. Requires an explicit pages list
+        
+    Yields:
+        tuple: (page_number, page) with 1-based page numbers. The page is a newly
+            allocated (height, width, 3) RGB or (height, width) gray numpy array,
+            or a TiledPage
     """
     output_dpi = str(customize_dpi if customize_dpi else Config.DPI)
-    output_dir = tempfile.mkdtemp()
+    if pages is not None and not pages:
+        return
     
-    raster_density = str(Config.RASTER_SCALE * 100)
+    if tiled:
+        if pages is None:
+            raise ValueError("Tiled rendering needs an explicit page list")
+        rendered = iter_pdf_pages(filename, customize_dpi, chunk_size,
+                                  [page_num for page_num in pages if page_num not in tiled], gray)
+        for page_num in pages:
+            if page_num in tiled:
+                width, height = tiled[page_num]
+                yield page_num, TiledPage(filename, page_num, int(output_dpi), width, height)
+                continue
+            page = next(rendered, None)
+            if page is None:
+                # The document ended early
+                return
+            yield page
+        return
+    
+    if Config.RENDER_TRANSPORT == 'pipe':
+        yield from _iter_piped_pages(filename, output_dpi, pages, gray)
+        return
+    if Config.RENDER_TRANSPORT != 'png':
+        raise ValueError(f"Unknown render transport: {Config.RENDER_TRANSPORT}")
+    
+    chunk_size = chunk_size or Config.RENDER_CHUNK_PAGES
+    
+    # Contiguous runs of requested pages, or one open-ended run over the document
+    runs = _page_runs(pages) if pages is not None else [(1, None)]
+    for run_first, run_last in runs:
+        yield from _iter_png_run(filename, output_dpi, chunk_size, run_first, run_last, gray)
+
+def _iter_png_run(filename, output_dpi, chunk_size, first_page, run_last, gray=False):
+    """Render pages first_page..run_last (None for the end of the document) in PNG chunks."""
+    while run_last is None or first_page <= run_last:
+        last_page = first_page + chunk_size - 1
+        if run_last is not None:
+            last_page = min(last_page, run_last)
+        output_dir = tempfile.mkdtemp()
+        
+        def render(dpi):
+            # A failed attempt may have left some pages behind
+            for name in os.listdir(output_dir):
+                os.remove(os.path.join(output_dir, name))
+            _render_page_range(filename, str(dpi), output_dir, first_page, last_page, gray)
+        
+        try:
+            try:
+                _, render_dpi = _with_dpi_fallback(render, int(output_dpi))
+            except ToolError as e:
+                # Renderers reject a first page past the end of the document
+                if e.kind == 'error' and run_last is None and first_page > 1 and not os.listdir(output_dir):
+                    return
+                raise
+            
+            # Process images
+            files = [f for f in os.listdir(output_dir) 
+                    if os.path.isfile(os.path.join(output_dir, f)) 
+                    and not f.startswith('.') and f.endswith('.png')]
+            files = natural_sort(files)
+            
+            mode = 'L' if gray else 'RGB'
+            for offset, f in enumerate(files):
+                with Image.open(os.path.join(output_dir, f)) as page_im:
+                    # convert() copies even when the mode already matches
+                    if page_im.mode != mode:
+                        page_im = page_im.convert(mode)
+                    page = np.asarray(page_im)
+                if render_dpi != int(output_dpi):
+                    page = _rescale(page, int(output_dpi) / render_dpi)
+                yield first_page + offset, page
+        
+        finally:
+            # Clean up temp directory
+            shutil.rmtree(output_dir)
+        
+        # A short chunk means the tool ran past the last page
+        if len(files) < last_page - first_page + 1:
+            return
+        first_page = last_page + 1
+
+def _renderer_name():
+    return 'magick' if os.name == 'nt' else 'gs'
+
+def _retry_dpi(error, dpi, attempt):
+    """
+    DPI for the next attempt after a failed render.
+    
+    Returns:
+        int: The lower DPI, or None when the failure is not worth retrying
+    """
+    lower = max(int(dpi * Config.TOOL_RETRY_DPI_SCALE), MIN_RETRY_DPI)
+    if not error.retryable or attempt >= Config.TOOL_RETRIES or lower >= dpi:
+        return None
+    record_retry(error.tool)
+    logger.warning(f"Retrying {error.tool} at {lower} DPI after {error.kind} at {dpi} DPI")
+    return lower
+
+def _with_dpi_fallback(render, dpi):
+    """
+    Call render(dpi), retrying at a lower DPI after a resource failure.
+    
+    Returns:
+        tuple: (render's result, DPI it succeeded at)
+    """
+    attempt = 0
+    while True:
+        try:
+            return render(dpi), dpi
+        except ToolError as e:
+            lower = _retry_dpi(e, dpi, attempt)
+            if lower is None:
+                raise
+            dpi = lower
+            attempt += 1
 
-    try:
-        if os.name == 'nt':
-            command = [
-                Config.IMAGEMAGICK_PATH,
-                '-density', raster_density,
-                filename,
-                '-resample', output_dpi,
-                '-set', 'colorspace', 'RGB',
-                os.path.join(output_dir, 'image.png')
-            ]
-            print('Executing command:', ' '.join(command))
-            subprocess.call(command)
+def _rescale(image, factor, size=None):
+    """Scale a page or region rendered at a fallback DPI back to the requested resolution."""
+    if size is None:
+        size = (round(image.shape[1] * factor), round(image.shape[0] * factor))
+    return cv2.resize(image, size, interpolation=cv2.INTER_LINEAR)
+
+def _page_runs(pages):
+    """Group sorted page numbers into inclusive (first, last) runs."""
+    runs = []
+    for page_num in pages:
+        if runs and page_num == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], page_num)
         else:
-            command = [
-                'gs',
-                '-q',
-                '-sDEVICE=png16m',
-                '-o', os.path.join(output_dir, 'file-%02d.png'),
-                '-r' + output_dpi,
-                filename
-            ]
-            subprocess.call(command)
-
-        # Process images
-        files = [f for f in os.listdir(output_dir) 
-                if os.path.isfile(os.path.join(output_dir, f)) 
-                and not f.startswith('.')]
-        files = natural_sort(files)
+            runs.append((page_num, page_num))
+    return runs
+
+def format_page_list(pages, offset=0):
+    """
+    Format page numbers as a compact list such as '1,3-5'.
+    
+    Args:
+        pages (list): Sorted page numbers
+        offset (int): Added to every number, e.g. -1 for ImageMagick's 0-based indices
+    """
+    return ','.join(
+        str(first + offset) if first == last else f'{first + offset}-{last + offset}'
+        for first, last in _page_runs(pages)
+    )
+
+def _render_page_range(filename, output_dpi, output_dir, first_page, last_page, gray=False):
+    """Rasterise pages first_page..last_page (1-based, inclusive) as PNG files into output_dir."""
+    raster_density = str(Config.RASTER_SCALE * 100)
+    
+    if os.name == 'nt':
+        command = [
+            Config.IMAGEMAGICK_PATH,
+            '-density', raster_density,
+            f'{filename}[{first_page - 1}-{last_page - 1}]',
+            '-resample', output_dpi,
+            '-set', 'colorspace', 'RGB',
+            *(('-colorspace', 'Gray') if gray else ()),
+            os.path.join(output_dir, 'image.png')
+        ]
+    else:
+        command = [
+            'gs',
+            '-q',
+            '-sDEVICE=' + ('pnggray' if gray else 'png16m'),
+            f'-dFirstPage={first_page}',
+            f'-dLastPage={last_page}',
+            '-o', os.path.join(output_dir, 'file-%02d.png'),
+            '-r' + output_dpi,
+            filename
+        ]
+    page_count = last_page - first_page + 1
+    run_tool(_renderer_name(), command, timeout=Config.TOOL_TIMEOUT * page_count if Config.TOOL_TIMEOUT else None)
+
+def _iter_piped_pages(filename, output_dpi, pages=None, gray=False):
+    """
+    Rasterise pages (all by default) as raw PPM (PGM when gray) on the renderer's
+    stdout and yield them as they arrive. After a resource failure the pages not
+    yet delivered are rendered again at a lower DPI.
+    """
+    dpi = render_dpi = int(output_dpi)
+    remaining = list(pages) if pages is not None else None
+    next_page = 1
+    attempt = 0
+    while True:
+        try:
+            for page_num, page in _stream_pages(filename, str(render_dpi), remaining, gray):
+                if render_dpi != dpi:
+                    page = _rescale(page, dpi / render_dpi)
+                yield page_num, page
+                next_page = page_num + 1
+            return
+        except ToolError as e:
+            lower = _retry_dpi(e, render_dpi, attempt)
+            if lower is None:
+                raise
+            if remaining is None:
+                # An open-ended render is resumed from an explicit page list
+                from .html_converter import pdf_page_count
+                page_count = pdf_page_count(filename)
+                if not page_count:
+                    raise
+                remaining = list(range(1, page_count + 1))
+            remaining = [page_num for page_num in remaining if page_num >= next_page]
+            if not remaining:
+                return
+            render_dpi = lower
+            attempt += 1
+
+def _stream_pages(filename, output_dpi, pages=None, gray=False):
+    """One supervised renderer call streaming pages; the timeout applies per page."""
+    if os.name == 'nt':
+        command = [
+            Config.IMAGEMAGICK_PATH,
+            '-density', str(Config.RASTER_SCALE * 100),
+            f'{filename}[{format_page_list(pages, -1)}]' if pages is not None else filename,
+            '-resample', output_dpi,
+            '-set', 'colorspace', 'RGB',
+            *(('-colorspace', 'Gray', 'pgm:-') if gray else ('ppm:-',))
+        ]
+    else:
+        command = [
+            'gs',
+            '-q',
+            '-sDEVICE=' + ('pgmraw' if gray else 'ppmraw'),
+            '-o', '-',
+            '-r' + output_dpi
+        ]
+        if pages is not None:
+            command.append(f'-sPageList={format_page_list(pages)}')
+        command.append(filename)
+    
+    # Frames arrive in document order, one per requested page
+    page_numbers = iter(pages) if pages is not None else None
+    with open_tool(_renderer_name(), command, timeout=Config.TOOL_TIMEOUT) as process:
+        page_num = 0
+        while True:
+            try:
+                page = read_pnm_frame(process.stdout)
+            except (EOFError, ValueError):
+                # A killed or crashed renderer leaves a truncated frame
+                process.finish()
+                raise
+            if page is None:
+                break
+            page_num = next(page_numbers) if page_numbers is not None else page_num + 1
+            # Time spent by the consumer does not count against the renderer
+            process.pause()
+            yield page_num, page
+            process.touch()
+        process.finish()
+
+def render_region(filename, page_num, bbox, dpi, page_height, gray=False):
+    """
+    Rasterise one rectangular region of a page.
+    
+    Ghostscript renders into a device of exactly the region's size (-g) with
+    the page shifted by PageOffset so that the region lands on it, so only the
+    region's pixels are ever produced.
+    
+    After a resource failure the region is rendered at a lower DPI and
+    scaled to the requested size.
+    
+    Args:
+        filename (str): Path to the PDF file
+        page_num (int): 1-based page number
+        bbox (tuple): (x, y, width, height) in pixels at dpi, origin at the top left
+        dpi (int): Output resolution
+        page_height (int): Height of the page in pixels at dpi
+        gray (bool): Render a single-channel region
+        
+    Returns:
+        numpy.ndarray: (height, width, 3) RGB or (height, width) gray region
+    """
+    x, y, width, height = (int(v) for v in bbox)
+    
+    def render(render_dpi):
+        factor = render_dpi / dpi
+        scaled = (int(x * factor), int(y * factor), max(1, round(width * factor)), max(1, round(height * factor)))
+        return _render_region(filename, page_num, scaled, render_dpi, round(page_height * factor), gray)
+    
+    region, render_dpi = _with_dpi_fallback(render, dpi)
+    if render_dpi != dpi:
+        region = _rescale(region, dpi / render_dpi, (width, height))
+    return region
+
+def _render_region(filename, page_num, bbox, dpi, page_height, gray=False):
+    """One supervised renderer call for render_region."""
+    x, y, width, height = bbox
+    
+    if os.name == 'nt':
+        command = [
+            Config.IMAGEMAGICK_PATH,
+            '-density', str(Config.RASTER_SCALE * 100),
+            f'{filename}[{page_num - 1}]',
+            '-resample', str(dpi),
+            '-crop', f'{width}x{height}+{x}+{y}', '+repage',
+            '-set', 'colorspace', 'RGB',
+            *(('-colorspace', 'Gray', 'pgm:-') if gray else ('ppm:-',))
+        ]
+    else:
+        # PageOffset is in points and measured from the bottom left of the page
+        points = 72 / dpi
+        offset_x = -x * points
+        offset_y = -(page_height - y - height) * points
+        command = [
+            'gs',
+            '-q',
+            '-sDEVICE=' + ('pgmraw' if gray else 'ppmraw'),
+            '-o', '-',
+            f'-r{dpi}',
+            f'-dFirstPage={page_num}',
+            f'-dLastPage={page_num}',
+            f'-g{width}x{height}',
+            '-dFIXEDMEDIA',
+            '-c', f'<</PageOffset [{offset_x:.4f} {offset_y:.4f}]>> setpagedevice',
+            '-f', filename
+        ]
+    
+    completed = run_tool(_renderer_name(), command, timeout=Config.TOOL_TIMEOUT, capture_stdout=True)
+    region = read_pnm_frame(io.BytesIO(completed.stdout))
+    if region is None:
+        raise ValueError(f"Renderer returned no image for page {page_num} region {bbox}")
+    return region
+
+class TiledPage:
+    """
+    A page too large to render whole, rendered in full-width bands on demand.
+    
+    Each band is a separate region render (see render_region) of at most
+    Config.TILE_PIXELS gray pixels, so memory is bounded by the band size
+    whatever the page size. Iterating the bands again renders them again.
+    """
+    
+    def __init__(self, filename, page_num, dpi, width, height):
+        """
+        Initialize the page.
+        
+        Args:
+            filename (str): Path to the PDF file
+            page_num (int): 1-based page number
+            dpi (int): Resolution the bands are rendered at
+            width (int): Page width in pixels at dpi
+            height (int): Page height in pixels at dpi
+        """
+        self.filename = filename
+        self.page_num = page_num
+        self.dpi = dpi
+        self.width = width
+        self.height = height
+    
+    @property
+    def shape(self):
+        """(height, width) of the page in pixels, like a gray page array."""
+        return (self.height, self.width)
+    
+    def iter_bands(self, tile_pixels=None):
+        """
+        Render the page top to bottom.
         
-        images = []
-        for f in files:
-            if f.endswith('.png'):
-                page_im = Image.open(os.path.join(output_dir, f)).convert('RGB')
-                page_im.load()
-                images.append(page_im)
-                
-        return images
-    
-    finally:
-        # Clean up temp directory
-        shutil.rmtree(output_dir)
+        Args:
+            tile_pixels (int, optional): Pixels per band. Defaults to Config.TILE_PIXELS
+            
+        Yields:
+            tuple: (y, band) where band is a (rows, width) uint8 gray array starting at page row y
+        """
+        rows = max(1, (tile_pixels or Config.TILE_PIXELS) // self.width)
+        for y in range(0, self.height, rows):
+            bbox = (0, y, self.width, min(rows, self.height - y))
+            yield y, render_region(self.filename, self.page_num, bbox, self.dpi, self.height, gray=True)
+    
+    def __repr__(self):
+        return f"TiledPage(page={self.page_num}, {self.width}x{self.height} at {self.dpi} DPI)"
+
+def oversized_pages(filename, dpi, budget=None):
+    """
+    Find the pages whose render would exceed the pixel budget.
+    
+    Page sizes are read with pdfinfo. When it is not installed, or tiling is
+    disabled, pdfinfo is not run and no page is reported.
+    
+    Args:
+        filename (str): Path to the PDF file
+        dpi (int): Resolution the pages are rendered at
+        budget (int, optional): Largest page in pixels rendered whole.
+            Defaults to Config.TILE_PIXEL_BUDGET; 0 or None disables tiling
+        
+    Returns:
+        tuple: (page_count, {page_number: (width, height)} in pixels at dpi),
+            or (None, {}) when the page sizes are unknown
+    """
+    from .html_converter import pdf_page_sizes, pdfinfo_available
+    budget = Config.TILE_PIXEL_BUDGET if budget is None else budget
+    if not budget or not pdfinfo_available():
+        return None, {}
+    sizes = pdf_page_sizes(filename, quiet=True)
+    if not sizes:
+        return None, {}
+    oversized = {}
+    for page_num, (width_pt, height_pt) in sizes.items():
+        width, height = round(width_pt * dpi / 72), round(height_pt * dpi / 72)
+        if width * height > budget:
+            oversized[page_num] = (width, height)
+    return max(sizes), oversized
+
+def read_pnm_frame(stream):
+    """
+    Read one binary PPM (P6) or PGM (P5) frame from a stream.
+    
+    The pixel data is read directly into a newly allocated array, so each
+    page costs exactly one buffer and no intermediate bytes object.
+    
+    Args:
+        stream: Binary file object positioned at the start of a frame
+        
+    Returns:
+        numpy.ndarray: (height, width, 3) RGB or (height, width) gray uint8 array,
+            or None at end of stream
+    """
+    magic = _read_pnm_token(stream)
+    if magic is None:
+        return None
+    if magic not in (b'P6', b'P5'):
+        raise ValueError(f"Unsupported PNM frame type: {magic!r}")
+    
+    width = int(_read_pnm_token(stream))
+    height = int(_read_pnm_token(stream))
+    maxval = int(_read_pnm_token(stream))
+    if maxval > 255:
+        raise ValueError(f"Unsupported PNM maxval: {maxval}")
+    
+    shape = (height, width, 3) if magic == b'P6' else (height, width)
+    page = np.empty(shape, dtype=np.uint8)
+    view = memoryview(page).cast('B')
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:])
+        if not count:
+            raise EOFError(f"Truncated PNM frame after {filled} of {len(view)} bytes")
+        filled += count
+    return page
+
+def _read_pnm_token(stream):
+    """Read one whitespace-delimited PNM header token, skipping comments."""
+    token = b''
+    while True:
+        char = stream.read(1)
+        if not char:
+            return token or None
+        if char == b'#' and not token:
+            stream.readline()
+        elif char.isspace():
+            if token:
+                # The single whitespace after maxval is consumed here too
+                return token
+        else:
+            token += char
 
 def natural_sort(l):
     """Sorts strings containing numbers in human order"""
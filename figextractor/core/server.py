@@ -0,0 +1,525 @@
+"""
+Local HTTP service that runs PDFs through the extraction pipeline.
+
+Endpoints:
+    POST /extract   PDF bytes (Content-Type: application/pdf, optional ?name=)
+                    or JSON {"path": "..."} naming a PDF under Config.SERVER_PATH_ROOTS.
+                    Query or JSON options: images=reference|inline, timeout=<seconds>.
+                    Returns the PDF's metadata; figures carry an image_url
+                    (reference) or base64 image_data (inline).
+    GET /figures/<job>/<output dir>/<file>   Serves a figure or caption file
+                    listed in that job's response
+    GET /health     Worker pool and queue state as JSON
+    GET /metrics    Request counters and latencies in the Prometheus text format
+
+At most Config.SERVER_MAX_CONCURRENCY PDFs are processed at once and
+Config.SERVER_QUEUE_SIZE more may wait; beyond that requests are refused
+with 429 and a Retry-After header instead of piling up.
+
+Figure URLs stay valid for Config.SERVER_RESULT_TTL seconds. The output
+folders of uploaded PDFs are deleted when their URLs expire, or that long
+after the job ends if its request gave up waiting.
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import base64
+import shutil
+import signal
+import logging
+import threading
+from functools import partial
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from .pdf_processor import process_pdf
+from .daemon import _init_daemon_worker
+from .index import get_default_index
+from ..utils.metrics import append_pdf_metrics, prometheus_label
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+IMAGE_MODES = ('reference', 'inline')
+
+
+class RequestError(Exception):
+    """A request the service refuses, with the HTTP status to answer with."""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def _extract(pdf_path):
+    """Worker entry point: process one PDF and return its metadata."""
+    data = process_pdf(pdf_path)
+    return next(iter(data.values()))
+
+
+class ExtractionService:
+    def __init__(self, max_concurrency=None, queue_size=None, request_timeout=None, path_roots=None,
+                 result_ttl=None):
+        """
+        Worker pool and admission control behind the HTTP handler.
+
+        Args:
+            max_concurrency (int, optional): PDFs processed at once. Defaults to Config.SERVER_MAX_CONCURRENCY
+            queue_size (int, optional): Requests allowed to wait for a worker. Defaults to Config.SERVER_QUEUE_SIZE
+            request_timeout (float, optional): Longest a request may take, in seconds.
+                Defaults to Config.SERVER_REQUEST_TIMEOUT
+            path_roots (list, optional): Directories that path requests may read from.
+                Defaults to Config.SERVER_PATH_ROOTS, or Config.INPUT_DIR when that is None
+            result_ttl (float, optional): Seconds a job's figure URLs and an upload's
+                output folder are kept. Defaults to Config.SERVER_RESULT_TTL
+        """
+        self.max_concurrency = max_concurrency or Config.SERVER_MAX_CONCURRENCY
+        self.queue_size = Config.SERVER_QUEUE_SIZE if queue_size is None else queue_size
+        self.request_timeout = request_timeout or Config.SERVER_REQUEST_TIMEOUT
+        self.result_ttl = Config.SERVER_RESULT_TTL if result_ttl is None else result_ttl
+        roots = path_roots or Config.SERVER_PATH_ROOTS or [Config.INPUT_DIR]
+        self.path_roots = [os.path.realpath(root) for root in roots]
+        self.upload_dir = os.path.join(Config.TEMP_DIR, 'uploads')
+        os.makedirs(self.upload_dir, exist_ok=True)
+
+        self._executor = ProcessPoolExecutor(max_workers=self.max_concurrency, initializer=_init_daemon_worker)
+        # A slot is held from admission until the job finishes, even if its
+        # request has already timed out, so timeouts cannot oversubscribe the workers
+        self._slots = threading.BoundedSemaphore(self.max_concurrency + self.queue_size)
+        self._lock = threading.Lock()
+        self._jobs = set()
+        self._started = time.time()
+        self._requests = {}
+        self._extract_seconds = 0.0
+        self._extract_count = 0
+        # key -> (expiry, {servable path relative to OUTPUT_DIR: absolute path},
+        # upload output folder to delete or None), in expiry order
+        self._published = {}
+        # Jobs whose request timed out while they were still running
+        self._abandoned = set()
+        self.closing = False
+
+    def admit(self):
+        """Reserve a slot for one extraction or raise a 429 RequestError."""
+        if self.closing:
+            raise RequestError(503, "Service is shutting down")
+        if not self._slots.acquire(blocking=False):
+            raise RequestError(429, "Too many requests in progress",
+                               {'Retry-After': str(self.retry_after())})
+
+    def release(self):
+        """Give back a slot reserved with admit() that was not used for a job."""
+        self._slots.release()
+
+    def retry_after(self):
+        """Seconds a refused client should wait, from the average extraction time."""
+        with self._lock:
+            if not self._extract_count:
+                return 1
+            return max(1, math.ceil(self._extract_seconds / self._extract_count))
+
+    def run(self, pdf_path, timeout=None, remove_after=False):
+        """
+        Process a PDF on the worker pool. The caller must hold a slot from admit().
+
+        Args:
+            pdf_path (str): PDF to process
+            timeout (float, optional): Seconds to wait, capped at the service's request timeout
+            remove_after (bool): Delete the PDF once the job is over (uploads), which may
+                be after the request timed out. Its output folder is deleted later, see publish
+
+        Returns:
+            dict: The PDF's metadata
+        """
+        timeout = min(timeout or self.request_timeout, self.request_timeout)
+        executor = self._executor
+        try:
+            future = executor.submit(_extract, pdf_path)
+        except BaseException:
+            self._slots.release()
+            if remove_after:
+                os.remove(pdf_path)
+            raise
+        start = time.perf_counter()
+        with self._lock:
+            self._jobs.add(future)
+        future.add_done_callback(partial(self._job_done, pdf_path if remove_after else None))
+
+        try:
+            data = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            if remove_after:
+                with self._lock:
+                    if future.done():
+                        self._publish_locked({}, pdf_path)
+                    else:
+                        # _job_done schedules the output for deletion
+                        self._abandoned.add(future)
+            if future.cancel():
+                raise RequestError(504, f"Timed out after {timeout:g}s waiting for a worker")
+            raise RequestError(504, f"Timed out after {timeout:g}s; the PDF is still being processed")
+        except BaseException as e:
+            if remove_after:
+                self.publish({}, pdf_path)
+            if isinstance(e, BrokenProcessPool):
+                self._replace_executor(executor)
+                raise RequestError(500, "Worker process terminated abruptly")
+            raise
+
+        with self._lock:
+            self._extract_seconds += time.perf_counter() - start
+            self._extract_count += 1
+            if Config.METRICS_ENABLED and Config.METRICS_FORMAT == 'jsonl' and data.get('metrics'):
+                append_pdf_metrics(os.path.basename(pdf_path), data['metrics'])
+        return data
+
+    def _job_done(self, remove_path, future):
+        with self._lock:
+            self._jobs.discard(future)
+            if future in self._abandoned:
+                self._abandoned.discard(future)
+                self._publish_locked({}, remove_path)
+        self._slots.release()
+        if remove_path and os.path.exists(remove_path):
+            os.remove(remove_path)
+
+    def _replace_executor(self, executor):
+        with self._lock:
+            if self._executor is executor and not self.closing:
+                logger.error("Worker pool broke, starting a new one")
+                executor.shutdown(wait=False)
+                self._executor = ProcessPoolExecutor(max_workers=self.max_concurrency,
+                                                     initializer=_init_daemon_worker)
+
+    def resolve_path(self, path):
+        """Check that a requested path is a PDF under one of the allowed roots."""
+        real = os.path.realpath(path)
+        if not any(os.path.commonpath([real, root]) == root for root in self.path_roots):
+            raise RequestError(403, "Path is outside the allowed directories")
+        if not os.path.isfile(real):
+            raise RequestError(404, "No such PDF")
+        return real
+
+    def publish(self, files, upload_path=None):
+        """
+        Make a job's artefacts servable for result_ttl seconds.
+
+        Args:
+            files (list): Paths relative to Config.OUTPUT_DIR, '/'-separated
+            upload_path (str, optional): Uploaded PDF whose output folder is deleted
+                once the entry expires
+
+        Returns:
+            str: Job id for /figures/<job>/<path> URLs
+        """
+        with self._lock:
+            key = self._publish_locked(files, upload_path)
+        self.expire()
+        return key
+
+    def _publish_locked(self, files, upload_path):
+        key = uuid.uuid4().hex
+        root = os.path.realpath(Config.OUTPUT_DIR)
+        output_dir = None
+        if upload_path:
+            output_dir = os.path.join(root, os.path.splitext(os.path.basename(upload_path))[0])
+        servable = {path: os.path.join(root, *path.split('/')) for path in files}
+        self._published[key] = (time.monotonic() + self.result_ttl, servable, output_dir)
+        return key
+
+    def lookup(self, key, path):
+        """
+        Absolute path of an artefact published under a job, or None.
+
+        Args:
+            key (str): Job id from publish
+            path (str): '/'-separated path relative to Config.OUTPUT_DIR
+        """
+        self.expire()
+        with self._lock:
+            entry = self._published.get(key)
+            return entry[1].get(path) if entry else None
+
+    def expire(self, everything=False):
+        """Forget expired jobs and delete the output folders of expired uploads."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            # Every entry lives equally long, so insertion order is expiry order
+            for key, (expiry, _, output_dir) in list(self._published.items()):
+                if expiry > now and not everything:
+                    break
+                del self._published[key]
+                if output_dir:
+                    expired.append(output_dir)
+        for output_dir in expired:
+            shutil.rmtree(output_dir, ignore_errors=True)
+            if Config.INDEX_ENABLED:
+                try:
+                    get_default_index().remove_document(os.path.basename(output_dir) + '.pdf')
+                except Exception as e:
+                    logger.warning(f"Failed to drop {os.path.basename(output_dir)} from the index: {str(e)}")
+            logger.info(f"Deleted expired upload output {output_dir}")
+
+    def count_request(self, endpoint, status):
+        with self._lock:
+            key = (endpoint, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+    def stats(self):
+        """
+        Current state of the worker pool and queue.
+
+        Returns:
+            dict: Running and queued jobs, capacity and average extraction time
+        """
+        with self._lock:
+            # Future.running() also counts the call the pool prefetches for an idle worker
+            running = min(len(self._jobs), self.max_concurrency)
+            return {
+                'status': 'closing' if self.closing else 'ok',
+                'uptime_seconds': time.time() - self._started,
+                'max_concurrency': self.max_concurrency,
+                'queue_size': self.queue_size,
+                'running': running,
+                'queued': len(self._jobs) - running,
+                'completed': self._extract_count,
+                'mean_extract_seconds': (self._extract_seconds / self._extract_count
+                                         if self._extract_count else None)
+            }
+
+    def format_metrics(self):
+        """Service metrics in the Prometheus text exposition format."""
+        stats = self.stats()
+        with self._lock:
+            requests = dict(self._requests)
+            extract_seconds, extract_count = self._extract_seconds, self._extract_count
+        lines = [
+            '# HELP figextractor_http_requests_total HTTP requests by endpoint and status',
+            '# TYPE figextractor_http_requests_total counter'
+        ]
+        for (endpoint, status), count in sorted(requests.items()):
+            lines.append(f'figextractor_http_requests_total{{endpoint="{prometheus_label(endpoint)}",'
+                         f'code="{status}"}} {count}')
+        gauges = (
+            ('running', 'PDFs being processed'),
+            ('queued', 'Requests waiting for a worker'),
+            ('max_concurrency', 'PDFs processed at once at most'),
+            ('queue_size', 'Requests allowed to wait for a worker'),
+        )
+        for key, help_text in gauges:
+            lines.append(f'# HELP figextractor_http_{key} {help_text}')
+            lines.append(f'# TYPE figextractor_http_{key} gauge')
+            lines.append(f'figextractor_http_{key} {stats[key]}')
+        lines.append('# HELP figextractor_http_extract_seconds Time from submission to result of completed extractions')
+        lines.append('# TYPE figextractor_http_extract_seconds summary')
+        lines.append(f'figextractor_http_extract_seconds_sum {extract_seconds}')
+        lines.append(f'figextractor_http_extract_seconds_count {extract_count}')
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        """Refuse new work, wait for admitted jobs to finish and delete upload outputs."""
+        self.closing = True
+        self._executor.shutdown(wait=True)
+        # Figure URLs end with the service
+        self.expire(everything=True)
+
+
+class ExtractionHandler(BaseHTTPRequestHandler):
+    server_version = 'FigExtractor'
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload, headers=None):
+        self._send(status, json.dumps(payload), headers=headers)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/health':
+            stats = self.service.stats()
+            status = 503 if self.service.closing else 200
+            self._send_json(status, stats)
+            self.service.count_request('health', status)
+        elif path == '/metrics':
+            self._send(200, self.service.format_metrics(), 'text/plain; version=0.0.4')
+            self.service.count_request('metrics', 200)
+        elif path.startswith('/figures/'):
+            status = self._serve_file(unquote(path[len('/figures/'):]))
+            self.service.count_request('figures', status)
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def _serve_file(self, relative):
+        # Only the artefacts a job's response listed are served, under that job's id
+        key, _, path = relative.partition('/')
+        real = self.service.lookup(key, path)
+        if real is None or not os.path.isfile(real):
+            self._send_json(404, {'error': 'Not found'})
+            return 404
+        content_types = {'.jpg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp',
+                         '.txt': 'text/plain; charset=utf-8', '.json': 'application/json'}
+        with open(real, 'rb') as f:
+            self._send(200, f.read(), content_types.get(os.path.splitext(real)[1], 'application/octet-stream'))
+        return 200
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/extract':
+            self._send_json(404, {'error': 'Not found'})
+            return
+        try:
+            payload = self._extract(parse_qs(url.query))
+            status, headers = 200, None
+        except RequestError as e:
+            payload, status, headers = {'error': str(e)}, e.status, e.headers
+        except Exception as e:
+            logger.error(f"Extraction request failed: {type(e).__name__}: {str(e)}")
+            payload, status, headers = {'error': f"{type(e).__name__}: {str(e)}"}, 500, None
+        self._send_json(status, payload, headers)
+        self.service.count_request('extract', status)
+
+    def _read_body(self):
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            raise RequestError(411, "Content-Length required")
+        if length > Config.SERVER_MAX_UPLOAD_MB * 1024 * 1024:
+            raise RequestError(413, f"Upload larger than {Config.SERVER_MAX_UPLOAD_MB} MB")
+        return self.rfile.read(length)
+
+    def _extract(self, query):
+        options = {key: values[-1] for key, values in query.items()}
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip()
+
+        # Admit before reading an upload, so a full service does not buy the bytes first
+        self.service.admit()
+        upload_path = None
+        try:
+            body = self._read_body()
+            if content_type == 'application/json':
+                try:
+                    request = json.loads(body or b'{}')
+                except ValueError:
+                    raise RequestError(400, "Malformed JSON body")
+                options.update({key: value for key, value in request.items() if key != 'path'})
+                if not request.get('path'):
+                    raise RequestError(400, "JSON requests need a 'path'")
+                pdf_path = self.service.resolve_path(request['path'])
+            elif content_type == 'application/pdf':
+                if not body.startswith(b'%PDF'):
+                    raise RequestError(400, "Body is not a PDF")
+                # A unique name keeps concurrent uploads of the same file apart in OUTPUT_DIR
+                stem = os.path.splitext(os.path.basename(options.get('name') or 'upload.pdf'))[0]
+                upload_path = os.path.join(self.service.upload_dir, f"{stem}-{uuid.uuid4().hex[:8]}.pdf")
+                with open(upload_path, 'wb') as f:
+                    f.write(body)
+                pdf_path = upload_path
+            else:
+                raise RequestError(415, "Send application/pdf or application/json")
+
+            images = options.get('images', 'reference')
+            if images not in IMAGE_MODES:
+                raise RequestError(400, f"images must be one of {', '.join(IMAGE_MODES)}")
+            try:
+                timeout = float(options['timeout']) if options.get('timeout') else None
+            except (TypeError, ValueError):
+                raise RequestError(400, "timeout must be a number of seconds")
+        except BaseException:
+            self.service.release()
+            if upload_path and os.path.exists(upload_path):
+                os.remove(upload_path)
+            raise
+
+        start = time.perf_counter()
+        metadata = self.service.run(pdf_path, timeout, remove_after=upload_path is not None)
+
+        output_name = os.path.splitext(os.path.basename(pdf_path))[0]
+        output_dir = os.path.join(Config.OUTPUT_DIR, output_name)
+        artefacts = []
+        figure_images = []
+        for figure in metadata['figures']:
+            if figure.get('caption_bb') is not None:
+                artefacts.append(f"{output_name}/page_{figure['page']}_caption_{figure['figure_number']}.txt")
+            image_file = figure.get('image_file')
+            if image_file:
+                image = f"{output_name}/{image_file}"
+            elif figure.get('duplicate_of'):
+                # Deduplicated figures point at an image saved for another PDF
+                image = figure['duplicate_of'].replace(os.sep, '/')
+            else:
+                continue
+            artefacts.append(image)
+            figure_images.append((figure, image))
+        try:
+            for figure, image in figure_images:
+                if images == 'inline':
+                    with open(os.path.join(Config.OUTPUT_DIR, image), 'rb') as f:
+                        figure['image_data'] = base64.b64encode(f.read()).decode('ascii')
+        finally:
+            job = self.service.publish(artefacts, upload_path)
+        if images == 'reference':
+            for figure, image in figure_images:
+                figure['image_url'] = f"/figures/{job}/{image}"
+        return {
+            'pdf': os.path.basename(pdf_path),
+            'output_dir': output_dir,
+            'seconds': time.perf_counter() - start,
+            'metadata': metadata
+        }
+
+
+def run_server(host=None, port=None, **kwargs):
+    """
+    Serve extraction requests until SIGTERM or SIGINT.
+
+    Args:
+        host (str, optional): Interface to bind. Defaults to Config.SERVER_HOST
+        port (int, optional): Port to bind. Defaults to Config.SERVER_PORT
+        **kwargs: See ExtractionService
+    """
+    service = ExtractionService(**kwargs)
+    httpd = ThreadingHTTPServer((host or Config.SERVER_HOST, Config.SERVER_PORT if port is None else port),
+                                ExtractionHandler)
+    # server_close() joins the handler threads, so requests in progress get their response
+    httpd.daemon_threads = False
+    httpd.service = service
+
+    def stop(signum, frame):
+        logger.info(f"Stopping HTTP service on {signal.Signals(signum).name}")
+        service.closing = True
+        # shutdown() waits for serve_forever, so it cannot run on this thread
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+    host, port = httpd.server_address[:2]
+    logger.info(f"Serving on http://{host}:{port} with {service.max_concurrency} workers")
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        service.close()
+        logger.info("HTTP service stopped")
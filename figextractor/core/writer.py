@@ -0,0 +1,262 @@
+"""
+Output stage that encodes and writes extraction artefacts off the critical path.
+"""
+
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from ..utils.metrics import NULL_METRICS
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# File extension per configured figure format; 'none' writes no image files
+FIGURE_EXTENSIONS = {
+    'jpeg': '.jpg',
+    'png': '.png',
+    'webp': '.webp',
+    'none': None
+}
+
+
+def atomic_write(path, data, fsync=False):
+    """
+    Write data to path so that readers never see a partial file.
+
+    Args:
+        path (str): Destination path
+        data (bytes or str): Content; str is written as UTF-8
+        fsync (bool): Flush the file to disk before it is renamed into place
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ArtifactWriter:
+    def __init__(self, max_workers=None, max_pending=None, figure_format=None, quality=None, fsync=None,
+                 metrics=None):
+        """
+        Initialize the writer.
+
+        Args:
+            max_workers (int, optional): Encoding threads. Defaults to Config.WRITER_THREADS
+            max_pending (int, optional): Queued artefacts before submit blocks. Defaults to Config.WRITER_MAX_PENDING
+            figure_format (str, optional): 'jpeg', 'png', 'webp' or 'none'. Defaults to Config.FIGURE_FORMAT
+            quality (int, optional): Encoder quality. Defaults to Config.FIGURE_QUALITY
+            fsync (bool, optional): fsync each file before publishing it. Defaults to Config.WRITER_FSYNC
+            metrics (PdfMetrics, optional): Collector for the 'save' stage, timed on the writer threads
+        """
+        self.figure_format = figure_format or Config.FIGURE_FORMAT
+        if self.figure_format not in FIGURE_EXTENSIONS:
+            raise ValueError(f"Unknown figure format: {self.figure_format}")
+        self.quality = quality if quality is not None else Config.FIGURE_QUALITY
+        self.fsync = Config.WRITER_FSYNC if fsync is None else fsync
+        self.metrics = metrics or NULL_METRICS
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or Config.WRITER_THREADS,
+            thread_name_prefix='artifact-writer'
+        )
+        # Backpressure: extraction blocks once this many artefacts are in flight,
+        # so queued page buffers can't pile up faster than they are written
+        self._slots = threading.BoundedSemaphore(max_pending or Config.WRITER_MAX_PENDING)
+        self._errors = []
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def figure_path(self, base_path):
+        """
+        Path a figure will be written to, or None when images are disabled.
+
+        Args:
+            base_path (str): Output path without extension
+        """
+        extension = FIGURE_EXTENSIONS[self.figure_format]
+        return base_path + extension if extension else None
+
+    def submit_figure(self, figure, base_path):
+        """
+        Queue a figure for encoding and writing.
+
+        Args:
+            figure (FigureRecord): Figure to save; its page reference is released once written
+            base_path (str): Output path without extension
+
+        Returns:
+            str: Path the figure will be written to, or None when images are disabled
+        """
+        path = self.figure_path(base_path)
+        if path is None:
+            figure.release()
+            return None
+
+        def write():
+            try:
+                with self.metrics.stage('save', figures=1):
+                    atomic_write(path, figure.encode(os.path.splitext(path)[1], self.quality), self.fsync)
+            finally:
+                figure.release()
+
+        self._submit(write)
+        return path
+
+    def submit_text(self, path, text):
+        """Queue a text file to be written."""
+        def write():
+            with self.metrics.stage('save'):
+                atomic_write(path, text, self.fsync)
+
+        self._submit(write)
+
+    def when_written(self, callback, on_error=None):
+        """
+        Call callback once every artefact submitted so far is on disk.
+
+        The callback runs on a writer thread, or immediately when nothing is
+        pending. It is not called if any of those artefacts failed to write;
+        on_error is called instead.
+
+        Args:
+            callback (callable): Called without arguments
+            on_error (callable, optional): Called without arguments after a failure
+        """
+        with self._lock:
+            waiting = set(self._pending)
+            if not waiting:
+                failed = bool(self._errors)
+        if not waiting:
+            if not failed:
+                callback()
+            elif on_error:
+                on_error()
+            return
+
+        remaining = [len(waiting)]
+        failed = [False]
+        lock = threading.Lock()
+
+        def done(future):
+            with lock:
+                remaining[0] -= 1
+                failed[0] = failed[0] or future.exception() is not None
+                finished = remaining[0] == 0
+            if not finished:
+                return
+            if not failed[0]:
+                callback()
+            elif on_error:
+                on_error()
+
+        for future in waiting:
+            future.add_done_callback(done)
+
+    def _submit(self, task):
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(task)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self._slots.release()
+        error = future.exception()
+        with self._lock:
+            self._pending.discard(future)
+            if error is not None:
+                self._errors.append(error)
+
+    def close(self):
+        """Wait for all queued artefacts and raise the first write error, if any."""
+        self._executor.shutdown(wait=True)
+        if self._errors:
+            raise self._errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't mask the original error with a write failure
+            self._executor.shutdown(wait=True)
+        return False
+
+
+class MetadataStream:
+    """
+    Write metadata.json incrementally as figures are produced.
+
+    The file has the same shape as before, {pdf_name: {'figures': [...],
+    'pages_annotated': [...]}} plus 'metrics' when instrumentation is
+    enabled, but each figure is serialised as soon as it is added and not
+    kept in memory. Content goes to a temporary file that replaces the
+    target only when the stream is closed successfully.
+    """
+
+    def __init__(self, path, pdf_name, fsync=None):
+        self.path = path
+        self.fsync = Config.WRITER_FSYNC if fsync is None else fsync
+        self.pages_annotated = []
+        self._count = 0
+        self._tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        self._file = open(self._tmp_path, 'w', encoding='utf-8')
+        self._file.write('{\n  ' + json.dumps(pdf_name) + ': {\n    "figures": [')
+
+    @property
+    def figure_count(self):
+        """Number of figure entries written so far."""
+        return self._count
+
+    def add_figure(self, figure_data):
+        """Append one figure entry."""
+        entry = json.dumps(figure_data, indent=2).replace('\n', '\n      ')
+        self._file.write((',\n      ' if self._count else '\n      ') + entry)
+        self._count += 1
+
+    def add_page(self, page_num):
+        """Record a page as annotated."""
+        self.pages_annotated.append(page_num)
+
+    def close(self, metrics=None):
+        """
+        Finish the document and publish it atomically.
+
+        Args:
+            metrics (dict, optional): Pipeline metrics stored under 'metrics'
+        """
+        closing = '\n    ],\n' if self._count else '],\n'
+        pages = json.dumps(self.pages_annotated, indent=2).replace('\n', '\n    ')
+        self._file.write(closing + '    "pages_annotated": ' + pages)
+        if metrics is not None:
+            self._file.write(',\n    "metrics": ' + json.dumps(metrics, indent=2).replace('\n', '\n    '))
+        self._file.write('\n  }\n}')
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """Discard the partial document."""
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
@@ -10,6 +10,7 @@ from .helpers import (
     compute_overlap,
     find_caption_text
 )
+from .driver_pool import DriverPool, get_default_pool, close_default_pool
 
 __all__ = [
     'setup_chrome_driver',
@@ -17,5 +18,8 @@ __all__ = [
     'create_output_directory',
     'get_bounding_box',
     'compute_overlap',
-    'find_caption_text'
+    'find_caption_text',
+    'DriverPool',
+    'get_default_pool',
+    'close_default_pool'
 ]
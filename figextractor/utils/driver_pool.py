@@ -0,0 +1,255 @@
+"""
+Pool of warm headless Chrome drivers for the 'selenium' caption backend.
+"""
+
+import os
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from .helpers import setup_chrome_driver
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def process_tree_rss(pid):
+    """
+    Resident memory of a process and all of its descendants.
+
+    Args:
+        pid (int): Root process id (e.g. chromedriver, whose children are Chrome)
+
+    Returns:
+        int: RSS in bytes, or None where /proc is unavailable
+    """
+    if not os.path.isdir('/proc'):
+        return None
+
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces, the ppid follows its closing paren
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f'/proc/{current}/statm') as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+        stack.extend(children.get(current, []))
+    return total
+
+
+class PooledDriver:
+    """
+    A pooled WebDriver that counts the pages loaded through it.
+
+    Attribute access is forwarded to the wrapped driver, so the extractor can
+    use it exactly like a plain WebDriver.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.baseline_rss = self._rss()
+
+    def get(self, url):
+        self.pages += 1
+        return self.driver.get(url)
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+    def _pid(self):
+        service = getattr(self.driver, 'service', None)
+        process = getattr(service, 'process', None)
+        return process.pid if process is not None else None
+
+    def _rss(self):
+        pid = self._pid()
+        return process_tree_rss(pid) if pid else None
+
+    def is_alive(self):
+        """Check that the driver process is running and the browser answers a trivial script."""
+        service = getattr(self.driver, 'service', None)
+        process = getattr(service, 'process', None)
+        if process is not None and process.poll() is not None:
+            return False
+        try:
+            return self.driver.execute_script('return 1') == 1
+        except Exception:
+            return False
+
+    def rss_growth(self):
+        """Growth in resident memory of the driver's process tree since it started, in bytes."""
+        current = self._rss()
+        if current is None or self.baseline_rss is None:
+            return 0
+        return current - self.baseline_rss
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logger.warning(f"Failed to quit Chrome driver: {str(e)}")
+
+
+class DriverPool:
+    def __init__(self, size=None, max_pages=None, max_rss_growth_mb=None, page_load_timeout=None,
+                 factory=setup_chrome_driver):
+        """
+        Initialize the pool. Drivers are started lazily on first use.
+
+        Args:
+            size (int, optional): Maximum number of live drivers. Defaults to Config.DRIVER_POOL_SIZE
+            max_pages (int, optional): Recycle a driver after this many pages. Defaults to Config.DRIVER_MAX_PAGES
+            max_rss_growth_mb (int, optional): Recycle a driver whose process tree grew by this
+                many MB. Defaults to Config.DRIVER_MAX_RSS_GROWTH_MB
+            page_load_timeout (int, optional): Seconds before a page load counts as hung.
+                Defaults to Config.DRIVER_PAGE_LOAD_TIMEOUT
+            factory (callable): Creates a new WebDriver
+        """
+        self.size = size or Config.DRIVER_POOL_SIZE
+        self.max_pages = max_pages or Config.DRIVER_MAX_PAGES
+        self.max_rss_growth = (max_rss_growth_mb or Config.DRIVER_MAX_RSS_GROWTH_MB) * 1024 * 1024
+        self.page_load_timeout = page_load_timeout or Config.DRIVER_PAGE_LOAD_TIMEOUT
+        self.factory = factory
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._live = set()
+        self._closed = False
+
+    def _start(self):
+        driver = self.factory()
+        driver.set_page_load_timeout(self.page_load_timeout)
+        driver.set_script_timeout(self.page_load_timeout)
+        pooled = PooledDriver(driver)
+        with self._lock:
+            self._live.add(pooled)
+        logger.info("Started pooled Chrome driver")
+        return pooled
+
+    def _discard(self, pooled, reason):
+        logger.info(f"Replacing pooled Chrome driver: {reason}")
+        with self._lock:
+            self._live.discard(pooled)
+        pooled.quit()
+
+    def warm(self, count=None):
+        """Start drivers ahead of time so the first PDFs don't pay the startup cost."""
+        started = [self.acquire() for _ in range(min(count or self.size, self.size))]
+        for pooled in started:
+            self.release(pooled)
+
+    def acquire(self, timeout=None):
+        """
+        Take a healthy driver from the pool, starting or replacing one as needed.
+
+        Args:
+            timeout (float, optional): Seconds to wait for a free driver
+
+        Returns:
+            PooledDriver: A driver that answered a health check
+        """
+        if self._closed:
+            raise RuntimeError("Driver pool is closed")
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("No Chrome driver became available")
+
+        try:
+            while True:
+                try:
+                    pooled = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._start()
+                if pooled.is_alive():
+                    return pooled
+                self._discard(pooled, "driver crashed or stopped responding")
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, pooled, failed=False):
+        """
+        Return a driver to the pool, recycling it if it failed or has done enough work.
+
+        Args:
+            pooled (PooledDriver): Driver from acquire
+            failed (bool): The driver raised a WebDriver error while in use
+        """
+        try:
+            if self._closed:
+                self._discard(pooled, "pool closed")
+            elif failed:
+                self._discard(pooled, "driver error during use")
+            elif pooled.pages >= self.max_pages:
+                self._discard(pooled, f"served {pooled.pages} pages")
+            elif pooled.rss_growth() > self.max_rss_growth:
+                self._discard(pooled, "memory growth")
+            else:
+                self._idle.put(pooled)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def driver(self, timeout=None):
+        """
+        Borrow a driver for the duration of a with block.
+
+        A WebDriver error raised inside the block recycles the driver; other
+        errors (e.g. a malformed PDF) return it to the pool.
+        """
+        pooled = self.acquire(timeout)
+        failed = False
+        try:
+            yield pooled
+        except Exception as e:
+            failed = type(e).__module__.startswith('selenium')
+            raise
+        finally:
+            self.release(pooled, failed=failed)
+
+    def close(self):
+        """Quit every live driver."""
+        self._closed = True
+        with self._lock:
+            live = list(self._live)
+            self._live.clear()
+        for pooled in live:
+            pooled.quit()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool():
+    """Process-wide driver pool shared by every PDF handled in this process."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None or _default_pool._closed:
+            _default_pool = DriverPool()
+        return _default_pool
+
+
+def close_default_pool():
+    """Quit the drivers of the process-wide pool, if it was ever used."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is not None:
+            _default_pool.close()
+            _default_pool = None
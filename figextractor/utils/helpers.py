@@ -5,13 +5,23 @@ Helper functions for the FigExtractor package.
 import os
 import re
 import logging
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
 from config import Config
 
+try:
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+except ImportError:  # Selenium is only needed for the browser caption backend
+    webdriver = None
+
 logger = logging.getLogger(__name__)
 
+# Text prefixes that mark the start of a figure caption
+CAPTION_PREFIXES = ('Figure', 'Fig.')
+
+# Looser, case-insensitive prefixes for text that might start a caption
+CAPTION_CANDIDATE_PREFIXES = ('figure', 'fig.', 'fig')
+
 def setup_chrome_driver():
     """
     Initialize and configure Chrome WebDriver for PDF processing.
@@ -19,6 +29,9 @@ def setup_chrome_driver():
     Returns:
         webdriver.Chrome: Configured Chrome WebDriver instance
     """
+    if webdriver is None:
+        raise ImportError("selenium is required for the 'selenium' caption backend")
+
     chrome_options = Options()
     for option in Config.CHROME_OPTIONS:
         chrome_options.add_argument(option)
@@ -138,13 +151,25 @@ def find_caption_text(element):
         text = re.sub(r'\s+', ' ', text)
         
         # Check if it's actually a caption
-        if text.lower().startswith(('figure', 'fig.', 'fig')):
+        if is_caption_candidate(text):
             return text
         
         return None
     except Exception:
         return None
 
+def is_caption_candidate(text):
+    """
+    Check whether a line of text might start a figure caption.
+    
+    Args:
+        text (str): Line of text
+        
+    Returns:
+        bool: True if the text starts with a caption prefix, ignoring case
+    """
+    return text.lstrip().lower().startswith(CAPTION_CANDIDATE_PREFIXES)
+
 def natural_sort(l):
     """
     Sort strings containing numbers in natural order.
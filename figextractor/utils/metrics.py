@@ -0,0 +1,410 @@
+"""
+Lightweight per-stage instrumentation for the extraction pipeline.
+
+A PdfMetrics object collects, for each named stage (render, html,
+detect_figures, detect_captions, match, save, ...), the number of calls,
+wall time, CPU time and the peak resident memory of the process, plus page
+and figure counts. When metrics are disabled the pipeline uses NULL_METRICS,
+whose stages are a shared no-op context manager.
+
+A stage's CPU time is that of the thread running it. CPU used by external
+tools is only known for the process as a whole once they exit, and stages
+overlap (HTML shards convert while pages render), so it is reported per PDF
+as tools_cpu_seconds rather than split between stages.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import logging
+from config import Config
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter so peaks can be measured per PDF (Linux only)."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """
+    Peak resident memory of this process.
+
+    Returns:
+        int: Bytes, or None where it cannot be measured
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def _children_cpu():
+    """CPU seconds used by reaped child processes (gs, pdftohtml, ...)."""
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class _Stage:
+    """Context manager timing one call of a stage on the current thread."""
+
+    __slots__ = ('metrics', 'name', 'pages', 'figures', '_wall', '_cpu')
+
+    def __init__(self, metrics, name, pages=0, figures=0):
+        self.metrics = metrics
+        self.name = name
+        self.pages = pages
+        self.figures = figures
+
+    def __enter__(self):
+        self._cpu = time.thread_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu
+        self.metrics._record(self.name, wall, cpu, self.pages, self.figures)
+        return False
+
+
+class _NullStage:
+    """Stage of disabled metrics; counts assigned to it are discarded."""
+
+    __slots__ = ('pages', 'figures')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+class NullMetrics:
+    """Drop-in replacement for PdfMetrics that records nothing."""
+
+    enabled = False
+
+    def __init__(self):
+        self._stage = _NullStage()
+
+    def stage(self, name, pages=0, figures=0):
+        return self._stage
+
+    def iter_stage(self, name, iterable):
+        return iterable
+
+    def finish(self, pages=None, figures=None):
+        return None
+
+    def to_dict(self):
+        return None
+
+
+NULL_METRICS = NullMetrics()
+
+
+class PdfMetrics:
+    enabled = True
+
+    def __init__(self, pdf_name):
+        """
+        Start collecting metrics for one PDF.
+
+        Args:
+            pdf_name (str): PDF file name, used in the run-level metrics file
+        """
+        self.pdf_name = pdf_name
+        self.stages = {}
+        self.pages = 0
+        self.figures = 0
+        self.result = None
+        self._lock = threading.Lock()
+        # Without a per-PDF reset the peak is the worker's lifetime high-water mark
+        self._peak_is_per_pdf = reset_peak_rss()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._children = _children_cpu()
+
+    def stage(self, name, pages=0, figures=0):
+        """
+        Time one call of a stage.
+
+        Args:
+            name (str): Stage name
+            pages (int): Pages handled by this call
+            figures (int): Figures handled by this call; can also be set on the
+                returned object inside the with block
+
+        Returns:
+            Context manager recording the call when it exits
+        """
+        return _Stage(self, name, pages, figures)
+
+    def iter_stage(self, name, iterable):
+        """
+        Time every item drawn from an iterator, e.g. pages from a lazy renderer.
+
+        Each item counts as one page of the stage.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name, pages=1) as stage:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    stage.pages = 0
+                    return
+            yield item
+
+    def _record(self, name, wall, cpu, pages, figures):
+        rss = peak_rss()
+        with self._lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                entry = self.stages[name] = {
+                    'calls': 0,
+                    'wall_seconds': 0.0,
+                    'cpu_seconds': 0.0,
+                    'peak_rss_bytes': None,
+                    'pages': 0,
+                    'figures': 0
+                }
+            entry['calls'] += 1
+            entry['wall_seconds'] += wall
+            entry['cpu_seconds'] += cpu
+            entry['pages'] += pages
+            entry['figures'] += figures
+            if rss is not None:
+                entry['peak_rss_bytes'] = max(entry['peak_rss_bytes'] or 0, rss)
+
+    def finish(self, pages=None, figures=None):
+        """
+        Close the measurement of the whole PDF.
+
+        Args:
+            pages (int, optional): Pages processed
+            figures (int, optional): Figures extracted
+
+        Returns:
+            dict: See to_dict
+        """
+        if pages is not None:
+            self.pages = pages
+        if figures is not None:
+            self.figures = figures
+        self.result = {
+            'wall_seconds': time.perf_counter() - self._wall,
+            # Process CPU includes the writer threads; tools run as child processes
+            'cpu_seconds': time.process_time() - self._cpu,
+            'tools_cpu_seconds': _children_cpu() - self._children,
+            'peak_rss_bytes': peak_rss(),
+            'peak_rss_scope': 'pdf' if self._peak_is_per_pdf else 'process',
+            'pages': self.pages,
+            'figures': self.figures
+        }
+        return self.to_dict()
+
+    def to_dict(self):
+        """
+        Metrics as stored in metadata.json.
+
+        Returns:
+            dict: Totals for the PDF plus a 'stages' mapping of per-stage records
+        """
+        with self._lock:
+            stages = {name: dict(entry) for name, entry in self.stages.items()}
+        totals = dict(self.result) if self.result else {'pages': self.pages, 'figures': self.figures}
+        totals['stages'] = stages
+        return totals
+
+
+def create_metrics(pdf_name, enabled=None):
+    """
+    Metrics collector for one PDF.
+
+    Args:
+        pdf_name (str): PDF file name
+        enabled (bool, optional): Defaults to Config.METRICS_ENABLED
+
+    Returns:
+        PdfMetrics, or NULL_METRICS when disabled
+    """
+    if enabled is None:
+        enabled = Config.METRICS_ENABLED
+    return PdfMetrics(pdf_name) if enabled else NULL_METRICS
+
+
+def prometheus_label(value):
+    """Escape a value for use inside a quoted Prometheus label."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_prometheus(records, tools=None):
+    """
+    Render per-PDF metrics in the Prometheus text exposition format.
+
+    Args:
+        records (list): (pdf name, metrics dict) pairs
+        tools (dict, optional): Per-tool statistics of the run, see supervisor.tool_stats
+
+    Returns:
+        str: Exposition text
+    """
+    pdf_metrics = (
+        ('wall_seconds', 'Wall time to process the PDF'),
+        ('cpu_seconds', 'CPU time of the extraction process for the PDF'),
+        ('tools_cpu_seconds', 'CPU time of external tools run for the PDF'),
+        ('peak_rss_bytes', 'Peak resident memory while processing the PDF'),
+        ('pages', 'Pages processed'),
+        ('figures', 'Figures extracted'),
+    )
+    stage_metrics = (
+        ('calls', 'Calls of the stage'),
+        ('wall_seconds', 'Wall time spent in the stage, summed over calls'),
+        ('cpu_seconds', 'CPU time of the thread running the stage, summed over calls; external tools excluded'),
+        ('peak_rss_bytes', 'Peak resident memory at the end of the stage'),
+        ('pages', 'Pages handled by the stage'),
+        ('figures', 'Figures handled by the stage'),
+    )
+
+    lines = []
+    for key, help_text in pdf_metrics:
+        name = f'figextractor_pdf_{key}'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for pdf, metrics in records:
+            if metrics.get(key) is not None:
+                lines.append(f'{name}{{pdf="{prometheus_label(pdf)}"}} {metrics[key]}')
+    for key, help_text in stage_metrics:
+        name = f'figextractor_stage_{key}'
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for pdf, metrics in records:
+            for stage, entry in metrics.get('stages', {}).items():
+                if entry.get(key) is not None:
+                    lines.append(
+                        f'{name}{{pdf="{prometheus_label(pdf)}",stage="{prometheus_label(stage)}"}} {entry[key]}'
+                    )
+    if tools:
+        for key, help_text in (('calls', 'Calls of the external tool'),
+                               ('wall_seconds', 'Wall time spent in the external tool'),
+                               ('retries', 'Failed calls retried with fallback settings')):
+            name = f'figextractor_tool_{key}'
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for tool, entry in sorted(tools.items()):
+                lines.append(f'{name}{{tool="{prometheus_label(tool)}"}} {entry[key]}')
+        name = 'figextractor_tool_failures'
+        lines.append(f'# HELP {name} Failed calls of the external tool by failure kind')
+        lines.append(f'# TYPE {name} gauge')
+        for tool, entry in sorted(tools.items()):
+            for kind, count in sorted(entry['failures'].items()):
+                lines.append(f'{name}{{tool="{prometheus_label(tool)}",kind="{prometheus_label(kind)}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def _default_path(fmt):
+    return Config.METRICS_PATH or os.path.join(
+        Config.OUTPUT_DIR, 'metrics.jsonl' if fmt == 'jsonl' else 'metrics.prom'
+    )
+
+
+def _pdf_line(timestamp, pdf, metrics):
+    return json.dumps({'type': 'pdf', 'time': timestamp, 'pdf': pdf, **metrics}) + '\n'
+
+
+def append_pdf_metrics(pdf, metrics, path=None):
+    """
+    Append one PDF's metrics to the run-level JSONL file as soon as it finishes.
+
+    Used by the daemon and the server, which have no end of run to write a
+    summary at. Only the 'jsonl' format accumulates per PDF; in the
+    'prometheus' format those modes report through their own status file
+    and /metrics endpoint instead.
+
+    Args:
+        pdf (str): PDF file name
+        metrics (dict): The PDF's metrics, see PdfMetrics.to_dict
+        path (str, optional): Output file. Defaults as for write_run_metrics
+
+    Returns:
+        str: Path written
+    """
+    path = path or _default_path('jsonl')
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(_pdf_line(time.time(), pdf, metrics))
+    return path
+
+
+def write_run_metrics(summary, path=None, fmt=None):
+    """
+    Write the metrics of a batch run to a run-level file.
+
+    'jsonl' appends one line per PDF plus one line for the run, so the file
+    accumulates across runs. 'prometheus' replaces the file with the latest
+    run, suitable for a node_exporter textfile collector.
+
+    Args:
+        summary (dict): Run summary from batch.run_batch
+        path (str, optional): Output file. Defaults to Config.METRICS_PATH, or
+            metrics.jsonl / metrics.prom in Config.OUTPUT_DIR
+        fmt (str, optional): 'jsonl' or 'prometheus'. Defaults to Config.METRICS_FORMAT
+
+    Returns:
+        str: Path written
+    """
+    from ..core.writer import atomic_write
+
+    fmt = fmt or Config.METRICS_FORMAT
+    if fmt not in ('jsonl', 'prometheus'):
+        raise ValueError(f"Unknown metrics format: {fmt}")
+    if path is None:
+        path = _default_path(fmt)
+
+    records = [
+        (os.path.basename(result['pdf']), result['metrics'])
+        for result in summary['results'] if result.get('metrics')
+    ]
+
+    if fmt == 'prometheus':
+        atomic_write(path, format_prometheus(records, summary.get('tools')))
+        return path
+
+    timestamp = time.time()
+    with open(path, 'a', encoding='utf-8') as f:
+        for pdf, metrics in records:
+            f.write(_pdf_line(timestamp, pdf, metrics))
+        f.write(json.dumps({
+            'type': 'run',
+            'time': timestamp,
+            'workers': summary['workers'],
+            'total': summary['total'],
+            'succeeded': summary['succeeded'],
+            'failed': summary['failed'],
+            'figures': summary['figures'],
+            'wall_seconds': summary['seconds'],
+            'tools': summary.get('tools', {})
+        }) + '\n')
+    return path
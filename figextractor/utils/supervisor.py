@@ -0,0 +1,372 @@
+"""
+Supervised execution of the external tools (gs, magick, pdftohtml, pdfinfo).
+
+Every tool call goes through run_tool, or open_tool for renderers whose
+stdout is streamed. Calls get a wall-clock timeout, memory and CPU rlimits
+(POSIX), captured stderr and a failure classification:
+
+    missing   the executable could not be started
+    timeout   killed after exceeding its wall-clock timeout
+    cpu       killed by the CPU-time rlimit
+    memory    ran out of memory (rlimit hit or an allocation error on stderr)
+    crash     killed by any other signal
+    error     exited with a non-zero status
+
+Failures raise ToolError, a CalledProcessError, so existing handlers keep
+working. Per-tool call counts, wall time, failures by kind and retries are
+kept per process and reported through tool_stats.
+"""
+
+import os
+import re
+import copy
+import time
+import signal
+import logging
+import threading
+import subprocess
+from collections import deque
+from config import Config
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Failure kinds worth retrying with cheaper settings
+RESOURCE_FAILURES = ('timeout', 'cpu', 'memory', 'crash')
+
+STDERR_TAIL_BYTES = 64 * 1024
+
+_MEMORY_RE = re.compile(rb'VMerror|out of memory|memory allocation failed|bad_alloc|cannot allocate memory',
+                        re.IGNORECASE)
+
+
+class ToolError(subprocess.CalledProcessError):
+    def __init__(self, tool, kind, returncode, cmd, stderr=b'', seconds=0.0):
+        """
+        Failure of a supervised tool call.
+
+        Args:
+            tool (str): Tool name, e.g. 'gs'
+            kind (str): Failure kind, see the module docstring
+            returncode (int): Exit status, negative for a signal, None when not started
+            cmd (list): Command line
+            stderr (bytes): Tail of the tool's stderr
+            seconds (float): Wall time until the failure
+        """
+        super().__init__(returncode, cmd, stderr=stderr)
+        self.tool = tool
+        self.kind = kind
+        self.seconds = seconds
+
+    @property
+    def retryable(self):
+        """True when the failure may go away with cheaper settings."""
+        return self.kind in RESOURCE_FAILURES
+
+    def __str__(self):
+        message = f"{self.tool} failed ({self.kind}, exit status {self.returncode}) after {self.seconds:.1f}s"
+        detail = (self.stderr or b'').decode('utf-8', 'replace').strip()
+        if detail:
+            message += ': ' + detail.splitlines()[-1][:500]
+        return message
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _record(tool, seconds, kind=None):
+    with _stats_lock:
+        entry = _stats.get(tool)
+        if entry is None:
+            entry = _stats[tool] = {'calls': 0, 'wall_seconds': 0.0, 'failures': {}, 'retries': 0}
+        entry['calls'] += 1
+        entry['wall_seconds'] += seconds
+        if kind:
+            entry['failures'][kind] = entry['failures'].get(kind, 0) + 1
+
+
+def record_retry(tool):
+    """Count a retry of a failed tool call with fallback settings."""
+    with _stats_lock:
+        entry = _stats.setdefault(tool, {'calls': 0, 'wall_seconds': 0.0, 'failures': {}, 'retries': 0})
+        entry['retries'] += 1
+
+
+def tool_stats():
+    """
+    Per-tool statistics of this process.
+
+    Returns:
+        dict: tool -> {'calls', 'wall_seconds', 'failures': {kind: count}, 'retries'}
+    """
+    with _stats_lock:
+        return copy.deepcopy(_stats)
+
+
+def tool_stats_since(snapshot):
+    """
+    Statistics accumulated since an earlier tool_stats() snapshot.
+
+    Returns:
+        dict: Same form as tool_stats, tools without calls omitted
+    """
+    delta = {}
+    for tool, entry in tool_stats().items():
+        before = snapshot.get(tool, {'calls': 0, 'wall_seconds': 0.0, 'failures': {}, 'retries': 0})
+        calls = entry['calls'] - before['calls']
+        retries = entry['retries'] - before['retries']
+        if not calls and not retries:
+            continue
+        failures = {kind: count - before['failures'].get(kind, 0) for kind, count in entry['failures'].items()}
+        delta[tool] = {
+            'calls': calls,
+            'wall_seconds': entry['wall_seconds'] - before['wall_seconds'],
+            'failures': {kind: count for kind, count in failures.items() if count},
+            'retries': retries
+        }
+    return delta
+
+
+def merge_tool_stats(records):
+    """
+    Add up tool statistics, e.g. of all PDFs in a batch.
+
+    Args:
+        records (iterable): Dicts in the form returned by tool_stats
+
+    Returns:
+        dict: Combined statistics
+    """
+    merged = {}
+    for record in records:
+        for tool, entry in record.items():
+            total = merged.setdefault(tool, {'calls': 0, 'wall_seconds': 0.0, 'failures': {}, 'retries': 0})
+            total['calls'] += entry['calls']
+            total['wall_seconds'] += entry['wall_seconds']
+            total['retries'] += entry['retries']
+            for kind, count in entry['failures'].items():
+                total['failures'][kind] = total['failures'].get(kind, 0) + count
+    return merged
+
+
+def _limits():
+    """(resource, soft and hard limit) pairs applied to tool processes."""
+    limits = []
+    if resource is None:
+        return limits
+    if Config.TOOL_MEMORY_LIMIT_MB:
+        size = int(Config.TOOL_MEMORY_LIMIT_MB) * 1024 * 1024
+        limits.append((resource.RLIMIT_AS, (size, size)))
+    if Config.TOOL_CPU_LIMIT_SECONDS:
+        seconds = int(Config.TOOL_CPU_LIMIT_SECONDS)
+        # The soft limit sends SIGXCPU, the hard limit a second later SIGKILL
+        limits.append((resource.RLIMIT_CPU, (seconds, seconds + 1)))
+    return limits
+
+
+def _set_limits(limits):
+    for limit, values in limits:
+        resource.setrlimit(limit, values)
+
+
+class ToolProcess:
+    def __init__(self, tool, command, timeout=None, stdout=subprocess.PIPE, stdin=None):
+        """
+        Start a supervised tool.
+
+        The timeout is a deadline that touch() pushes back, so a streaming
+        renderer can be given a budget per page rather than per document.
+        stderr is drained on a thread, keeping its tail for error reports.
+
+        Args:
+            tool (str): Tool name used in statistics and errors
+            command (list): Command line
+            timeout (float, optional): Seconds until the tool is killed, None for no limit
+            stdout: Passed to Popen
+            stdin: Passed to Popen
+
+        Raises:
+            ToolError: 'missing' when the executable cannot be started
+        """
+        self.tool = tool
+        self.command = command
+        self.timeout = timeout
+        self.timed_out = False
+        self._start = time.perf_counter()
+        self._finished = False
+        self._stderr = deque()
+        self._stderr_size = 0
+        self._done = threading.Event()
+
+        limits = _limits()
+        use_prlimit = limits and hasattr(resource, 'prlimit')
+        try:
+            self.process = subprocess.Popen(
+                command, stdin=stdin, stdout=stdout, stderr=subprocess.PIPE, bufsize=1 << 20,
+                # A new session lets a timeout kill helpers the tool started too
+                start_new_session=os.name == 'posix',
+                preexec_fn=(lambda: _set_limits(limits)) if limits and not use_prlimit else None
+            )
+        except OSError as e:
+            _record(tool, 0.0, 'missing')
+            raise ToolError(tool, 'missing', None, command, str(e).encode()) from e
+        if use_prlimit:
+            for limit, values in limits:
+                try:
+                    resource.prlimit(self.process.pid, limit, values)
+                except OSError:
+                    # The tool already exited
+                    pass
+
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+        self._deadline = time.monotonic() + timeout if timeout else None
+        if timeout:
+            threading.Thread(target=self._watch, daemon=True).start()
+
+    @property
+    def stdout(self):
+        return self.process.stdout
+
+    def _drain_stderr(self):
+        for chunk in iter(lambda: self.process.stderr.read1(8192), b''):
+            self._stderr.append(chunk)
+            self._stderr_size += len(chunk)
+            while self._stderr_size > STDERR_TAIL_BYTES and len(self._stderr) > 1:
+                self._stderr_size -= len(self._stderr.popleft())
+
+    def _watch(self):
+        while True:
+            deadline = self._deadline
+            if deadline is None:
+                # Paused; check again for a restarted timeout
+                remaining = 1.0
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timed_out = True
+                    self.kill()
+                    return
+            if self._done.wait(remaining):
+                return
+
+    def touch(self):
+        """Restart the timeout, e.g. after each page a renderer delivers."""
+        if self.timeout:
+            self._deadline = time.monotonic() + self.timeout
+
+    def pause(self):
+        """Stop the timeout until touch(), e.g. while the caller handles a page."""
+        if self.timeout:
+            self._deadline = None
+
+    def kill(self):
+        """Kill the tool and any process it started."""
+        if self.process.poll() is not None:
+            return
+        try:
+            if os.name == 'posix':
+                os.killpg(self.process.pid, signal.SIGKILL)
+            else:
+                self.process.kill()
+        except OSError:
+            pass
+
+    @property
+    def stderr(self):
+        """Tail of the tool's stderr so far."""
+        return b''.join(self._stderr)
+
+    def _classify(self, returncode, stderr):
+        if self.timed_out:
+            return 'timeout'
+        if returncode < 0 and -returncode == getattr(signal, 'SIGXCPU', None):
+            return 'cpu'
+        if _MEMORY_RE.search(stderr):
+            return 'memory'
+        if returncode < 0:
+            return 'crash'
+        return 'error'
+
+    def finish(self, check=True):
+        """
+        Wait for the tool to exit and record the call.
+
+        Args:
+            check (bool): Raise on a non-zero exit status
+
+        Returns:
+            int: Exit status
+
+        Raises:
+            ToolError: When check is set and the tool failed
+        """
+        returncode = self.process.wait()
+        self._done.set()
+        self._stderr_thread.join()
+        seconds = time.perf_counter() - self._start
+        kind = None
+        if returncode != 0 or self.timed_out:
+            kind = self._classify(returncode, self.stderr)
+        if not self._finished:
+            self._finished = True
+            _record(self.tool, seconds, kind)
+        if kind and check:
+            error = ToolError(self.tool, kind, returncode, self.command, self.stderr, seconds)
+            logger.warning(str(error))
+            raise error
+        return returncode
+
+    def close(self):
+        """Kill the tool if it is still running, e.g. when its output is abandoned."""
+        if self.process.poll() is None:
+            self.kill()
+        if self.process.stdout:
+            self.process.stdout.close()
+        if not self._finished:
+            self.finish(check=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+        return False
+
+
+def open_tool(tool, command, timeout=None):
+    """
+    Start a tool whose stdout is read incrementally.
+
+    Use as a context manager; call finish() after reading the output to
+    check the exit status.
+
+    Returns:
+        ToolProcess
+    """
+    return ToolProcess(tool, command, timeout)
+
+
+def run_tool(tool, command, timeout=None, capture_stdout=False, check=True):
+    """
+    Run a tool to completion under supervision.
+
+    Args:
+        tool (str): Tool name used in statistics and errors
+        command (list): Command line
+        timeout (float, optional): Wall-clock limit in seconds
+        capture_stdout (bool): Return stdout instead of discarding it
+        check (bool): Raise ToolError when the tool fails
+
+    Returns:
+        subprocess.CompletedProcess: With stdout (bytes or None) and the stderr tail
+    """
+    with ToolProcess(tool, command, timeout, stdout=subprocess.PIPE if capture_stdout else subprocess.DEVNULL) as process:
+        stdout = process.stdout.read() if capture_stdout else None
+        returncode = process.finish(check=check)
+        return subprocess.CompletedProcess(command, returncode, stdout, process.stderr)
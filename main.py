@@ -1,7 +1,13 @@
 import os
 import sys
+import sqlite3
+import argparse
 import logging
-from figextractor.core.pdf_processor import process_pdf
+from figextractor.core.batch import run_batch, ORDERS
+from figextractor.core.daemon import run_daemon
+from figextractor.core.distributed import run_distributed, default_node_id
+from figextractor.core.server import run_server
+from figextractor.core.index import FigureIndex
 from config import Config
 
 def setup_logging():
@@ -15,10 +21,77 @@ def setup_logging():
         ]
     )
 
-def main():
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Extract figures and captions from PDF documents")
+    parser.add_argument('--workers', type=int, default=Config.WORKERS,
+                        help="number of worker processes")
+    parser.add_argument('--page-workers', type=int, default=Config.PAGE_WORKERS,
+                        help="pages of one PDF processed concurrently by each worker")
+    parser.add_argument('--html-workers', type=int, default=Config.HTML_WORKERS,
+                        help="concurrent pdftohtml calls over page ranges of one PDF")
+    parser.add_argument('--order', choices=ORDERS, default='name',
+                        help="order in which PDFs are handed to the workers")
+    parser.add_argument('--retries', type=int, default=Config.RETRIES,
+                        help="how many times a failed PDF is retried")
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep running and process PDFs as they appear in the input directory")
+    parser.add_argument('--poll-interval', type=float, default=Config.WATCH_POLL_INTERVAL,
+                        help="seconds between scans of the input directory in daemon mode")
+    parser.add_argument('--distributed', action='store_true',
+                        help="share the input directory with other nodes, claiming PDFs through a lease queue")
+    parser.add_argument('--queue-dir', default=Config.QUEUE_DIR,
+                        help="shared lease queue directory in distributed mode (default: output/queue)")
+    parser.add_argument('--serve', action='store_true',
+                        help="run the local HTTP extraction service")
+    parser.add_argument('--host', default=Config.SERVER_HOST,
+                        help="interface the HTTP service binds to")
+    parser.add_argument('--port', type=int, default=Config.SERVER_PORT,
+                        help="port the HTTP service listens on")
+    parser.add_argument('--search', metavar='QUERY',
+                        help="search the figure index for captions matching QUERY and exit")
+    parser.add_argument('--limit', type=int, default=20,
+                        help="maximum number of search results")
+    parser.add_argument('--raw-query', action='store_true',
+                        help="pass the --search query to SQLite FTS5 unchanged (AND, OR, NEAR, prefix*)")
+    parser.add_argument('--backfill-index', action='store_true',
+                        help="index every metadata.json in the output directory and exit")
+    parser.add_argument('--resume', action='store_true', default=Config.RESUME,
+                        help="skip PDFs and pages finished by an interrupted earlier run")
+    parser.add_argument('--detection-dpi', type=int, default=Config.DETECTION_DPI,
+                        help="detect figures on pages rendered at this DPI and re-render only the figures at the output DPI")
+    parser.add_argument('--tile-pixel-budget', type=int, default=Config.TILE_PIXEL_BUDGET,
+                        help="render and detect pages with more pixels than this in bands (0 disables)")
+    parser.add_argument('--page-selection', choices=('all', 'captions'), default=Config.PAGE_SELECTION,
+                        help="render every page, or only pages with caption candidates")
+    parser.add_argument('--page-margin', type=int, default=Config.PAGE_SELECTION_MARGIN,
+                        help="neighbouring pages rendered around each caption page")
+    parser.add_argument('--dedup', action='store_true', default=Config.DEDUP_ENABLED,
+                        help="reference figures that duplicate an earlier figure instead of saving them again")
+    parser.add_argument('--metrics', action='store_true', default=Config.METRICS_ENABLED,
+                        help="record per-stage timings and memory for every PDF")
+    parser.add_argument('--metrics-format', choices=('jsonl', 'prometheus'), default=Config.METRICS_FORMAT,
+                        help="format of the run-level metrics file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """Main entry point for the application"""
+    args = parse_args(argv)
+    
     # Initialize configuration and create necessary directories
     Config.initialize()
+    Config.RESUME = args.resume
+    Config.PAGE_WORKERS = args.page_workers
+    Config.HTML_WORKERS = args.html_workers
+    Config.DETECTION_DPI = args.detection_dpi
+    Config.TILE_PIXEL_BUDGET = args.tile_pixel_budget
+    Config.PAGE_SELECTION = args.page_selection
+    Config.PAGE_SELECTION_MARGIN = args.page_margin
+    Config.DEDUP_ENABLED = args.dedup
+    Config.METRICS_ENABLED = args.metrics
+    Config.METRICS_FORMAT = args.metrics_format
+    Config.WATCH_POLL_INTERVAL = args.poll_interval
+    Config.QUEUE_DIR = args.queue_dir
     
     # Setup logging
     setup_logging()
@@ -26,6 +99,29 @@ def main():
     
     logger.info("Starting FigExtractor")
     
+    if args.search is not None:
+        try:
+            results = FigureIndex().search(args.search, limit=args.limit, raw=args.raw_query)
+        except sqlite3.OperationalError as e:
+            sys.exit(f"Invalid search query {args.search!r}: {str(e)}")
+        for result in results:
+            print(f"{result['document']} p{result['page']} fig {result['figure_number']}: "
+                  f"{result['snippet']}\n    {result['image_path']}")
+        return
+    
+    if args.backfill_index:
+        indexed = FigureIndex().backfill()
+        logger.info(f"Indexed {indexed} documents from {Config.OUTPUT_DIR}")
+        return
+    
+    if args.serve:
+        run_server(host=args.host, port=args.port)
+        return
+    
+    if args.daemon:
+        run_daemon(workers=args.workers, retries=args.retries)
+        return
+    
     # Process each PDF in the input directory
     input_files = [f for f in os.listdir(Config.INPUT_DIR) 
                   if f.endswith('.pdf') and not f.startswith('._')]
@@ -36,18 +132,30 @@ def main():
     
     logger.info(f"Found {len(input_files)} PDF files to process")
     
-    for pdf_file in input_files:
-        try:
-            pdf_path = os.path.join(Config.INPUT_DIR, pdf_file)
-            logger.info(f"Processing {pdf_file}")
-            
-            process_pdf(pdf_path)
-            
-            logger.info(f"Successfully processed {pdf_file}")
-            
-        except Exception as e:
-            logger.error(f"Error processing {pdf_file}: {str(e)}")
-            continue
+    pdf_paths = [os.path.join(Config.INPUT_DIR, f) for f in input_files]
+    if args.distributed:
+        # Every node writes its own summary next to the others'
+        summary = run_distributed(
+            pdf_paths,
+            workers=args.workers,
+            order=args.order,
+            retries=args.retries,
+            summary_path=os.path.join(Config.OUTPUT_DIR, f'run_summary-{default_node_id()}.json')
+        )
+    else:
+        summary = run_batch(
+            pdf_paths,
+            workers=args.workers,
+            order=args.order,
+            retries=args.retries,
+            summary_path=os.path.join(Config.OUTPUT_DIR, 'run_summary.json')
+        )
+    
+    logger.info(f"Processed {summary['succeeded']}/{summary['total']} PDFs "
+                f"({summary['figures']} figures) in {summary['seconds']:.1f}s")
+    for result in summary['results']:
+        if result['status'] != 'ok':
+            logger.error(f"Failed {os.path.basename(result['pdf'])}: {result['error']}")
 
 if __name__ == "__main__":
     main()
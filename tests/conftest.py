@@ -0,0 +1,33 @@
+import os
+import sys
+import multiprocessing
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+
+@pytest.fixture
+def fork_workers():
+    """Make worker processes fork, so functions patched in a test reach them."""
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        pytest.skip("needs the fork start method")
+    previous = multiprocessing.get_start_method(allow_none=True)
+    multiprocessing.set_start_method('fork', force=True)
+    yield
+    multiprocessing.set_start_method(previous, force=True)
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    """Point Config at a temporary tree with checkpoints and metrics off."""
+    for name in ('INPUT_DIR', 'OUTPUT_DIR', 'TEMP_DIR', 'CACHE_DIR'):
+        path = tmp_path / name.lower()
+        path.mkdir()
+        monkeypatch.setattr(Config, name, str(path))
+    monkeypatch.setattr(Config, 'CHECKPOINTS', False)
+    monkeypatch.setattr(Config, 'METRICS_ENABLED', False)
+    monkeypatch.setattr(Config, 'CAPTION_BACKEND', 'lxml')
+    return Config
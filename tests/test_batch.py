@@ -0,0 +1,47 @@
+import os
+
+from figextractor.core import batch
+
+
+def fake_run_one(pdf_path):
+    """Stand-in for batch._run_one: poison PDFs kill their worker process."""
+    if 'poison' in os.path.basename(pdf_path):
+        os._exit(1)
+    return {'pdf': pdf_path, 'status': 'ok', 'figures': 1, 'seconds': 0.0, 'worker': os.getpid(), 'tools': {}}
+
+
+def test_crashing_pdf_only_fails_itself(config, fork_workers, monkeypatch):
+    monkeypatch.setattr(batch, '_run_one', fake_run_one)
+    pdfs = [os.path.join(config.INPUT_DIR, f'{name}.pdf') for name in ('a', 'b', 'poison', 'c', 'd', 'e')]
+
+    summary = batch.run_batch(pdfs, workers=2, retries=0)
+
+    results = {os.path.basename(r['pdf']): r for r in summary['results']}
+    assert summary['total'] == 6
+    assert results['poison.pdf']['status'] == 'failed'
+    assert results['poison.pdf']['attempts'] == 1
+    for name in ('a', 'b', 'c', 'd', 'e'):
+        assert results[f'{name}.pdf']['status'] == 'ok'
+        assert results[f'{name}.pdf']['attempts'] == 1
+
+
+def test_crashing_pdf_is_retried(config, fork_workers, monkeypatch):
+    monkeypatch.setattr(batch, '_run_one', fake_run_one)
+    pdfs = [os.path.join(config.INPUT_DIR, f'{name}.pdf') for name in ('a', 'poison', 'b')]
+
+    summary = batch.run_batch(pdfs, workers=2, retries=1)
+
+    results = {os.path.basename(r['pdf']): r for r in summary['results']}
+    assert results['poison.pdf']['status'] == 'failed'
+    assert results['poison.pdf']['attempts'] == 2
+    assert results['a.pdf']['status'] == results['b.pdf']['status'] == 'ok'
+
+
+def test_workers_remove_their_temp_dirs(config, fork_workers, monkeypatch):
+    monkeypatch.setattr(batch, '_run_one', fake_run_one)
+    pdfs = [os.path.join(config.INPUT_DIR, f'{name}.pdf') for name in ('a', 'b', 'c', 'd')]
+
+    summary = batch.run_batch(pdfs, workers=2, retries=0)
+
+    assert summary['succeeded'] == 4
+    assert not [name for name in os.listdir(config.TEMP_DIR) if name.startswith('worker-')]
@@ -0,0 +1,95 @@
+import json
+import os
+
+from figextractor.core.cache import ResultCache
+
+
+def write(path, content='x'):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def test_results_entry_holds_only_listed_artefacts(config, tmp_path):
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    figures = [
+        {'page': 1, 'figure_number': 1, 'caption_text': 'Figure 1', 'caption_bb': [0, 0, 1, 1],
+         'image_file': 'page_1_figure_1.jpg'},
+        {'page': 2, 'figure_number': 1, 'caption_text': '', 'caption_bb': None,
+         'image_file': None, 'duplicate_of': 'other/page_1_figure_1.jpg'},
+    ]
+    write(output_dir / 'metadata.json', json.dumps({'a.pdf': {'figures': figures}}))
+    write(output_dir / 'page_1_figure_1.jpg')
+    write(output_dir / 'page_1_caption_1.txt', 'Figure 1')
+    # Left behind by an interrupted run or earlier settings
+    write(output_dir / 'progress.json', '{}')
+    write(output_dir / 'page_2_figure_1.jpg')
+
+    cache = ResultCache(str(tmp_path / 'cache'), max_bytes=1 << 20)
+    cache.put_results('key', str(output_dir))
+
+    restored = tmp_path / 'restored'
+    restored.mkdir()
+    stored = cache.get_results('key', str(restored))
+    assert stored['a.pdf']['figures'] == figures
+    assert sorted(os.listdir(restored)) == ['metadata.json', 'page_1_caption_1.txt', 'page_1_figure_1.jpg']
+
+
+def test_incomplete_results_are_not_cached(config, tmp_path):
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    figures = [{'page': 1, 'figure_number': 1, 'caption_bb': None, 'image_file': 'page_1_figure_1.jpg'}]
+    write(output_dir / 'metadata.json', json.dumps({'a.pdf': {'figures': figures}}))
+
+    cache = ResultCache(str(tmp_path / 'cache'), max_bytes=1 << 20)
+    cache.put_results('key', str(output_dir))
+
+    assert cache.get_results('key', str(tmp_path)) is None
+    assert os.listdir(tmp_path / 'cache' / 'results') == []
+
+
+def test_html_entry_is_published_whole(config, tmp_path):
+    html_dir = tmp_path / 'html'
+    html_dir.mkdir()
+    write(html_dir / 'page1.html', 'page 1')
+    write(html_dir / 'index.html')
+
+    cache = ResultCache(str(tmp_path / 'cache'), max_bytes=1 << 20)
+    cache.put_html('key', str(html_dir))
+    # Storing it again, as a concurrent worker would, keeps the first entry
+    cache.put_html('key', str(html_dir))
+    cache.put_html('missing', str(tmp_path / 'missing'))
+
+    assert os.listdir(tmp_path / 'cache' / 'html') == ['key']
+    restored = tmp_path / 'restored'
+    assert cache.get_html('key', str(restored))
+    assert sorted(os.listdir(restored)) == ['index.html', 'page1.html']
+    assert (restored / 'page1.html').read_text() == 'page 1'
+
+
+def test_cache_is_only_walked_over_budget_or_every_interval(config, monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'CACHE_EVICT_INTERVAL', 3)
+    scans = []
+    original = ResultCache.evict
+    monkeypatch.setattr(ResultCache, 'evict', lambda self: scans.append(1) or original(self))
+    html_dir = tmp_path / 'html'
+    html_dir.mkdir()
+    write(html_dir / 'page1.html', 'x' * 100)
+
+    cache = ResultCache(str(tmp_path / 'cache'), max_bytes=350)
+    for i in range(3):
+        ResultCache(str(tmp_path / 'cache'), max_bytes=350).put_html(f'key{i}', str(html_dir))
+    # The first commit measures the cache, the next two are counted
+    assert len(scans) == 1
+
+    # Going over the budget walks the cache and evicts the oldest entry at once
+    os.utime(tmp_path / 'cache' / 'html' / 'key0', (0, 0))
+    cache.put_html('key3', str(html_dir))
+    assert len(scans) == 2
+    assert sorted(os.listdir(tmp_path / 'cache' / 'html')) == ['key1', 'key2', 'key3']
+
+    # Under budget, another process's entries are picked up after CACHE_EVICT_INTERVAL commits
+    cache.max_bytes = 1 << 20
+    for i in range(4, 7):
+        cache.put_html(f'key{i}', str(html_dir))
+    assert len(scans) == 3
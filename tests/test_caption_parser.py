@@ -0,0 +1,62 @@
+from figextractor.core.caption_parser import (
+    count_html_pages, detect_page_captions, parse_html_page, select_caption_pages
+)
+
+SPAN = '<span class="f0" style="font-size:{size}px;vertical-align:baseline;color:rgba(0,0,0,1);">{text}</span>'
+
+
+def line(left, top, *chunks, size=10):
+    spans = ''.join(SPAN.format(size=size, text=text) for text in chunks)
+    return f'<div class="txt" style="position:absolute; left:{left}px; top:{top}px;">{spans}</div>'
+
+
+def write_page(html_dir, page_num, *lines):
+    """Write a pageN.html laid out the way pdftohtml writes it."""
+    path = html_dir / f'page{page_num}.html'
+    path.write_text(
+        '<html><head><style type="text/css"></style></head><body>\n'
+        f'<img style="position:absolute; left:0px; top:0px;" width="612" height="792" src="page{page_num}.png">\n'
+        + '\n'.join(lines) + '\n</body></html>',
+        encoding='utf-8'
+    )
+    return str(path)
+
+
+def test_lines_get_text_and_estimated_boxes(tmp_path):
+    path = write_page(tmp_path, 1, line(72, 100, 'Results', ' ', 'and  discussion'),
+                      line(72.6, 130.2, 'x', size=20), line(72, 160, '   '))
+
+    page_size, lines = parse_html_page(path)
+
+    assert page_size == (612, 792)
+    assert [entry['text'] for entry in lines] == ['Results and discussion', 'x']
+    # 23 characters at 10 px and half an em each; one line is 1.15 em high
+    assert lines[0]['bbox'] == (72, 100, 115, 12)
+    assert lines[1]['bbox'] == (72, 130, 10, 23)
+
+
+def test_only_caption_lines_are_captions(tmp_path):
+    path = write_page(tmp_path, 1, line(72, 100, 'Figure 1: Growth curves'), line(72, 120, 'Fig. 2 Detail'),
+                      line(72, 140, 'figure skating is a sport'), line(72, 160, 'See Figure 1'))
+
+    captions, page_size = detect_page_captions(path)
+
+    assert page_size == (612, 792)
+    assert [caption['text'] for caption in captions] == ['Figure 1: Growth curves', 'Fig. 2 Detail']
+
+
+def test_unreadable_page_has_no_captions(tmp_path):
+    assert detect_page_captions(str(tmp_path / 'page9.html')) == ([], None)
+
+
+def test_pages_with_caption_candidates_are_selected(tmp_path):
+    write_page(tmp_path, 1, line(72, 100, 'Introduction'))
+    write_page(tmp_path, 2, line(72, 100, 'Introduction'))
+    write_page(tmp_path, 3, line(72, 100, 'FIG. 4 shows'))
+    write_page(tmp_path, 4, line(72, 100, 'Methods'))
+    write_page(tmp_path, 7, line(72, 100, 'Figure 5'))
+    (tmp_path / 'page3.png').write_bytes(b'')
+
+    assert count_html_pages(str(tmp_path)) == 7
+    assert select_caption_pages(str(tmp_path)) == ([3, 7], 7)
+    assert select_caption_pages(str(tmp_path), margin=1) == ([2, 3, 4, 6, 7], 7)
@@ -0,0 +1,155 @@
+import os
+import json
+
+import numpy as np
+import pytest
+
+from figextractor.core import pdf_processor
+from figextractor.core.checkpoint import MANIFEST_NAME, PAGE_LOG_NAME, PdfCheckpoint
+from figextractor.core.pdf_processor import process_pdf
+
+PAGES = 4
+
+
+class FakeFigure:
+    """Figure whose encoded image is a fixed string."""
+
+    phash = None
+
+    def __init__(self, page_num):
+        self.bbox = (10, 10 * page_num, 50, 40)
+
+    def encode(self, ext, quality=None):
+        return b'image'
+
+    def release(self):
+        pass
+
+
+class Pipeline:
+    """Stand-ins for the external tools and detection, recording what was rendered."""
+
+    def __init__(self, interrupt_at=None):
+        self.interrupt_at = interrupt_at
+        self.rendered = []
+
+    def convert_to_html(self, pdf_path, html_dir):
+        os.makedirs(html_dir, exist_ok=True)
+        for page_num in range(1, PAGES + 1):
+            with open(os.path.join(html_dir, f'page{page_num}.html'), 'w') as f:
+                f.write('<html><body></body></html>')
+
+    def iter_pdf_pages(self, filename, customize_dpi=None, pages=None, gray=False, tiled=None):
+        for page_num in pages if pages is not None else range(1, PAGES + 1):
+            self.rendered.append(page_num)
+            yield page_num, np.zeros((100, 80, 3), dtype=np.uint8)
+
+    def iter_figures_and_captions(self, pdf_path, html_dir, pages, **kwargs):
+        for page_num, _ in pages:
+            if page_num == self.interrupt_at:
+                raise RuntimeError("interrupted")
+            yield page_num, [FakeFigure(page_num)], [None]
+
+
+def install(monkeypatch, pipeline):
+    monkeypatch.setattr(pdf_processor, 'convert_to_html', pipeline.convert_to_html)
+    monkeypatch.setattr(pdf_processor, 'start_html_conversion', lambda pdf_path, html_dir: None)
+    monkeypatch.setattr(pdf_processor, 'oversized_pages', lambda pdf_path, dpi: (None, {}))
+    monkeypatch.setattr(pdf_processor, 'iter_pdf_pages', pipeline.iter_pdf_pages)
+    monkeypatch.setattr(pdf_processor, 'iter_figures_and_captions', pipeline.iter_figures_and_captions)
+
+
+@pytest.fixture
+def pdf(config, monkeypatch):
+    for name, value in (('CHECKPOINTS', True), ('RESUME', True), ('CACHE_ENABLED', False),
+                        ('INDEX_ENABLED', False), ('DEDUP_ENABLED', False), ('PAGE_SELECTION', 'all')):
+        monkeypatch.setattr(config, name, value)
+    path = os.path.join(config.INPUT_DIR, 'doc.pdf')
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.4 test')
+    return path
+
+
+def test_resume_processes_only_the_remaining_pages(config, monkeypatch, pdf):
+    first = Pipeline(interrupt_at=3)
+    install(monkeypatch, first)
+    with pytest.raises(RuntimeError):
+        process_pdf(pdf)
+    assert first.rendered == [1, 2, 3]
+    assert not os.path.exists(os.path.join(config.OUTPUT_DIR, 'doc', 'metadata.json'))
+
+    second = Pipeline()
+    install(monkeypatch, second)
+    data = process_pdf(pdf)
+
+    assert second.rendered == [3, 4]
+    entry = data['doc.pdf']
+    assert entry['pages_annotated'] == [1, 2, 3, 4]
+    assert [(f['page'], f['image_file']) for f in entry['figures']] == [
+        (page_num, f'page_{page_num}_figure_1.jpg') for page_num in range(1, PAGES + 1)
+    ]
+    with open(os.path.join(config.OUTPUT_DIR, 'doc', 'metadata.json'), encoding='utf-8') as f:
+        assert json.load(f) == data
+
+    # A finished PDF is skipped entirely
+    third = Pipeline()
+    install(monkeypatch, third)
+    assert process_pdf(pdf) == data
+    assert third.rendered == []
+
+
+def test_changed_settings_start_over(config, monkeypatch, pdf):
+    install(monkeypatch, Pipeline(interrupt_at=3))
+    with pytest.raises(RuntimeError):
+        process_pdf(pdf)
+
+    # Another output format changes the results key, so the old progress is discarded
+    monkeypatch.setattr(config, 'FIGURE_FORMAT', 'png')
+    rerun = Pipeline()
+    install(monkeypatch, rerun)
+    process_pdf(pdf)
+    assert rerun.rendered == [1, 2, 3, 4]
+
+
+def test_pages_are_appended_and_compacted_on_finish(tmp_path):
+    checkpoint = PdfCheckpoint(str(tmp_path), 'key')
+    for page_num in range(1, 4):
+        checkpoint.page_done(page_num, [{'page': page_num}])
+    # Recording a page appends one line instead of rewriting the manifest
+    assert not (tmp_path / MANIFEST_NAME).exists()
+    assert len((tmp_path / PAGE_LOG_NAME).read_text().splitlines()) == 4
+
+    checkpoint.finish()
+    assert not (tmp_path / PAGE_LOG_NAME).exists()
+    reopened = PdfCheckpoint(str(tmp_path), 'key', resume=True)
+    assert reopened.complete
+    assert reopened.completed_pages() == {n: [{'page': n}] for n in range(1, 4)}
+
+
+def test_resume_merges_the_log_and_ignores_a_torn_line(tmp_path):
+    checkpoint = PdfCheckpoint(str(tmp_path), 'key')
+    checkpoint.page_done(1, [])
+    checkpoint.page_done(2, [{'page': 2}])
+    # A crash mid-append leaves a partial last line
+    with open(tmp_path / PAGE_LOG_NAME, 'a') as f:
+        f.write('{"page": 3, "fig')
+
+    resumed = PdfCheckpoint(str(tmp_path), 'key', resume=True)
+    assert not resumed.complete
+    assert resumed.completed_pages() == {1: [], 2: [{'page': 2}]}
+    resumed.page_done(3, [])
+    assert PdfCheckpoint(str(tmp_path), 'key', resume=True).completed_pages() == {1: [], 2: [{'page': 2}], 3: []}
+
+    # Opening without resume starts over
+    PdfCheckpoint(str(tmp_path), 'key')
+    assert PdfCheckpoint(str(tmp_path), 'key', resume=True).completed_pages() == {}
+
+
+def test_another_key_starts_over(tmp_path):
+    checkpoint = PdfCheckpoint(str(tmp_path), 'key')
+    checkpoint.page_done(1, [])
+    checkpoint.finish()
+
+    other = PdfCheckpoint(str(tmp_path), 'other', resume=True)
+    assert not other.complete
+    assert other.completed_pages() == {}
@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import threading
+
+from figextractor.core import batch, daemon
+from figextractor.core.daemon import WatchDaemon
+
+
+def fake_run_one(pdf_path):
+    """Stand-in for batch._run_one: poison PDFs kill their worker process."""
+    time.sleep(0.2)
+    if 'poison' in os.path.basename(pdf_path):
+        os._exit(1)
+    return {'pdf': pdf_path, 'status': 'ok', 'figures': 1, 'seconds': 0.2, 'worker': os.getpid(), 'tools': {},
+            'metrics': {'wall_seconds': 0.2, 'pages': 1, 'figures': 1, 'stages': {}}}
+
+
+def write_pdf(config, name, content=b'%PDF-1.4\n'):
+    path = os.path.join(config.INPUT_DIR, name)
+    with open(path, 'ab') as f:
+        f.write(content)
+    return path
+
+
+def run_until(watcher, count):
+    """Run the daemon on a thread until count PDFs have finished, then stop it."""
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    try:
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            stats = watcher.stats()
+            if stats['processed'] + stats['failed'] == count:
+                break
+            time.sleep(0.1)
+    finally:
+        watcher.stop()
+        thread.join(30)
+    return watcher.stats()
+
+
+def test_full_queue_defers_settled_files(config):
+    watcher = WatchDaemon(settle_seconds=0, queue_size=2)
+    paths = [write_pdf(config, f'{name}.pdf') for name in 'abcd']
+
+    assert watcher.scan() == []  # first sighting only starts the settle clock
+    queued = watcher.scan()
+    assert len(queued) == 2 and watcher.queue.qsize() == 2
+
+    # The rest wait as settled candidates until there is room
+    assert watcher.scan() == []
+    watcher.queue.get_nowait()
+    later = watcher.scan()
+    assert len(later) == 1
+    assert len(set(queued + later)) == 3 and set(queued + later) <= set(paths)
+
+
+def test_files_still_being_written_are_left_alone(config):
+    watcher = WatchDaemon(settle_seconds=0)
+    path = write_pdf(config, 'growing.pdf')
+    write_pdf(config, 'empty.pdf', b'')
+
+    assert watcher.scan() == []
+    write_pdf(config, 'growing.pdf', b'more bytes')
+    assert watcher.scan() == []  # changed since the last scan
+    assert watcher.scan() == [path]  # unchanged now; the empty file never is queued
+    assert watcher.scan() == []  # and is not queued twice
+
+
+def test_crashing_pdf_only_fails_itself(config, fork_workers, monkeypatch):
+    monkeypatch.setattr(batch, '_run_one', fake_run_one)
+    monkeypatch.setattr(daemon, '_run_one', fake_run_one)
+    for name in ('a', 'poison', 'b', 'c'):
+        write_pdf(config, f'{name}.pdf')
+    watcher = WatchDaemon(workers=2, poll_interval=0.1, settle_seconds=0, retries=0)
+
+    stats = run_until(watcher, 4)
+    assert (stats['processed'], stats['failed']) == (3, 1)
+
+
+def test_metrics_are_written_as_pdfs_finish(config, monkeypatch):
+    monkeypatch.setattr(config, 'METRICS_ENABLED', True)
+    monkeypatch.setattr(config, 'METRICS_FORMAT', 'jsonl')
+    monkeypatch.setattr(daemon, '_run_one', fake_run_one)
+    path = os.path.join(config.OUTPUT_DIR, 'metrics.jsonl')
+    watcher = WatchDaemon(workers=1, poll_interval=0.1, settle_seconds=0)
+
+    write_pdf(config, 'a.pdf')
+    thread = threading.Thread(target=run_until, args=(watcher, 2))
+    thread.start()
+    try:
+        # The first PDF's line is there before the daemon stops
+        deadline = time.time() + 30
+        while not os.path.exists(path) and time.time() < deadline:
+            time.sleep(0.05)
+        with open(path, encoding='utf-8') as f:
+            assert [json.loads(line)['pdf'] for line in f] == ['a.pdf']
+        write_pdf(config, 'b.pdf')
+    finally:
+        thread.join(60)
+
+    with open(path, encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert [(line['type'], line.get('pdf')) for line in lines] == [('pdf', 'a.pdf'), ('pdf', 'b.pdf'), ('run', None)]
+    assert lines[0]['pages'] == 1
+    assert (lines[2]['total'], lines[2]['succeeded'], lines[2]['figures']) == (2, 2, 2)
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from figextractor.core.dedup import FigureDeduplicator
+from figextractor.core.index import FigureIndex
+from figextractor.core.writer import ArtifactWriter
+
+
+class FailingFigure:
+    """Figure whose pixels cannot be produced, like a failed region render."""
+
+    def encode(self, ext, quality=None):
+        raise ValueError("render failed")
+
+    def release(self):
+        pass
+
+
+@pytest.fixture
+def deduper(config, tmp_path):
+    return FigureDeduplicator(FigureIndex(str(tmp_path / 'index.sqlite')), max_distance=4,
+                              output_root=config.OUTPUT_DIR)
+
+
+def write_image(root, image):
+    path = os.path.join(root, image)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'image')
+
+
+def test_failed_write_is_not_a_duplicate_target(config, deduper):
+    image = 'a/page_1_figure_1.jpg'
+    deduper.register(0x0F0F, 100, 50, image)
+    assert deduper.find(0x0F0F, 100, 50) == (image, 0)
+
+    with pytest.raises(ValueError):
+        with ArtifactWriter(figure_format='jpeg') as writer:
+            writer.submit_figure(FailingFigure(), os.path.join(config.OUTPUT_DIR, 'a', 'page_1_figure_1'))
+            writer.when_written(lambda: deduper.persist(0x0F0F, 100, 50, image),
+                                on_error=lambda: deduper.discard(image))
+
+    assert deduper.find(0x0F0F, 100, 50) is None
+
+
+def test_registering_a_path_again_replaces_its_hash(config, deduper):
+    image = 'a/page_1_figure_1.jpg'
+    deduper.register(0x0F0F, 100, 50, image)
+    write_image(config.OUTPUT_DIR, image)
+    deduper.persist(0x0F0F, 100, 50, image)
+
+    # The PDF is reprocessed and the path now holds a different figure
+    deduper.register(0xF0F0F0F0, 100, 50, image)
+    write_image(config.OUTPUT_DIR, image)
+    deduper.persist(0xF0F0F0F0, 100, 50, image)
+
+    assert deduper.find(0x0F0F, 100, 50) is None
+    assert deduper.find(0xF0F0F0F0, 100, 50) == (image, 0)
+
+    # A second process reads the latest hash from the index
+    other = FigureDeduplicator(deduper.index, max_distance=4, output_root=config.OUTPUT_DIR)
+    assert other.find(0x0F0F, 100, 50) is None
+    assert other.find(0xF0F0F0F0, 100, 50) == (image, 0)
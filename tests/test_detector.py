@@ -0,0 +1,98 @@
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from figextractor.core.detector import (
+    detect_figure_boxes, detect_figure_boxes_batch, detect_figure_boxes_tiled, merge_boxes
+)
+
+
+def reference_merge(boxes, gap):
+    """Merge pairs one at a time until no two gap-expanded boxes touch."""
+    boxes = [list(box) for box in boxes]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                (x1, y1, w1, h1), (x2, y2, w2, h2) = boxes[i], boxes[j]
+                if (min(x1 + w1, x2 + w2) + 2 * gap >= max(x1, x2)
+                        and min(y1 + h1, y2 + h2) + 2 * gap >= max(y1, y2)):
+                    x0, y0 = min(x1, x2), min(y1, y2)
+                    boxes[i] = [x0, y0, max(x1 + w1, x2 + w2) - x0, max(y1 + h1, y2 + h2) - y0]
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return sorted(map(tuple, boxes))
+
+
+def test_merge_matches_pairwise_reference():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        count = int(rng.integers(1, 60))
+        boxes = np.stack([rng.integers(0, 1000, count), rng.integers(0, 1000, count),
+                          rng.integers(1, 80, count), rng.integers(1, 80, count)], axis=1)
+        gap = int(rng.integers(0, 20))
+        assert sorted(map(tuple, merge_boxes(boxes, gap).tolist())) == reference_merge(boxes.tolist(), gap)
+
+
+def test_merge_memory_grows_linearly():
+    # A dense page: 5000 glyph-sized components on a grid
+    xs, ys = np.meshgrid(np.arange(50) * 40, np.arange(100) * 40)
+    boxes = np.stack([xs.ravel(), ys.ravel(), np.full(xs.size, 10), np.full(xs.size, 10)], axis=1)
+    # Full-width rules, which every box in a sweep overlaps along x
+    rules = np.stack([np.zeros(2000, int), np.arange(2000) * 20, np.full(2000, 3000), np.full(2000, 5)], axis=1)
+
+    for page, gap, expected in ((boxes, 4, len(boxes)), (boxes, 16, 1), (rules, 2, len(rules))):
+        tracemalloc.start()
+        try:
+            merged = merge_boxes(page, gap)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert len(merged) == expected
+        # The dense pairwise matrices took over 1 GB here
+        assert peak < 64 * 1024 ** 2
+
+
+def synthetic_page():
+    """A page with a bar chart, its tick labels, and a paragraph of text below."""
+    page = np.full((1100, 850), 255, dtype=np.uint8)
+    # Axes, bars and tick labels
+    cv2.line(page, (150, 150), (150, 450), 0, 2)
+    cv2.line(page, (150, 450), (600, 450), 0, 2)
+    for i, height in enumerate((120, 250, 80, 200)):
+        cv2.rectangle(page, (190 + i * 100, 450 - height), (250 + i * 100, 450), 60, -1)
+        cv2.putText(page, str(i), (212 + i * 100, 475), cv2.FONT_HERSHEY_SIMPLEX, 0.6, 0, 1)
+    # Body text, well away from the chart
+    for row in range(8):
+        cv2.putText(page, 'the quick brown fox jumps over the lazy dog', (100, 600 + row * 30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, 0, 1)
+    return page
+
+
+def test_chart_is_one_figure_and_text_is_none():
+    boxes = detect_figure_boxes(synthetic_page(), min_size=100, threshold=240, merge_gap=24,
+                                min_overlap=0.0, seed_fraction=0.25)
+
+    assert len(boxes) == 1
+    x, y, w, h = boxes[0].tolist()
+    # The axes, the bars and the tick labels under the axis, but no body text
+    assert x <= 149 and y <= 150 and x + w >= 601
+    assert 475 <= y + h < 580
+
+
+def test_tiled_and_batched_detection_agree():
+    page = synthetic_page()
+    options = dict(min_size=100, threshold=240, merge_gap=24, min_overlap=0.0, seed_fraction=0.25)
+    whole = detect_figure_boxes(page, **options)
+
+    # Bands cut through the bars and the axis
+    bands = ((y, page[y:y + 170]) for y in range(0, page.shape[0], 170))
+    assert np.array_equal(detect_figure_boxes_tiled(bands, **options), whole)
+    batched = detect_figure_boxes_batch([page, page[:, ::-1].copy()], **options)
+    assert np.array_equal(batched[0], whole)
+    assert np.array_equal(batched[1], detect_figure_boxes(page[:, ::-1].copy(), **options))
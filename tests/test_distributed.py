@@ -0,0 +1,120 @@
+import os
+import glob
+import json
+import time
+import multiprocessing
+
+from figextractor.core import batch, distributed
+from figextractor.core.distributed import LeaseQueue, run_distributed
+
+
+def fake_run_one(pdf_path):
+    """Stand-in for batch._run_one: poison PDFs kill their worker process."""
+    time.sleep(0.05)
+    if 'poison' in os.path.basename(pdf_path):
+        os._exit(1)
+    return {'pdf': pdf_path, 'status': 'ok', 'figures': 1, 'seconds': 0.05, 'worker': os.getpid(), 'tools': {}}
+
+
+def run_node(pdfs, queue_dir, node, summary_path):
+    run_distributed(pdfs, workers=2, retries=0, summary_path=summary_path,
+                    queue=LeaseQueue(queue_dir, node=node))
+
+
+def test_nodes_share_the_work(config, fork_workers, monkeypatch, tmp_path):
+    monkeypatch.setattr(batch, '_run_one', fake_run_one)
+    monkeypatch.setattr(distributed, '_run_one', fake_run_one)
+    monkeypatch.setattr(config, 'QUEUE_POLL_INTERVAL', 0.1)
+    monkeypatch.setattr(config, 'LEASE_HEARTBEAT', 0.1)
+    queue_dir = str(tmp_path / 'queue')
+    names = [f'doc{i:02d}.pdf' for i in range(12)] + ['doc05-poison.pdf']
+    pdfs = [os.path.join(config.INPUT_DIR, name) for name in names]
+
+    nodes = [
+        multiprocessing.Process(target=run_node, args=(pdfs, queue_dir, f'node{i}', str(tmp_path / f'node{i}.json')))
+        for i in range(3)
+    ]
+    for node in nodes:
+        node.start()
+    for node in nodes:
+        node.join(60)
+        assert node.exitcode == 0
+
+    # Every PDF was processed by exactly one node
+    processed = []
+    for i in range(3):
+        with open(tmp_path / f'node{i}.json', encoding='utf-8') as f:
+            processed += [os.path.basename(r['pdf']) for r in json.load(f)['results']]
+    assert sorted(processed) == sorted(names)
+
+    done = {}
+    for path in glob.glob(os.path.join(queue_dir, 'done', '*.json')):
+        with open(path, encoding='utf-8') as f:
+            record = json.load(f)
+        done[os.path.basename(record['pdf'])] = record
+    assert sorted(done) == sorted(names)
+    assert done['doc05-poison.pdf']['status'] == 'failed'
+    assert all(done[name]['status'] == 'ok' and done[name]['attempts'] == 1 for name in names if 'poison' not in name)
+    assert not glob.glob(os.path.join(queue_dir, 'leases', '*.lease'))
+
+    # A finished queue gives later nodes nothing to do
+    summary = run_distributed(pdfs, workers=2, queue=LeaseQueue(queue_dir, node='late'))
+    assert summary['total'] == 0 and summary['skipped'] == len(names)
+
+
+def test_expired_lease_is_taken_over(config, tmp_path):
+    queue_dir = str(tmp_path / 'queue')
+    pdf = os.path.join(config.INPUT_DIR, 'doc.pdf')
+    first = LeaseQueue(queue_dir, node='first', ttl=0.5)
+    second = LeaseQueue(queue_dir, node='second', ttl=0.5)
+
+    assert first.claim(pdf) == 1
+    assert second.claim(pdf) is None
+
+    # The first node stops renewing, as if it had crashed
+    time.sleep(1.2)
+    assert second.claim(pdf) == 2
+    assert first.renew() == [first.key(pdf)]
+
+    second.complete(pdf, {'pdf': pdf, 'status': 'ok'})
+    assert first.is_done(pdf)
+    assert first.claim(pdf) is None
+    second.close()
+    first.close()
+
+
+def expire_lease(queue_dir, pdf):
+    """Leave a lease behind as a node that died holding it would."""
+    dead = LeaseQueue(queue_dir, node='dead', ttl=0.5)
+    assert dead.claim(pdf) is not None
+    time.sleep(1.2)
+
+
+def test_pdf_of_a_dead_node_is_processed(config, monkeypatch, tmp_path):
+    monkeypatch.setattr(distributed, '_run_one', fake_run_one)
+    monkeypatch.setattr(config, 'QUEUE_POLL_INTERVAL', 0.1)
+    queue_dir = str(tmp_path / 'queue')
+    pdf = os.path.join(config.INPUT_DIR, 'doc.pdf')
+    expire_lease(queue_dir, pdf)
+
+    # The dead node's run does not use up the retries
+    summary = run_distributed([pdf], workers=1, retries=0, queue=LeaseQueue(queue_dir, node='live', ttl=0.5))
+    result, = summary['results']
+    assert result['status'] == 'ok' and result['attempts'] == 1
+    with open(glob.glob(os.path.join(queue_dir, 'done', '*.json'))[0], encoding='utf-8') as f:
+        record = json.load(f)
+    assert record['status'] == 'ok' and record['attempts'] == 1
+
+
+def test_pdf_that_keeps_killing_nodes_is_abandoned(config, monkeypatch, tmp_path):
+    monkeypatch.setattr(distributed, '_run_one', fake_run_one)
+    monkeypatch.setattr(config, 'QUEUE_POLL_INTERVAL', 0.1)
+    monkeypatch.setattr(config, 'LEASE_MAX_TAKEOVERS', 1)
+    queue_dir = str(tmp_path / 'queue')
+    pdf = os.path.join(config.INPUT_DIR, 'doc.pdf')
+    expire_lease(queue_dir, pdf)
+
+    summary = run_distributed([pdf], workers=1, retries=0, queue=LeaseQueue(queue_dir, node='live', ttl=0.5))
+    result, = summary['results']
+    assert result['status'] == 'failed' and result['failure'] == 'lease'
+    assert LeaseQueue(queue_dir, node='late').is_done(pdf)
@@ -0,0 +1,154 @@
+import os
+import sys
+import time
+
+import pytest
+
+from figextractor.core import html_converter
+from figextractor.core.html_converter import ShardedHtmlConversion, shard_ranges, start_html_conversion
+from figextractor.utils.supervisor import ToolError
+
+# Writes pageN.html for -f..-l plus the per-call index.html and font file, once
+# $GATE_DIR/<first page> exists; fails for the range holding $FAIL_PAGE
+FAKE_PDFTOHTML = '''\
+import os, sys, time
+args = sys.argv[1:]
+first, last = int(args[args.index('-f') + 1]), int(args[args.index('-l') + 1])
+output = args[-1]
+gate = os.path.join(os.environ['GATE_DIR'], str(first))
+while not os.path.exists(gate):
+    time.sleep(0.01)
+if first <= int(os.environ.get('FAIL_PAGE', 0)) <= last:
+    sys.stderr.write('Error: damaged page\\n')
+    sys.exit(1)
+os.makedirs(output)
+for page in range(first, last + 1):
+    with open(os.path.join(output, f'page{page}.html'), 'w') as f:
+        f.write(f'page {page}')
+for name in ('index.html', 'ff1.otf'):
+    with open(os.path.join(output, name), 'w') as f:
+        f.write(f'{first}-{last}')
+'''
+
+
+@pytest.fixture
+def pdftohtml(config, monkeypatch, tmp_path):
+    """Install the fake pdftohtml; returns a function that lets the shard starting at a page run."""
+    script = tmp_path / 'pdftohtml'
+    script.write_text(f'#!{sys.executable}\n' + FAKE_PDFTOHTML)
+    script.chmod(0o755)
+    gates = tmp_path / 'gates'
+    gates.mkdir()
+    monkeypatch.setattr(config, 'XPDF_PATH', str(script))
+    monkeypatch.setenv('GATE_DIR', str(gates))
+
+    def release(*first_pages):
+        for first in first_pages:
+            (gates / str(first)).touch()
+    return release
+
+
+def pages_in(path):
+    return sorted(int(name[4:-5]) for name in os.listdir(path) if name.startswith('page'))
+
+
+def test_shard_ranges():
+    assert shard_ranges(7, 3) == [(1, 3), (4, 6), (7, 7)]
+    assert shard_ranges(6, 3) == [(1, 3), (4, 6)]
+    assert shard_ranges(2, 16) == [(1, 2)]
+
+
+def test_shards_merge_into_one_page_layout(pdftohtml, tmp_path):
+    output = tmp_path / 'html'
+    output.mkdir()
+    (output / 'stale.html').write_text('from an earlier run')
+
+    conversion = ShardedHtmlConversion('doc.pdf', str(output), page_count=7, shard_pages=3, workers=3)
+    try:
+        # Shards finish in reverse order
+        for first in (7, 4, 1):
+            pdftohtml(first)
+            conversion.wait_page(first)
+        conversion.wait()
+    finally:
+        conversion.close()
+
+    assert pages_in(output) == list(range(1, 8))
+    assert (output / 'page5.html').read_text() == 'page 5'
+    assert not (output / 'stale.html').exists()
+    # Files every call writes come from the first shard, whose font numbering page 1 uses
+    assert (output / 'index.html').read_text() == '1-3'
+    assert (output / 'ff1.otf').read_text() == '1-3'
+    assert not os.path.exists(str(output) + '.shards')
+
+
+def test_wait_page_returns_once_its_shard_is_merged(pdftohtml, tmp_path):
+    output = tmp_path / 'html'
+    conversion = ShardedHtmlConversion('doc.pdf', str(output), page_count=7, shard_pages=3, workers=3)
+    try:
+        pdftohtml(1)
+        conversion.wait_page(2)
+        assert pages_in(output) == [1, 2, 3]
+
+        # Later shards are still held back, so their pages are not there yet
+        time.sleep(0.2)
+        assert pages_in(output) == [1, 2, 3]
+
+        pdftohtml(7)
+        conversion.wait_page(7)
+        assert pages_in(output) == [1, 2, 3, 7]
+
+        pdftohtml(4)
+        conversion.wait_page(4)
+        # Pages past the end do not wait for anything
+        conversion.wait_page(8)
+        conversion.wait()
+        assert pages_in(output) == list(range(1, 8))
+        assert (output / 'index.html').read_text() == '1-3'
+    finally:
+        conversion.close()
+
+
+def test_failed_shard_raises_for_its_pages_only(config, monkeypatch, pdftohtml, tmp_path):
+    monkeypatch.setattr(config, 'TOOL_RETRIES', 1)
+    monkeypatch.setenv('FAIL_PAGE', '5')
+    output = tmp_path / 'html'
+    conversion = ShardedHtmlConversion('doc.pdf', str(output), page_count=7, shard_pages=3, workers=3)
+    pdftohtml(1, 4, 7)
+    try:
+        conversion.wait_page(1)
+        conversion.wait_page(7)
+        with pytest.raises(ToolError) as excinfo:
+            conversion.wait_page(5)
+        # An ordinary error exit is not retried
+        assert (excinfo.value.kind, excinfo.value.retryable) == ('error', False)
+        assert 'damaged page' in str(excinfo.value)
+        with pytest.raises(ToolError):
+            conversion.wait()
+    finally:
+        conversion.close()
+    assert pages_in(output) == [1, 2, 3, 7]
+
+
+def test_sharding_applies_to_long_documents_only(config, monkeypatch, pdftohtml, tmp_path):
+    monkeypatch.setattr(config, 'HTML_SHARD_PAGES', 3)
+    monkeypatch.setattr(html_converter, 'pdf_page_count', lambda pdf_path: 3)
+    output = str(tmp_path / 'html')
+
+    monkeypatch.setattr(config, 'HTML_WORKERS', 1)
+    assert start_html_conversion('doc.pdf', output) is None
+    monkeypatch.setattr(config, 'HTML_WORKERS', 2)
+    assert start_html_conversion('doc.pdf', output) is None
+    monkeypatch.setattr(config, 'CAPTION_BACKEND', 'selenium')
+    monkeypatch.setattr(html_converter, 'pdf_page_count', lambda pdf_path: 4)
+    assert start_html_conversion('doc.pdf', output) is None
+
+    monkeypatch.setattr(config, 'CAPTION_BACKEND', 'lxml')
+    conversion = start_html_conversion('doc.pdf', output)
+    pdftohtml(1, 4)
+    try:
+        assert conversion.ranges == [(1, 3), (4, 4)]
+        conversion.wait()
+    finally:
+        conversion.close()
+    assert pages_in(output) == [1, 2, 3, 4]
@@ -0,0 +1,44 @@
+import sqlite3
+
+import pytest
+
+from figextractor.core.index import FigureIndex, fts_quote
+
+
+@pytest.fixture
+def index(config, tmp_path):
+    index = FigureIndex(str(tmp_path / 'index.sqlite'))
+    if not index.fts:
+        pytest.skip("SQLite without FTS5")
+    index.index_document('paper.pdf', {
+        'figures': [
+            {'page': 1, 'figure_number': 1, 'region_bb': [0, 0, 10, 10], 'caption_text': 'Fig. 3. The cell-cycle kinase',
+             'caption_bb': None, 'image_file': None},
+            {'page': 2, 'figure_number': 1, 'region_bb': [0, 0, 10, 10], 'caption_text': 'Figure 4: A kinase inhibitor',
+             'caption_bb': None, 'image_file': None},
+        ],
+        'pages_annotated': [1, 2]
+    }, config.OUTPUT_DIR)
+    return index
+
+
+def test_fts_quote():
+    assert fts_quote('cell-cycle  Fig. 3') == '"cell-cycle" "Fig." "3"'
+    assert fts_quote('say "hi"') == '"say" """hi"""'
+
+
+@pytest.mark.parametrize('query, pages', [
+    ('cell-cycle', [1]),
+    ('Fig. 3', [1]),
+    ('kinase', [1, 2]),
+    ('"quoted', []),
+    ('', []),
+])
+def test_free_text_queries(index, query, pages):
+    assert sorted(result['page'] for result in index.search(query)) == pages
+
+
+def test_raw_queries(index):
+    assert [result['page'] for result in index.search('inhibit*', raw=True)] == [2]
+    with pytest.raises(sqlite3.OperationalError):
+        index.search('Fig. 3', raw=True)
@@ -0,0 +1,57 @@
+from itertools import permutations
+
+import numpy as np
+
+from figextractor.core.matcher import linear_sum_assignment, match_page
+
+
+def brute_force_cost(cost):
+    """Lowest total over every way of giving each row of the smaller side its own column."""
+    if cost.shape[0] > cost.shape[1]:
+        cost = cost.T
+    rows = range(cost.shape[0])
+    return min(cost[rows, list(cols)].sum() for cols in permutations(range(cost.shape[1]), cost.shape[0]))
+
+
+def test_assignment_is_optimal():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        shape = tuple(rng.integers(1, 7, size=2))
+        # Small integers give plenty of ties
+        cost = rng.integers(0, 10, size=shape).astype(float)
+
+        rows, cols = linear_sum_assignment(cost)
+
+        assert len(rows) == min(shape)
+        assert len(set(rows.tolist())) == len(set(cols.tolist())) == len(rows)
+        assert list(rows) == sorted(rows)
+        assert cost[rows, cols].sum() == brute_force_cost(cost)
+
+
+def test_empty_assignment():
+    rows, cols = linear_sum_assignment(np.zeros((0, 3)))
+    assert len(rows) == len(cols) == 0
+
+
+def test_early_figure_does_not_take_a_later_figures_caption():
+    figures = [(0, 0, 100, 100), (0, 122, 100, 100)]
+    captions = [
+        (115, 0, 50, 10),  # right of the first figure, 15 px away, out of reach of the second
+        (0, 110, 100, 2),  # between the figures, 10 px from each
+    ]
+    # A greedy pass gives the first figure the nearer shared caption and the second none
+    matches = match_page(figures, captions, threshold=50, above_penalty=1.0, side_penalty=1.0)
+    assert matches.tolist() == [0, 1]
+
+
+def test_layout_priors_and_threshold():
+    figure = [(100, 100, 200, 100)]
+    above = (100, 80, 200, 10)  # 10 px above the figure
+    below = (100, 211, 200, 10)  # 11 px below it
+    assert match_page(figure, [above, below], threshold=50, above_penalty=1.25).tolist() == [1]
+    assert match_page(figure, [above, below], threshold=50, above_penalty=1.0).tolist() == [0]
+
+    far = (100, 400, 200, 10)
+    assert match_page(figure, [far], threshold=50).tolist() == [-1]
+    assert match_page(figure, [], threshold=50).tolist() == [-1]
+    assert match_page([], [below], threshold=50).tolist() == []
@@ -0,0 +1,24 @@
+import sys
+import subprocess
+
+from figextractor.utils.metrics import PdfMetrics
+
+# Spins for a fixed amount of CPU time rather than wall time
+BUSY_CHILD = 'import time\nwhile time.process_time() < 0.5: pass'
+
+
+def test_tool_cpu_is_counted_per_pdf_not_per_stage():
+    metrics = PdfMetrics('a.pdf')
+    with metrics.stage('render'):
+        subprocess.run([sys.executable, '-c', BUSY_CHILD], check=True)
+    with metrics.stage('html'):
+        pass
+
+    result = metrics.finish(pages=1, figures=0)
+
+    # os.times counts child CPU in clock ticks
+    assert result['tools_cpu_seconds'] >= 0.45
+    # Only the thread's own CPU counts towards a stage
+    assert result['stages']['render']['cpu_seconds'] < 0.3
+    assert result['stages']['render']['calls'] == result['stages']['html']['calls'] == 1
+    assert result['stages']['render']['wall_seconds'] >= 0.5
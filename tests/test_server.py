@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from figextractor.core import server as server_module
+from figextractor.core.server import ExtractionService, ExtractionHandler
+
+
+@pytest.fixture
+def server(config):
+    """Serve a one-slot service with no queue on an ephemeral port."""
+    service = ExtractionService(max_concurrency=1, queue_size=0, path_roots=[config.INPUT_DIR])
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ExtractionHandler)
+    httpd.service = service
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    service.close()
+    thread.join()
+
+
+def fake_extract(pdf_path):
+    """Stand-in for server._extract: writes one figure and its caption."""
+    from config import Config
+    output_dir = os.path.join(Config.OUTPUT_DIR, os.path.splitext(os.path.basename(pdf_path))[0])
+    os.makedirs(output_dir, exist_ok=True)
+    for name, content in (('page_1_figure_1.jpg', 'image'), ('page_1_caption_1.txt', 'Figure 1'),
+                          ('metadata.json', '{}')):
+        with open(os.path.join(output_dir, name), 'w') as f:
+            f.write(content)
+    figure = {'page': 1, 'figure_number': 1, 'region_bb': [0, 0, 10, 10], 'caption_text': 'Figure 1',
+              'caption_bb': [0, 12, 10, 2], 'image_file': 'page_1_figure_1.jpg'}
+    return {'figures': [figure], 'pages_annotated': [1], 'metrics': {'wall_seconds': 0.1, 'stages': {}}}
+
+
+def request(httpd, path, payload=None, body=None, content_type='application/json'):
+    """Send a GET, or a POST of payload as JSON or of raw body; return status, headers and body."""
+    url = f'http://127.0.0.1:{httpd.server_address[1]}{path}'
+    data = json.dumps(payload).encode('utf-8') if payload is not None else body
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': content_type})
+    try:
+        with urllib.request.urlopen(req, timeout=10) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def wait_for(condition, timeout=5):
+    """Poll until condition() holds, for work finishing on another thread."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting"
+        time.sleep(0.01)
+
+
+def test_health_reports_capacity(server):
+    status, _, body = request(server, '/health')
+    assert status == 200
+    stats = json.loads(body)
+    assert stats['status'] == 'ok'
+    assert (stats['max_concurrency'], stats['queue_size']) == (1, 0)
+    assert (stats['running'], stats['queued']) == (0, 0)
+
+
+def test_full_service_refuses_with_retry_after(config, server):
+    pdf = config.INPUT_DIR + '/a.pdf'
+    open(pdf, 'wb').close()
+    server.service.admit()
+    try:
+        status, headers, body = request(server, '/extract', {'path': pdf})
+    finally:
+        server.service.release()
+    assert status == 429
+    assert int(headers['Retry-After']) >= 1
+    assert 'error' in json.loads(body)
+
+    _, _, metrics = request(server, '/metrics')
+    assert b'figextractor_http_requests_total{endpoint="extract",code="429"} 1' in metrics
+
+
+def test_paths_outside_roots_are_refused(config, server, tmp_path):
+    outside = tmp_path / 'secret.pdf'
+    outside.write_bytes(b'%PDF-1.4')
+    escape = config.INPUT_DIR + '/../secret.pdf'
+    for path in (str(outside), escape):
+        status, _, body = request(server, '/extract', {'path': path})
+        assert status == 403, path
+        assert 'outside' in json.loads(body)['error']
+
+    # A refused request gives its admission slot back
+    assert request(server, '/extract', {'path': config.INPUT_DIR + '/missing.pdf'})[0] == 404
+
+
+def test_only_the_jobs_artefacts_are_served(config, fork_workers, monkeypatch, server):
+    monkeypatch.setattr(server_module, '_extract', fake_extract)
+    pdf = config.INPUT_DIR + '/a.pdf'
+    open(pdf, 'wb').close()
+    with open(os.path.join(config.OUTPUT_DIR, 'index.sqlite'), 'w') as f:
+        f.write('private')
+
+    status, _, body = request(server, '/extract', {'path': pdf})
+    assert status == 200
+    url = json.loads(body)['metadata']['figures'][0]['image_url']
+    job = url.split('/')[2]
+    assert request(server, url)[2] == b'image'
+    assert request(server, f'/figures/{job}/a/page_1_caption_1.txt')[2] == b'Figure 1'
+
+    for path in (f'/figures/{job}/a/metadata.json', f'/figures/{job}/index.sqlite',
+                 f'/figures/{job}/a/../index.sqlite', '/figures/a/page_1_figure_1.jpg',
+                 '/figures/index.sqlite', url.replace(job, 'f' * 32)):
+        assert request(server, path)[0] == 404, path
+
+
+def test_upload_output_is_deleted_when_its_urls_expire(config, fork_workers, monkeypatch, server):
+    monkeypatch.setattr(server_module, '_extract', fake_extract)
+    server.service.result_ttl = 0.5
+
+    status, _, body = request(server, '/extract?name=paper.pdf', body=b'%PDF-1.4', content_type='application/pdf')
+    assert status == 200
+    response = json.loads(body)
+    url = response['metadata']['figures'][0]['image_url']
+    assert request(server, url)[0] == 200
+    assert os.path.isdir(response['output_dir'])
+    # The uploaded PDF is removed by the job's done callback, which may lag the response
+    wait_for(lambda: os.listdir(server.service.upload_dir) == [])
+
+    time.sleep(0.6)
+    assert request(server, url)[0] == 404
+    assert not os.path.exists(response['output_dir'])
+
+
+def test_each_jobs_metrics_are_appended(config, fork_workers, monkeypatch, server):
+    monkeypatch.setattr(server_module, '_extract', fake_extract)
+    monkeypatch.setattr(config, 'METRICS_ENABLED', True)
+    monkeypatch.setattr(config, 'METRICS_FORMAT', 'jsonl')
+    pdf = config.INPUT_DIR + '/a.pdf'
+    open(pdf, 'wb').close()
+
+    for _ in range(2):
+        assert request(server, '/extract', {'path': pdf})[0] == 200
+
+    with open(os.path.join(config.OUTPUT_DIR, 'metrics.jsonl'), encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert [(line['type'], line['pdf'], line['wall_seconds']) for line in lines] == [('pdf', 'a.pdf', 0.1)] * 2
@@ -0,0 +1,135 @@
+import sys
+import time
+
+import pytest
+
+from figextractor.core.html_converter import run_pdftohtml
+from figextractor.core.renderer import _with_dpi_fallback
+from figextractor.utils.supervisor import ToolError, run_tool, tool_stats, tool_stats_since
+
+resource = pytest.importorskip('resource')
+
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+
+@pytest.fixture
+def no_limits(config, monkeypatch):
+    monkeypatch.setattr(config, 'TOOL_MEMORY_LIMIT_MB', None)
+    monkeypatch.setattr(config, 'TOOL_CPU_LIMIT_SECONDS', None)
+    return config
+
+
+def test_slow_tool_is_killed_with_a_retryable_timeout(no_limits):
+    before = tool_stats()
+    start = time.monotonic()
+    with pytest.raises(ToolError) as excinfo:
+        run_tool('sleeper', python('import time; time.sleep(30)'), timeout=0.5)
+
+    assert time.monotonic() - start < 10
+    error = excinfo.value
+    assert (error.tool, error.kind, error.retryable) == ('sleeper', 'timeout', True)
+    assert error.returncode < 0
+    stats = tool_stats_since(before)['sleeper']
+    assert (stats['calls'], stats['failures']) == (1, {'timeout': 1})
+
+
+@pytest.mark.parametrize('code, kind, retryable', [
+    ('import sys; sys.stderr.write("Error: bad xref\\n"); sys.exit(3)', 'error', False),
+    ('import sys; sys.stderr.write("GPL Ghostscript: VMerror\\n"); sys.exit(1)', 'memory', True),
+    ('import os, signal; os.kill(os.getpid(), signal.SIGSEGV)', 'crash', True),
+])
+def test_failures_are_classified(no_limits, code, kind, retryable):
+    with pytest.raises(ToolError) as excinfo:
+        run_tool('tool', python(code), timeout=30)
+    assert (excinfo.value.kind, excinfo.value.retryable) == (kind, retryable)
+    if kind == 'error':
+        assert excinfo.value.returncode == 3
+        assert str(excinfo.value).endswith('Error: bad xref')
+
+
+def test_missing_executable(no_limits, tmp_path):
+    with pytest.raises(ToolError) as excinfo:
+        run_tool('tool', [str(tmp_path / 'nonexistent')])
+    assert (excinfo.value.kind, excinfo.value.returncode, excinfo.value.retryable) == ('missing', None, False)
+
+
+def test_success_returns_output(no_limits):
+    completed = run_tool('tool', python('print("ok")'), timeout=30, capture_stdout=True)
+    assert (completed.returncode, completed.stdout.strip()) == (0, b'ok')
+    failed = run_tool('tool', python('import sys; sys.exit(2)'), check=False)
+    assert failed.returncode == 2
+
+
+def test_limits_are_applied_to_the_tool(no_limits):
+    no_limits.TOOL_MEMORY_LIMIT_MB = 1024
+    no_limits.TOOL_CPU_LIMIT_SECONDS = 1
+    completed = run_tool('tool', python(
+        'import resource; print(resource.getrlimit(resource.RLIMIT_AS)[0], resource.getrlimit(resource.RLIMIT_CPU)[0])'
+    ), timeout=30, capture_stdout=True)
+    assert completed.stdout.split() == [str(1024 * 1024 * 1024).encode(), b'1']
+
+    # Allocating past the address-space limit fails inside the tool
+    with pytest.raises(ToolError) as excinfo:
+        run_tool('tool', python('bytearray(2 * 1024 ** 3)'), timeout=30)
+    assert b'MemoryError' in excinfo.value.stderr
+
+    # Spinning past the CPU limit is killed by SIGXCPU
+    with pytest.raises(ToolError) as excinfo:
+        run_tool('tool', python('while True: pass'), timeout=30)
+    assert (excinfo.value.kind, excinfo.value.retryable) == ('cpu', True)
+
+
+def test_render_is_retried_at_a_lower_dpi(config, monkeypatch):
+    monkeypatch.setattr(config, 'TOOL_RETRIES', 1)
+    monkeypatch.setattr(config, 'TOOL_RETRY_DPI_SCALE', 0.5)
+    attempts = []
+
+    def render(dpi, kind='timeout'):
+        attempts.append(dpi)
+        if len(attempts) == 1:
+            raise ToolError('gs', kind, -9, ['gs'])
+        return 'page'
+
+    before = tool_stats()
+    assert _with_dpi_fallback(render, 300) == ('page', 150)
+    assert attempts == [300, 150]
+    assert tool_stats_since(before)['gs']['retries'] == 1
+
+    # Ordinary errors, and failures past TOOL_RETRIES, are raised
+    attempts.clear()
+    with pytest.raises(ToolError):
+        _with_dpi_fallback(lambda dpi: render(dpi, 'error'), 300)
+    assert attempts == [300]
+    monkeypatch.setattr(config, 'TOOL_RETRIES', 0)
+    attempts.clear()
+    with pytest.raises(ToolError):
+        _with_dpi_fallback(render, 300)
+    assert attempts == [300]
+
+
+def test_timed_out_pdftohtml_is_retried(no_limits, monkeypatch, tmp_path):
+    # Hangs on the first call, converts on the second
+    script = tmp_path / 'pdftohtml'
+    script.write_text(f'#!{sys.executable}\n' + '''\
+import os, sys, time
+marker = os.path.join(os.path.dirname(sys.argv[0]), 'called')
+if not os.path.exists(marker):
+    open(marker, 'w').close()
+    time.sleep(30)
+os.makedirs(sys.argv[-1])
+open(os.path.join(sys.argv[-1], 'page1.html'), 'w').close()
+''')
+    script.chmod(0o755)
+    monkeypatch.setattr(no_limits, 'XPDF_PATH', str(script))
+    monkeypatch.setattr(no_limits, 'HTML_TIMEOUT', 1)
+    monkeypatch.setattr(no_limits, 'TOOL_RETRIES', 1)
+    output = tmp_path / 'html'
+
+    before = tool_stats()
+    run_pdftohtml('doc.pdf', str(output))
+
+    assert (output / 'page1.html').exists()
+    stats = tool_stats_since(before)['pdftohtml']
+    assert (stats['calls'], stats['failures'], stats['retries']) == (2, {'timeout': 1}, 1)